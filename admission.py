@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from typing import Deque, Optional, Tuple
+
+from telegram import Bot, ChatJoinRequest
+from telegram.error import TelegramError
+
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+class GroupAdmissions:
+    """Admits approved users to the group through personal invite links and join requests.
+
+    Every link asks to join rather than joining directly (``creates_join_request``),
+    so the bot sees who follows it: a join request is approved only when it comes
+    from a user a link was issued to, and declined otherwise (someone following a
+    forwarded link, or who was never approved). The user's link is revoked once they
+    are admitted, so it works once, and it expires after ``link_ttl`` seconds anyway.
+
+    Links are minted ahead of demand into a pool of ``pool_size``, so approving a
+    user hands out a ready link instead of waiting on the Bot API; links with less
+    than ``min_validity`` seconds left are dropped from the pool and replaced. The
+    link issued to each user is kept in ``store`` until it expires, so with a shared
+    store any worker can admit them.
+    """
+
+    namespace = 'invites'
+
+    def __init__(self, store, limiter: RateLimiter, chat_id: int, pool_size: int = 20,
+                 link_ttl: float = 86400, min_validity: float = 3600):
+        self.store = store
+        self.limiter = limiter
+        self.chat_id = chat_id
+        self.pool_size = pool_size
+        self.link_ttl = link_ttl
+        self.min_validity = min(min_validity, link_ttl / 2)
+        # Minted links not issued yet, as (link, expire timestamp), oldest first
+        self.pool: Deque[Tuple[str, float]] = deque()
+        self._wanted = asyncio.Event()
+        self._refill_task: Optional[asyncio.Task] = None
+        # Links minted, issued from the pool or minted on the spot, and join requests by outcome
+        self.stats: Counter = Counter()
+
+    def start(self, bot: Bot):
+        """Keep the pool filled in the background"""
+        if self._refill_task is None and self.pool_size > 0:
+            self._refill_task = asyncio.get_running_loop().create_task(self._refill(bot))
+
+    async def stop(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+            self._refill_task = None
+
+    async def _mint(self, bot: Bot) -> Tuple[str, float]:
+        expires = time.time() + self.link_ttl
+        link = await self.limiter.call(
+            bot.create_chat_invite_link,
+            self.chat_id,
+            expire_date=int(expires),
+            creates_join_request=True
+        )
+        self.stats['minted'] += 1
+        return link.invite_link, expires
+
+    def _drop_expiring(self):
+        deadline = time.time() + self.min_validity
+        while self.pool and self.pool[0][1] <= deadline:
+            self.pool.popleft()
+
+    async def _refill(self, bot: Bot):
+        while True:
+            self._drop_expiring()
+            while len(self.pool) < self.pool_size:
+                try:
+                    self.pool.append(await self._mint(bot))
+                except TelegramError as e:
+                    logger.error(f"Could not create an invite link for {self.chat_id}, retrying in 30s: {e}")
+                    await asyncio.sleep(30)
+            self._wanted.clear()
+            # Wake up when a link is taken, or when the oldest one is about to be dropped
+            timeout = self.pool[0][1] - self.min_validity - time.time() if self.pool else None
+            try:
+                await asyncio.wait_for(self._wanted.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def issue(self, bot: Bot, user_id: int) -> str:
+        """A personal invite link for an approved user: theirs if still valid, else one from the pool"""
+        link = await asyncio.to_thread(self.store.get, self.namespace, f"user:{user_id}")
+        if link is not None:
+            return link
+        self._drop_expiring()
+        if self.pool:
+            link, expires = self.pool.popleft()
+            self.stats['issued_from_pool'] += 1
+        else:
+            link, expires = await self._mint(bot)
+            self.stats['issued_minted'] += 1
+        self._wanted.set()
+        await asyncio.to_thread(self.store.set, self.namespace, f"user:{user_id}", link, expires - time.time())
+        return link
+
+    async def handle(self, bot: Bot, join_request: ChatJoinRequest) -> bool:
+        """Approve a join request from a user holding an issued link, decline any other"""
+        user_id = join_request.from_user.id
+        link = await asyncio.to_thread(self.store.get, self.namespace, f"user:{user_id}")
+        if link is None:
+            used = join_request.invite_link.invite_link if join_request.invite_link else None
+            self.stats['declined'] += 1
+            logger.info(f"Declining join request from {user_id} through {used}: no link was issued to them")
+            await self.limiter.call(bot.decline_chat_join_request, self.chat_id, user_id=user_id)
+            return False
+        await self.limiter.call(bot.approve_chat_join_request, self.chat_id, user_id=user_id)
+        self.stats['approved'] += 1
+        await asyncio.to_thread(self.store.delete, self.namespace, f"user:{user_id}")
+        try:
+            await self.limiter.call(bot.revoke_chat_invite_link, self.chat_id, invite_link=link)
+        except TelegramError as e:
+            # It still expires, and nobody else can be admitted with it
+            logger.warning(f"Could not revoke invite link {link}: {e}")
+        return True
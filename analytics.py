@@ -0,0 +1,324 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from config import BotStates
+
+logger = logging.getLogger(__name__)
+
+# Onboarding funnel steps, in order, and the states that belong to each
+FUNNEL_STEPS = (
+    ('GREETING', (BotStates.GREETING,)),
+    ('KYC', (BotStates.KYC_QUESTION, BotStates.KYC_YES, BotStates.KYC_NO, BotStates.KYC_COMPLETION)),
+    ('DEPOSIT', (BotStates.DEPOSIT_QUESTION, BotStates.DEPOSIT_YES, BotStates.DEPOSIT_NO)),
+    # Users whose UID was approved on the spot skip COMPLETED, and admin decisions come after it
+    ('COMPLETED', (BotStates.COMPLETED, BotStates.APPROVED, BotStates.REJECTED)),
+)
+
+class DurationSketch:
+    """Approximate percentiles of durations, kept in logarithmic buckets.
+
+    Each bucket spans a factor of ``gamma``, so any percentile is within about 5%
+    of the true value while memory stays at a few hundred buckets at most.
+    """
+
+    gamma = 1.1
+    # Durations below this many seconds share the lowest bucket
+    min_seconds = 0.001
+
+    def __init__(self, buckets: Optional[Dict[int, int]] = None):
+        self.buckets: Dict[int, int] = buckets or {}
+        self.count = sum(self.buckets.values())
+
+    def add(self, seconds: float):
+        index = math.ceil(math.log(max(seconds, self.min_seconds)) / math.log(self.gamma))
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimated q-quantile in seconds, or None without data"""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                break
+        # Midpoint of the bucket (gamma^(index-1), gamma^index]
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+class FunnelAnalytics:
+    """Append-only log of user state changes with the onboarding funnel kept up to date.
+
+    Every state change is appended to ``events_file`` as ``<timestamp> <user_id> <state>``
+    and folded into running totals: users who reached each step, users currently at
+    each step, and how long users took from one step to the next. /stats reads only
+    the totals, so it stays fast however long the log grows. On close the totals are
+    saved with the log offset they cover, and the next start replays only later events.
+
+    Users are counted from their first GREETING; users already past it when analytics
+    started are left out of the funnel.
+
+    With several worker processes, each logs the changes of its own users. Worker
+    ``shard`` of ``shards`` then publishes its totals to ``store`` at most every
+    ``publish_every`` seconds after they change, and the funnel adds up the totals
+    of every worker.
+    """
+
+    # Appended events are flushed to the OS after this many
+    flush_every = 64
+    publish_every = 1.0
+    namespace = 'funnel'
+
+    def __init__(self, events_file: str = "state_events.log", steps: Sequence[Tuple[str, Sequence[str]]] = FUNNEL_STEPS,
+                 store=None, shard: Optional[int] = None, shards: int = 1):
+        self.store = store if shard is not None and shards > 1 else None
+        self.shard = shard
+        self.shards = shards
+        self._published_at = 0.0
+        self._publish_handle: Optional[asyncio.TimerHandle] = None
+        self.events_file = events_file
+        self.snapshot_file = f"{events_file}.snapshot"
+        self.steps = [name for name, _ in steps]
+        self.step_of = {state: index for index, (_, states) in enumerate(steps) for state in states}
+        self._reset()
+        offset = self._load_snapshot()
+        self._replay(offset)
+        self._log = open(events_file, 'a', encoding='utf-8')
+        self._unflushed = 0
+        if self.store is not None:
+            # Totals restored from the snapshot count before this worker's first change
+            self.publish()
+
+    def _reset(self):
+        # user_id -> (steps reached as a bit mask, current step, time the current step was entered)
+        self.users: Dict[int, Tuple[int, int, float]] = {}
+        self.reached = [0] * len(self.steps)
+        self.current = [0] * len(self.steps)
+        # durations[k]: time from entering step k to entering step k + 1
+        self.durations = [DurationSketch() for _ in self.steps[1:]]
+        self.events = 0
+
+    def _load_snapshot(self) -> int:
+        """Restore saved totals and return the log offset they cover"""
+        if not os.path.exists(self.snapshot_file):
+            return 0
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if not os.path.exists(self.events_file) or os.path.getsize(self.events_file) < snapshot['offset']:
+                raise ValueError("event log is shorter than the snapshot")
+            self.users = {int(user_id): tuple(user) for user_id, user in snapshot['users'].items()}
+            self.reached = snapshot['reached']
+            self.current = snapshot['current']
+            self.durations = [
+                DurationSketch({int(index): count for index, count in buckets.items()})
+                for buckets in snapshot['durations']
+            ]
+            self.events = snapshot['events']
+            return snapshot['offset']
+        except (json.JSONDecodeError, KeyError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring funnel snapshot {self.snapshot_file} ({e}), replaying the whole event log")
+            self._reset()
+            return 0
+
+    def _replay(self, offset: int):
+        """Fold events logged after `offset` into the totals"""
+        if not os.path.exists(self.events_file):
+            return
+        with open(self.events_file, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    timestamp, user_id, state = line.split()
+                    self._apply(int(user_id), state.decode('utf-8'), float(timestamp))
+                except ValueError:
+                    # A line torn by a crash
+                    continue
+        with open(self.events_file, 'rb+') as f:
+            # Start the next event on a fresh line if the log ends with a torn one
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    f.write(b'\n')
+
+    def record(self, user_id: int, state: str, timestamp: Optional[float] = None):
+        """Append a state change to the log and update the funnel"""
+        if timestamp is None:
+            timestamp = time.time()
+        self._log.write(f"{timestamp:.3f} {user_id} {state}\n")
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self._log.flush()
+            self._unflushed = 0
+        self._apply(int(user_id), state, timestamp)
+        if self.store is not None and self._publish_handle is None:
+            delay = self._published_at + self.publish_every - time.monotonic()
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if delay <= 0 or loop is None:
+                self.publish()
+            else:
+                self._publish_handle = loop.call_later(delay, self.publish)
+
+    def _apply(self, user_id: int, state: str, timestamp: float):
+        self.events += 1
+        step = self.step_of.get(state)
+        if step is None:
+            # Support, VIP and admin states are outside the onboarding funnel
+            return
+        user = self.users.get(user_id)
+        if user is None:
+            if step != 0:
+                return
+            mask, current, entered = 0, None, timestamp
+        else:
+            mask, current, entered = user
+            if step == current:
+                return
+            self.current[current] -= 1
+        bit = 1 << step
+        if not mask & bit and (step == 0 or current == step - 1):
+            mask |= bit
+            self.reached[step] += 1
+            if step:
+                self.durations[step - 1].add(timestamp - entered)
+        self.current[step] += 1
+        self.users[user_id] = (mask, step, timestamp)
+
+    def totals(self) -> Dict[str, Any]:
+        """A copy of this process' funnel totals, without the per-user progress behind them"""
+        return {
+            'events': self.events,
+            'reached': list(self.reached),
+            'current': list(self.current),
+            'durations': [dict(sketch.buckets) for sketch in self.durations],
+        }
+
+    def publish(self, wait: bool = False):
+        """Publish this worker's totals for the funnel of every worker.
+
+        On the event loop the store is written from a thread, unless `wait` is set.
+        """
+        if self._publish_handle is not None:
+            self._publish_handle.cancel()
+            self._publish_handle = None
+        self._published_at = time.monotonic()
+        totals = self.totals()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or wait:
+            self._write_totals(totals)
+        else:
+            loop.run_in_executor(None, self._write_totals, totals)
+
+    def _write_totals(self, totals: Dict[str, Any]):
+        try:
+            self.store.set(self.namespace, str(self.shard), totals)
+        except Exception as e:
+            logger.error(f"Failed to publish funnel totals of worker {self.shard}: {e}")
+
+    def _all_totals(self) -> Dict[str, Any]:
+        """The totals of every worker added up, or this process' alone"""
+        totals = self.totals()
+        if self.store is None:
+            return totals
+        for shard in range(self.shards):
+            if shard == self.shard:
+                continue
+            other = self.store.get(self.namespace, str(shard))
+            if other is None:
+                continue
+            totals['events'] += other['events']
+            for index in range(len(self.steps)):
+                totals['reached'][index] += other['reached'][index]
+                totals['current'][index] += other['current'][index]
+            for merged, buckets in zip(totals['durations'], other['durations']):
+                for bucket, count in buckets.items():
+                    # JSON object keys come back as strings
+                    merged[int(bucket)] = merged.get(int(bucket), 0) + count
+        return totals
+
+    def save(self):
+        """Save the totals with the log offset they cover"""
+        self._log.flush()
+        self._unflushed = 0
+        snapshot = {
+            'offset': self._log.tell(),
+            'events': self.events,
+            'reached': self.reached,
+            'current': self.current,
+            'durations': [sketch.buckets for sketch in self.durations],
+            'users': self.users,
+        }
+        tmp_file = f"{self.snapshot_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(tmp_file, self.snapshot_file)
+
+    def close(self):
+        """Save (and publish) the totals and close the log"""
+        if not self._log.closed:
+            self.save()
+            self._log.close()
+            if self.store is not None:
+                self.publish(wait=True)
+
+    def funnel(self) -> List[Dict[str, Optional[float]]]:
+        """Per step: users who reached it, users still there, conversion from the previous
+        step and the median and 90th percentile time to the next step, over every worker"""
+        return self._funnel_rows(self._all_totals())
+
+    def _funnel_rows(self, totals: Dict[str, Any]) -> List[Dict[str, Optional[float]]]:
+        reached = totals['reached']
+        durations = [DurationSketch(buckets) for buckets in totals['durations']]
+        rows = []
+        for index, name in enumerate(self.steps):
+            previous = reached[index - 1] if index else None
+            sketch = durations[index] if index < len(durations) else None
+            rows.append({
+                'step': name,
+                'reached': reached[index],
+                'current': totals['current'][index],
+                'conversion': reached[index] / previous if previous else None,
+                'p50': sketch.quantile(0.5) if sketch else None,
+                'p90': sketch.quantile(0.9) if sketch else None,
+            })
+        return rows
+
+    def format_funnel(self) -> str:
+        """Funnel summary for the /stats command"""
+        totals = self._all_totals()
+        lines = [f"📊 Onboarding funnel ({totals['reached'][0]} users, {totals['events']} state changes)"]
+        for row in self._funnel_rows(totals):
+            line = f"{row['step']}: {row['reached']} reached"
+            if row['conversion'] is not None:
+                line += f" ({row['conversion']:.1%} of previous)"
+            line += f", {row['current']} here now"
+            if row['p50'] is not None:
+                line += f"\n  → next step in {format_duration(row['p50'])} (median), {format_duration(row['p90'])} (p90)"
+            lines.append(line)
+        return "\n".join(lines)
+
+def format_duration(seconds: float) -> str:
+    """Short human-readable duration, e.g. 45s, 3m 20s, 2h 5m, 1d 3h"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds}s"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes}m"
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h"
@@ -1,8 +1,36 @@
+import asyncio
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
-from config import BOT_TOKEN, ADMIN_IDS, BINGX_REFERRAL_LINK, BotStates, MESSAGES
-from database import UserDatabase
+import re
+import secrets
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+from telegram import Update, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatJoinRequestHandler, TypeHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
+from config import BOT_TOKEN, ADMIN_IDS, BINGX_REFERRAL_LINK, DB_BACKEND, DB_FILE, SQLITE_FILE, MEDIA_CACHE_FILE, BROADCAST_DIR, REVIEWS_FILE, STATE_EVENTS_FILE, CONCURRENT_UPDATES, BotStates, MESSAGES
+from config import WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS
+from config import METRICS_PORT, METRICS_HOST, STORE_URL, WORKERS, WORKER_INDEX, ADMIN_REPLY_TTL, LOCALES_DIR, DEFAULT_LOCALE
+from config import GROUP_LINK, GROUP_CHAT_ID, INVITE_POOL_SIZE, INVITE_LINK_TTL
+from config import REFERRAL_SOURCE_FILE, REFERRAL_CACHE_FILE, REFERRAL_REFRESH_INTERVAL, MIN_DEPOSIT_USDT
+from config import OUTBOUND_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_QUEUE_SIZE
+from database import UserTransaction, open_database
+from media import MediaRegistry, StepComposer
+from ratelimit import RateLimiter
+from outbound import ADMIN, BULK, Lane, OutboundScheduler
+from broadcast import Broadcaster, BroadcastManager
+from webhook import allowed_updates_for, run_webhook
+from sharding import run_sharded_webhook, serve_updates, update_user_id
+from store import StoreDict, open_store
+from dispatcher import PerUserUpdateProcessor
+from flow import FlowEngine, Prompt, Transition
+from metrics import InstrumentedRequest, Metrics, MetricsServer
+from analytics import FunnelAnalytics, format_duration
+from review import ReviewQueue, APPROVED, REJECTED
+from dedup import UpdateDeduplicator
+from i18n import Locale, MessageCatalog
+from admission import GroupAdmissions
+from verification import FileReferralSource, SnapshotVerifier, UidClaims, Verification, parse_uid
 
 # Set up logging
 logging.basicConfig(
@@ -11,275 +39,127 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize database
-db = UserDatabase()
-
-admin_reply_state = {}  # key: admin_id, value: {'step': 1/2, 'user_id': ...}
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /start command or back to start/kyc from callback"""
-    user = update.effective_user
-    user_id = user.id
-
-    # Store user info
-    db.set_user_info(user_id, username=user.username, name=user.first_name)
-    db.set_user_state(user_id, BotStates.GREETING)
-    
-    #Send image
-    with open('img/welcome.png', 'rb') as photo:
-        await context.bot.send_photo(
-            chat_id=update.effective_user.id,
-            photo=photo
-        )
-
-    # Send welcome message
-    welcome_text = MESSAGES['welcome'].format(BINGX_REFERRAL_LINK=BINGX_REFERRAL_LINK)
-    if update.message:
-        await update.message.reply_text(welcome_text)
-    elif update.callback_query:
-        await update.callback_query.message.reply_text(welcome_text)
-
-    # Show both components
-    await ask_referral_registration(update, context)
-    await ask_vip_campaign(update, context)
-
-async def ask_kyc_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Ask if user has KYC-verified account"""
-    keyboard = [
-        [
-            InlineKeyboardButton("Yes, I have KYC account", callback_data="kyc_yes"),
-            InlineKeyboardButton("No, I don't have KYC account", callback_data="kyc_no")
-        ],
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    # Always show the same KYC question regardless of previous state
-    if update.callback_query:
-        # Instead of editing, send a new message
-        await update.callback_query.message.reply_text(
-            MESSAGES['kyc_question'],
-            reply_markup=reply_markup
-        )
-    else:
-        await update.message.reply_text(
-            MESSAGES['kyc_question'],
-            reply_markup=reply_markup
-        )
-
-async def handle_kyc_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle KYC response"""
-    query = update.callback_query
-    await query.answer()
-    
-    user_id = query.from_user.id
-    response = query.data
-
-    if response == "kyc_yes":
-        db.set_kyc_status(user_id, True)
-        db.set_user_state(user_id, BotStates.KYC_YES)
-        # Combine instructions and confirmation buttons in one new message
-        keyboard = [
-            [
-                InlineKeyboardButton("Yes, I completed the transfer", callback_data="kyc_transfer_yes"),
-                InlineKeyboardButton("No, I haven't completed it yet", callback_data="kyc_transfer_no")
-            ],
-            [
-                InlineKeyboardButton("⬅️ Back to start", callback_data="back_to_start")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        msg = await context.bot.send_message(
-            chat_id=user_id,
-            text=MESSAGES['kyc_yes'],
-            reply_markup=reply_markup
-        )
-        context.user_data['kyc_instruction_msg_id'] = msg.message_id
-
-    elif response == "kyc_no":
-        db.set_kyc_status(user_id, False)
-        db.set_user_state(user_id, BotStates.KYC_NO)
-        # Create keyboard with back button
-        keyboard = [
-            [
-                InlineKeyboardButton("⬅️ Back to KYC Question", callback_data="back_to_kyc")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=MESSAGES['kyc_no'],
-            reply_markup=reply_markup
-        )
-        # Wait for user to confirm KYC completion in text message
-        
-async def ask_kyc_transfer_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Ask if user has completed KYC transfer to referral"""
-    keyboard = [
-        [
-            InlineKeyboardButton("Yes, I completed the transfer", callback_data="kyc_transfer_yes"),
-            InlineKeyboardButton("No, I haven't completed it yet", callback_data="kyc_transfer_no")
-        ],
-        [
-            InlineKeyboardButton("⬅️ Back to KYC Question", callback_data="back_to_kyc")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text=MESSAGES['kyc_transfer_confirmation'],
-        reply_markup=reply_markup
-    )
-
-async def handle_kyc_transfer_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    print("handle_kyc_transfer_response")
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    response = query.data
-
-    if response == "kyc_transfer_yes":
-        db.set_user_state(user_id, BotStates.KYC_YES)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=MESSAGES['kyc_transfer_yes']
-        )
-        await ask_deposit_question(update, context)
-
-    elif response == "kyc_transfer_no":
-        db.set_user_state(user_id, BotStates.KYC_YES)
-        keyboard = [
-            [
-                InlineKeyboardButton("✅ I have completed it now", callback_data="kyc_transfer_yes"),
-                InlineKeyboardButton("⬅️ Back to KYC Question", callback_data="back_to_kyc")
-            ]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=MESSAGES['kyc_transfer_no'],
-            reply_markup=reply_markup
-        )
-
-
-async def ask_kyc_completion(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Step 4: Ask if user completed KYC, loop until Yes, then proceed to deposit question"""
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Yes", callback_data="kyc_complete_yes"),
-            InlineKeyboardButton("❌ No", callback_data="kyc_complete_no")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text="Did you complete KYC?",
-        reply_markup=reply_markup
-    )
-
-async def handle_kyc_completion_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle Step 4: KYC completion response, loop until Yes, then proceed to deposit question"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    response = query.data
-
-    if response == "kyc_complete_yes":
-        db.set_user_state(user_id, BotStates.KYC_COMPLETION)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="Great! Now let's check your deposit status."
-        )
-        await ask_deposit_question(update, context)
-    elif response == "kyc_complete_no":
-        db.set_user_state(user_id, BotStates.KYC_NO)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="Please complete your KYC verification first, then let me know when you're ready!"
-        )
-        # Loop: ask again
-        await ask_kyc_completion(update, context)
-
-async def ask_deposit_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Step 5: Ask if user made a deposit, loop until Yes, then proceed to UID/username submission"""
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Yes", callback_data="deposit_yes"),
-            InlineKeyboardButton("❌ No", callback_data="deposit_no")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text="Did you make a deposit?",
-        reply_markup=reply_markup
-    )
+# Users (with DB_BACKEND=store), admin conversations, the review backlog and funnel totals,
+# shared by every worker process
+store = open_store(STORE_URL)
 
-async def handle_deposit_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle Step 5: Deposit response, loop until Yes, then proceed to UID/username submission"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    response = query.data
-
-    if response == "deposit_yes":
-        db.set_deposit_status(user_id, True)
-        db.set_user_state(user_id, BotStates.DEPOSIT_YES)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="Great! Please submit your BingX UID and your Telegram username (Step 6)."
-        )
-        await ask_uid_submission(update, context)
-    elif response == "deposit_no":
-        db.set_deposit_status(user_id, False)
-        db.set_user_state(user_id, BotStates.DEPOSIT_NO)
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="Please make a deposit first, then let me know when you're ready!"
-        )
-        # Loop: ask again
-        await ask_deposit_question(update, context)
-
-async def notify_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, user_id: int):
-    """Notify admin about new user waiting for verification"""
+# Initialize database
+db = open_database(DB_BACKEND, DB_FILE, SQLITE_FILE, store)
+
+# Uploaded images are reused by file_id
+media = MediaRegistry(MEDIA_CACHE_FILE)
+# Sends each step's images, text and keyboard in as few API calls as possible
+steps = StepComposer(media)
+
+# Every message the bot sends goes through one scheduler, since Telegram's limits are per
+# bot; worker processes split the overall rate between them. Replies from handlers are
+# interactive, admin notifications and /broadcast send in their own, less urgent lanes.
+limiter = RateLimiter(global_rate=OUTBOUND_RATE / WORKERS, private_rate=OUTBOUND_CHAT_RATE)
+outbound = OutboundScheduler(limiter, OUTBOUND_QUEUE_SIZE)
+broadcaster = Broadcaster(Lane(ADMIN))
+broadcasts = BroadcastManager(db, Lane(BULK), BROADCAST_DIR)
+# Submitted UIDs waiting for an admin decision, shared by every admin
+reviews = ReviewQueue(Lane(ADMIN), store, REVIEWS_FILE)
+
+# With GROUP_CHAT_ID, approved users get personal single-use invite links and only they are
+# admitted. Invite links and join requests are not messages, so they get a limiter of their
+# own rather than the group's message rate. It only spaces the calls out: they still go
+# through the outbound scheduler, which retries 429 responses, so it does not retry them too.
+admissions = GroupAdmissions(
+    store,
+    RateLimiter(global_rate=30 / WORKERS, group_rate=5, group_burst=10, max_retries=0),
+    GROUP_CHAT_ID,
+    pool_size=INVITE_POOL_SIZE,
+    link_ttl=INVITE_LINK_TTL
+) if GROUP_CHAT_ID is not None else None
+
+# With REFERRAL_SOURCE_FILE, submitted UIDs of our referrals with KYC and a deposit are
+# approved without an admin, but only for the first user to submit each UID
+uid_claims = UidClaims(store)
+if STORE_URL.startswith('memory://'):
+    # The in-memory store starts empty, so claims are restored from the submissions under review
+    uid_claims.restore(reviews.submitted_uids())
+verifier = SnapshotVerifier(
+    FileReferralSource(REFERRAL_SOURCE_FILE),
+    REFERRAL_CACHE_FILE,
+    refresh_interval=REFERRAL_REFRESH_INTERVAL,
+    min_deposit=MIN_DEPOSIT_USDT,
+    claims=uid_claims
+) if REFERRAL_SOURCE_FILE else None
+
+# Instrumentation records nothing unless METRICS_PORT is set
+metrics = Metrics(enabled=METRICS_PORT is not None)
+metrics_server = MetricsServer(metrics)
+
+# Every state change is logged and folded into the onboarding funnel shown by /stats; each
+# worker process publishes its totals so /stats adds up every worker's
+analytics = FunnelAnalytics(STATE_EVENTS_FILE, store=store, shard=WORKER_INDEX, shards=WORKERS)
+db.state_listeners.append(analytics.record)
+
+# Redelivered updates and double-tapped buttons are dropped before any handler runs
+dedup = UpdateDeduplicator()
+
+# User-facing text in each user's language, each locale loaded the first time a user needs it
+catalog = MessageCatalog(MESSAGES, LOCALES_DIR, DEFAULT_LOCALE, params={'BINGX_REFERRAL_LINK': BINGX_REFERRAL_LINK})
+
+# An admin's /reply conversation expires ADMIN_REPLY_TTL seconds after their last step
+admin_reply_state = StoreDict(store, 'admin_reply', ttl=ADMIN_REPLY_TTL)  # key: admin_id, value: {'step': 1/2, 'user_ids': [...]}
+
+def user_locale(update: Update, user: Mapping[str, Any]) -> Locale:
+    """The locale stored for the user who sent an update, or the one matching their Telegram language"""
+    return catalog.locale(user.get('locale') or catalog.resolve(update.effective_user.language_code))
+
+def notify_admins(context: ContextTypes.DEFAULT_TYPE, text: str, **kwargs):
+    """Send a message to every admin in the background, so the user's reply does not wait for it"""
     if not ADMIN_IDS:
         logger.warning("Admin IDs not set, skipping admin notification")
         return
-    
-    user_data = db.get_user(user_id)
+    context.application.create_task(broadcaster.send(context.bot, ADMIN_IDS, text, **kwargs))
+
+async def submit_review(update: Update, tx: UserTransaction, submitted_uid: str, check: Optional[Verification] = None):
+    """Record the user's UID submission in the review queue, with the outcome of the UID check if there was one"""
+    user_data = tx.get_user()
     user = update.effective_user
     
     notification_text = MESSAGES['admin_notification'].format(
-        user_id=user_id,
+        user_id=user.id,
         username=user.username or "No username",
         name=user.first_name or "No name",
         has_kyc=user_data.get('has_kyc', 'Unknown'),
         has_deposit=user_data.get('has_deposit', 'Unknown')
-    )
+    ) + f"\nUID: {submitted_uid}"
+    if check is not None:
+        notification_text += f"\nUID check: {check.reason}"
+    await reviews.submit(user.id, notification_text, f"@{user.username} (ID: {user.id}), UID {submitted_uid}", submitted_uid)
+
+async def notify_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, submitted_uid: str,
+                       check: Optional[Verification] = None):
+    """Queue the user for review and notify every admin with approve/reject buttons"""
+    await submit_review(update, tx, submitted_uid, check)
+    user = update.effective_user
+    
+    if not ADMIN_IDS:
+        logger.warning("Admin IDs not set, skipping admin notification")
+        return
     
     keyboard = [
         [
-            InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user_id}"),
-            InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user_id}")
+            InlineKeyboardButton("✅ Approve", callback_data=f"approve:{user.id}"),
+            InlineKeyboardButton("❌ Reject", callback_data=f"reject:{user.id}")
         ]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    # Send notification to all admins
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=notification_text,
-                reply_markup=reply_markup
-            )
-        except Exception as e:
-            logger.error(f"Failed to notify admin {admin_id}: {e}")
-
-async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle admin approval/rejection"""
+    # Send notification to all admins, or update the copies they have if the user submitted again
+    context.application.create_task(reviews.notify(context.bot, user.id, ADMIN_IDS, reply_markup))
+
+async def review_user(update: Update, context: ContextTypes.DEFAULT_TYPE, argument: str, approved: bool):
+    """Handle admin approval/rejection from a notification or a /queue page.
+
+    The first admin to decide wins; every admin's notification is then edited to
+    show the decision instead of sending confirmations.
+    """
     query = update.callback_query
-    await query.answer()
     
     if query.from_user.id not in ADMIN_IDS:
         await context.bot.send_message(
@@ -288,340 +168,613 @@ async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return
     
-    action, user_id = query.data.split("_", 1)
+    # The argument is the user ID, followed by ':<page>' when pressed on a /queue page
+    user_id, _, page = argument.partition(':')
     user_id = int(user_id)
+    admin = query.from_user
+    admin_name = f"@{admin.username}" if admin.username else admin.first_name
     
-    if action == "approve":
+    if await reviews.decide(user_id, APPROVED if approved else REJECTED, admin_name):
+        db.set_user_state(user_id, BotStates.APPROVED if approved else BotStates.REJECTED)
+        await send_verification_result(context, user_id, approved)
+        context.application.create_task(reviews.update_notifications(context.bot, user_id))
+    elif user_id not in reviews.reviews and not page:
+        await query.edit_message_text(f"{query.message.text}\n\nNo review found for this user.")
+    
+    if page:
+        await show_queue_page(query, int(page))
+
+async def send_verification_result(context: ContextTypes.DEFAULT_TYPE, user_id: int, approved: bool):
+    """Tell a user the outcome of their review, with the group link if approved"""
+    locale = catalog.locale((await db.load_user(user_id)).get('locale'))
+    if approved:
         # Send group link to user
-        group_link = "https://t.me/your_group_link"  # Replace with actual group link
+        group_link = await admission_link(context, user_id)
         await context.bot.send_message(
             chat_id=user_id,
-            text=f"✅ Your verification is complete! Here's your group link:\n{group_link}"
+            text=locale.text('verification_approved').format(group_link=group_link)
         )
-        await context.bot.send_message(
-            chat_id=query.from_user.id,
-            text="✅ User approved and group link sent."
-        )
-        
-    elif action == "reject":
+    else:
         await context.bot.send_message(
             chat_id=user_id,
-            text="❌ Your verification was not approved. Please contact support for more information."
-        )
-        await context.bot.send_message(
-            chat_id=query.from_user.id,
-            text="❌ User rejected."
+            text=locale.text('verification_rejected')
         )
 
-async def ask_uid_submission(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Step 6: Ask user to submit UID and Telegram username"""
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text=(
-            "Please reply with your BingX UID.\n"
-            "⚠️ To make group management easier, please set a Telegram username in your Telegram settings "
-            "if you haven't already."
+async def admission_link(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> str:
+    """The group link for an approved user: a personal invite link when admissions are enabled"""
+    if admissions is None:
+        return GROUP_LINK
+    try:
+        return await admissions.issue(context.bot, user_id)
+    except TelegramError as e:
+        logger.error(f"Could not create an invite link for {user_id}, sending GROUP_LINK: {e}")
+        notify_admins(context, f"⚠️ Could not create an invite link for user {user_id}: {e}")
+        return GROUP_LINK
+
+async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admit users who were approved and decline everyone else"""
+    await admissions.handle(context.bot, update.chat_join_request)
+
+async def render_queue_page(page: int) -> Tuple[str, InlineKeyboardMarkup]:
+    """Text and keyboard of one /queue page"""
+    page, pending_count, entries = await reviews.page(page)
+    pages = reviews.pages_of(pending_count)
+    if not entries:
+        return "🗂 No users are waiting for review.", InlineKeyboardMarkup(
+            [[InlineKeyboardButton("🔄 Refresh", callback_data="queue:0")]]
         )
+    lines = [f"🗂 Pending reviews: {pending_count} (page {page + 1} of {pages})", ""]
+    keyboard = []
+    now = time.time()
+    for number, (user_id, review) in enumerate(entries, start=page * reviews.page_size + 1):
+        lines.append(f"{number}. {review['summary']}, waiting {format_duration(now - review['submitted_at'])}")
+        keyboard.append([
+            InlineKeyboardButton(f"✅ {number}", callback_data=f"approve:{user_id}:{page}"),
+            InlineKeyboardButton(f"❌ {number}", callback_data=f"reject:{user_id}:{page}"),
+        ])
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"queue:{page - 1}"))
+    navigation.append(InlineKeyboardButton("🔄 Refresh", callback_data=f"queue:{page}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"queue:{page + 1}"))
+    keyboard.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+async def show_queue_page(query: CallbackQuery, page: int):
+    """Replace a /queue message with another page"""
+    text, reply_markup = await render_queue_page(page)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # "message is not modified" when nothing changed since it was shown
+        logger.debug(f"Queue page not updated: {e}")
+
+# Flow actions: custom logic a transition runs before its state is stored.
+# Returning False leaves the user where they are; returning a state moves them there instead.
+
+async def approve_user(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    await review_user(update, context, argument, approved=True)
+
+async def reject_user(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    await review_user(update, context, argument, approved=False)
+
+async def turn_queue_page(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    """Show another page of the review queue in place"""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    await show_queue_page(update.callback_query, int(argument or 0))
+
+async def store_user_info(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    """Store the user's Telegram username, name and the locale of their Telegram language"""
+    user = update.effective_user
+    tx.set_user_info(username=user.username, name=user.first_name)
+    tx.update_user(locale=catalog.resolve(user.language_code))
+
+async def forward_vip_details(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    """Forward a VIP campaign application to the admins"""
+    user_id = update.effective_user.id
+    answer = update.message.text.strip()
+    telegram_username = update.effective_user.username or "(no username)"
+    notify_admins(context, f"VIP Campaign Application from @{telegram_username} (ID: {user_id}):\n{answer}")
+    await context.bot.send_message(chat_id=user_id, text=user_locale(update, tx.get_user()).text('vip_forwarded'))
+
+async def require_username(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    """Support requests need a username so the admin can reach the user"""
+    if not update.effective_user.username:
+        await update.message.reply_text(user_locale(update, tx.get_user()).text('support_username_required'))
+        return False
+
+async def forward_support_request(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    """Forward a support request to the admins"""
+    user_id = update.effective_user.id
+    issue_text = update.message.text.strip()
+    telegram_username = update.effective_user.username or "(no username)"
+    notify_admins(context, f"Support request from @{telegram_username} (ID: {user_id}):\n{issue_text}")
+    await update.message.reply_text(user_locale(update, tx.get_user()).text('support_forwarded'))
+
+async def submit_uid(update: Update, context: ContextTypes.DEFAULT_TYPE, tx: UserTransaction, argument: str):
+    """Step 6: Collect the BingX UID together with the Telegram username.
+
+    With a UID verifier, a UID it vouches for is approved on the spot; everything
+    else goes to the admins with the verifier's reason.
+    """
+    user_id = update.effective_user.id
+    locale = user_locale(update, tx.get_user())
+    telegram_username = update.effective_user.username
+    if not telegram_username:
+        await context.bot.send_message(chat_id=user_id, text=locale.text('uid_username_required'))
+        return False  # Do not proceed
+    submitted_uid = parse_uid(update.message.text)
+    if submitted_uid is None:
+        await context.bot.send_message(chat_id=user_id, text=locale.text('uid_invalid'))
+        return False  # Wait for a UID
+    combined_info = f"UID: {submitted_uid}\nTelegram: @{telegram_username}"
+    tx.update_user(uid_submission=combined_info)
+    check = await verifier.verify(submitted_uid, user_id) if verifier is not None else None
+    if check is not None and check.approved:
+        await submit_review(update, tx, submitted_uid, check)
+        await reviews.decide(user_id, APPROVED, "UID check")
+        await send_verification_result(context, user_id, approved=True)
+        return BotStates.APPROVED
+    await notify_admin(update, context, tx, submitted_uid, check)
+    await context.bot.send_message(chat_id=user_id, text=locale.text('uid_received'))
+
+def build_prompts(locale: Locale) -> Dict[str, Prompt]:
+    """Every message of the onboarding flows in one locale, keyed by step name"""
+    text, label = locale.text, locale.label
+    back_to_start = (label("⬅️ Back to start"), "back_to_start")
+    back_to_kyc = (label("⬅️ Back to KYC Question"), "back_to_kyc")
+    transfer_buttons = (
+        (label("Yes, I completed the transfer"), "kyc_transfer_yes"),
+        (label("No, I haven't completed it yet"), "kyc_transfer_no"),
+    )
+    return {
+        'welcome': Prompt(text('welcome'), images=('img/welcome.png',)),
+        'referral_link': Prompt(text('welcome')),
+        'referral_question': Prompt(text('referral_question'), buttons=(
+            ((label("✅ Yes"), "referral_yes"), (label("❌ No"), "referral_no")),
+            ((label("🟡 I already have a BingX account"), "referral_existing"),),
+        )),
+        'vip_question': Prompt(text('vip_question'), buttons=(
+            ((label("✅ Yes, I’m interested"), "vip_step1_yes"), (label("❌ No, I’m not interested"), "vip_step1_no")),
+        )),
+        'vip_campaign_details': Prompt(text('vip_details'), images=('img/whale.png',), buttons=(
+            ((label("✅ Yes, I’m interested"), "vip_step2_yes"), (label("❌ No, I’m not interested"), "vip_step2_no")),
+        )),
+        'vip_exchange_question': Prompt(text('vip_exchange_question')),
+        'vip_declined': Prompt(text('vip_declined')),
+        'kyc_question': Prompt(text('kyc_question'), buttons=(
+            ((label("Yes, I have KYC account"), "kyc_yes"), (label("No, I don't have KYC account"), "kyc_no")),
+        )),
+        'kyc_yes': Prompt(text('kyc_yes'), buttons=(transfer_buttons, (back_to_start,))),
+        'kyc_no': Prompt(text('kyc_no'), buttons=((back_to_kyc,),)),
+        'kyc_transfer_confirmation': Prompt(text('kyc_transfer_confirmation'), buttons=(transfer_buttons, (back_to_kyc,))),
+        'kyc_transfer_yes': Prompt(text('kyc_transfer_yes')),
+        'kyc_transfer_no': Prompt(text('kyc_transfer_no'), buttons=(
+            ((label("✅ I have completed it now"), "kyc_transfer_yes"), back_to_kyc),
+        )),
+        # Screenshots go out as one album with the instructions as its caption
+        'kyc_transfer_help': Prompt(text('kyc_transfer_help'), images=('img/verify_1.png', 'img/verify_2.png')),
+        'kyc_complete_question': Prompt(text('kyc_complete_question'), buttons=(
+            ((label("✅ Yes"), "kyc_complete_yes"), (label("❌ No"), "kyc_complete_no")),
+        )),
+        'kyc_complete_yes': Prompt(text('kyc_completion_yes')),
+        'kyc_complete_no': Prompt(text('kyc_completion_no')),
+        'deposit_question': Prompt(text('deposit_prompt'), buttons=(
+            ((label("✅ Yes"), "deposit_yes"), (label("❌ No"), "deposit_no")),
+        )),
+        'deposit_yes': Prompt(text('deposit_confirmed')),
+        'deposit_no': Prompt(text('deposit_no')),
+        'uid_request': Prompt(text('uid_request')),
+        'support_question': Prompt(text('support_question')),
+        # Not sent: the answer shown for presses on keyboards of steps already answered
+        'stale_button': Prompt(text('stale_button')),
+    }
+
+# The default locale's prompts; users in other locales get theirs compiled on first use
+PROMPTS = build_prompts(catalog.locale(DEFAULT_LOCALE))
+
+# /start, and any text the current step does not expect
+START = Transition(
+    state=BotStates.GREETING,
+    prompts=('welcome', 'referral_question', 'vip_question'),
+    action=store_user_info
+)
+
+# /support
+SUPPORT = Transition(state=BotStates.SUPPORT, prompts=('support_question',), action=require_username)
+
+# States in which the KYC completion and deposit questions can still be answered;
+# presses on those keyboards after the user has moved past the step are stale
+KYC_COMPLETION_FROM = (
+    BotStates.GREETING, BotStates.KYC_QUESTION, BotStates.KYC_YES, BotStates.KYC_NO,
+    BotStates.SUPPORT, BotStates.VIP_AWAITING_DETAILS, BotStates.COMPLETED,
 )
+DEPOSIT_FROM = (BotStates.KYC_COMPLETION, BotStates.KYC_YES, BotStates.DEPOSIT_NO)
+
+# Button presses, keyed by callback data (the part before ':' when it carries an argument)
+CALLBACKS = {
+    # Step 2: referral registration
+    'referral_yes': Transition(prompts=('kyc_complete_question',)),
+    'referral_no': Transition(prompts=('referral_link', 'referral_question')),
+    'referral_existing': Transition(prompts=('kyc_transfer_help', 'kyc_complete_question')),
+    # VIP campaign
+    'vip_step1_yes': Transition(prompts=('vip_campaign_details',)),
+    'vip_step1_no': Transition(prompts=('vip_declined',)),
+    'vip_step2_yes': Transition(state=BotStates.VIP_AWAITING_DETAILS, prompts=('vip_exchange_question',)),
+    'vip_step2_no': Transition(prompts=('vip_declined',)),
+    # Step 3: KYC transfer for existing accounts
+    'kyc_yes': Transition(state=BotStates.KYC_YES, fields={'has_kyc': True}, prompts=('kyc_yes',)),
+    'kyc_no': Transition(state=BotStates.KYC_NO, fields={'has_kyc': False}, prompts=('kyc_no',)),
+    'kyc_transfer_yes': Transition(state=BotStates.KYC_YES, prompts=('kyc_transfer_yes', 'deposit_question')),
+    'kyc_transfer_no': Transition(state=BotStates.KYC_YES, prompts=('kyc_transfer_no',)),
+    # Step 4: KYC completion, asked again until Yes
+    'kyc_complete_yes': Transition(state=BotStates.KYC_COMPLETION, prompts=('kyc_complete_yes', 'deposit_question'),
+                                   from_states=KYC_COMPLETION_FROM),
+    'kyc_complete_no': Transition(state=BotStates.KYC_NO, prompts=('kyc_complete_no', 'kyc_complete_question'),
+                                  from_states=KYC_COMPLETION_FROM),
+    # Step 5: deposit, asked again until Yes
+    'deposit_yes': Transition(state=BotStates.DEPOSIT_YES, fields={'has_deposit': True}, prompts=('deposit_yes', 'uid_request'),
+                              from_states=DEPOSIT_FROM),
+    'deposit_no': Transition(state=BotStates.DEPOSIT_NO, fields={'has_deposit': False}, prompts=('deposit_no', 'deposit_question'),
+                             from_states=DEPOSIT_FROM),
+    # Back buttons
+    'back_to_start': Transition(prompts=('referral_link', 'kyc_question')),
+    'back_to_kyc': Transition(prompts=('kyc_question',)),
+    'back_to_kyc_transfer': Transition(prompts=('kyc_transfer_confirmation',)),
+    # Step 7: admin verification, with the user ID as argument
+    'approve': Transition(action=approve_user),
+    'reject': Transition(action=reject_user),
+    'queue': Transition(action=turn_queue_page),
+}
+
+# Text replies, keyed by the state of the user who sent them
+TEXT_REPLIES = {
+    BotStates.VIP_AWAITING_DETAILS: Transition(state=BotStates.COMPLETED, action=forward_vip_details),
+    BotStates.SUPPORT: Transition(state=BotStates.COMPLETED, action=forward_support_request),
+    BotStates.DEPOSIT_YES: Transition(state=BotStates.COMPLETED, action=submit_uid),
+    # The user was told to complete KYC and says they are done
+    BotStates.KYC_NO: Transition(state=BotStates.KYC_QUESTION, prompts=('kyc_complete_question',)),
+    BotStates.WAITING_FOR_ADMIN: Transition(),
+}
+
+def prompt_variant(user: Mapping[str, Any]) -> Optional[str]:
+    """The locale whose prompts a user gets, None for the default locale's"""
+    locale = user.get('locale')
+    return locale if locale != DEFAULT_LOCALE else None
+
+def first_contact_fields(update: Update, user: Mapping[str, Any]) -> Dict[str, Any]:
+    """The locale of the user's Telegram language for users without one stored, e.g. on first contact through /support"""
+    if user.get('locale'):
+        return {}
+    return {'locale': catalog.resolve(update.effective_user.language_code)}
+
+flow = FlowEngine(db, steps, PROMPTS, CALLBACKS, TEXT_REPLIES, default_text=START, metrics=metrics,
+                  stale_prompt='stale_button', variants=lambda code: build_prompts(catalog.locale(code)),
+                  variant_of=prompt_variant, on_edit=dedup.message_edited, contact_fields=first_contact_fields)
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /start command"""
+    await flow.run(update, context, START)
+
+async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await flow.run(update, context, SUPPORT)
 
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle text messages: collect UID, support requests, or restart flow."""
+    """Handle text messages: admin replies, otherwise the sender's current onboarding step."""
     admin_id = update.effective_user.id
-    user_id = update.effective_user.id
-    user_data = db.get_user(user_id)
-    current_state = user_data.get('state', BotStates.GREETING)
     
-    if user_data.get('state') == "VIP_AWAITING_DETAILS":
-        answer = update.message.text.strip()
-        telegram_username = update.effective_user.username or "(no username)"
-        for admin_id in ADMIN_IDS:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"VIP Campaign Application from @{telegram_username} (ID: {user_id}):\n{answer}"
-            )
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="Your message has been forwarded to the admin."
-        )
-        db.set_user_state(user_id, "COMPLETED")
-        return
-    
-    if admin_id in ADMIN_IDS and admin_id in admin_reply_state:
-        state = admin_reply_state[admin_id]
+    state = await admin_reply_state.load(admin_id) if admin_id in ADMIN_IDS else None
+    if state is not None:
         if state['step'] == 1:
-            # Admin just entered user ID
-            user_id = update.message.text.strip()
-            if not user_id.isdigit():
-                await update.message.reply_text("Invalid user ID. Please enter a numeric Telegram user ID.")
+            # Admin just entered the user ID(s)
+            user_ids = parse_reply_targets(update.message.text)
+            if user_ids is None:
+                await update.message.reply_text(
+                    "Invalid user ID. Please enter a numeric Telegram user ID, or several separated by commas."
+                )
                 return
-            admin_reply_state[admin_id] = {'step': 2, 'user_id': user_id}
+            await admin_reply_state.save(admin_id, {'step': 2, 'user_ids': user_ids})
             await update.message.reply_text("Please enter the content you want to send.")
             return
         elif state['step'] == 2:
             # Admin just entered the message content
-            user_id = admin_reply_state[admin_id]['user_id']
-            content = update.message.text.strip()
-            try:
-                await context.bot.send_message(
-                    chat_id=int(user_id),
-                    text=f"💬 Admin reply:\n{content}"
-                )
-                await update.message.reply_text("✅ Your reply has been sent to the user.")
-            except Exception as e:
-                await update.message.reply_text(f"Failed to send message: {e}")
-            del admin_reply_state[admin_id]
+            await admin_reply_state.drop(admin_id)
+            await send_admin_reply(update, context, state['user_ids'], update.message.text.strip())
             return
-        
-    # 1. Handle support requests
-    if current_state == BotStates.SUPPORT:
-        issue_text = update.message.text.strip()
-        telegram_username = update.effective_user.username or "(no username)"
-        if ADMIN_IDS:
-            for admin_id in ADMIN_IDS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=f"Support request from @{telegram_username} (ID: {user_id}):\n{issue_text}"
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send support request to admin {admin_id}: {e}")
-        await update.message.reply_text("Your issue has been forwarded to the admin. Thank you!")
-        db.set_user_state(user_id, "COMPLETED")
-        return
-
-    # 2. Handle UID submission after deposit
-    if current_state == BotStates.DEPOSIT_YES:
-        submitted_uid = update.message.text.strip()
-        telegram_username = update.effective_user.username
-        if not telegram_username:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=(
-                    "❗ You must set a Telegram username before proceeding.\n"
-                    "Please go to Telegram Settings > Edit Profile > Username, set a username, then type /start to begin again."
-                )
-            )
-            return  # Do not proceed
-        # If username is set, continue as before
-        combined_info = f"UID: {submitted_uid}\nTelegram: @{telegram_username}"
-        db.update_user(user_id, uid_submission=combined_info)
-        if ADMIN_IDS:
-            for admin_id in ADMIN_IDS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=f"New user submitted UID and Telegram username:\n{combined_info}\nUser ID: {user_id}"
-                    )
-                except Exception as e:
-                    logger.error(f"Failed to send UID submission to admin {admin_id}: {e}")
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="✅ Info received! You will be added to the group."
-        )
-        db.set_user_state(user_id, "COMPLETED")
-        return
-
-    # 3. If user is expected to complete KYC and then confirm
-    if current_state == BotStates.KYC_NO:
-        db.set_user_state(user_id, BotStates.KYC_QUESTION)  # Prevents repeated triggers
-        await ask_kyc_completion(update, context)
-        return
-
-    # 4. For any other text, restart the conversation
-    if current_state != BotStates.WAITING_FOR_ADMIN:
-        await start(update, context)
+    
+    await flow.handle_text(update, context)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors"""
     logger.error(f"Update {update} caused error {context.error}")
-
-async def handle_back_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle back button clicks for each step in the flow."""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-
-    # Optionally: clean up any state/message IDs if you want
-    context.user_data['kyc_instruction_msg_id'] = None
-
-    if query.data == "back_to_kyc_transfer":
-        # Go back to KYC transfer confirmation step
-        await ask_kyc_transfer_confirmation(update, context)
-    elif query.data == "back_to_kyc":
-        # Go back to KYC question step
-        await ask_kyc_question(update, context)
-    elif query.data == "back_to_start":
-        # Go back to welcome + KYC question (like /start)
-        welcome_text = MESSAGES['welcome'].format(BINGX_REFERRAL_LINK=BINGX_REFERRAL_LINK)
-        await context.bot.send_message(chat_id=user_id, text=welcome_text)
-        await ask_kyc_question(update, context)
-    # Add more as needed for other steps
-
-async def ask_referral_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Step 2: Ask if user registered with the referral link"""
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Yes", callback_data="referral_yes"),
-            InlineKeyboardButton("❌ No", callback_data="referral_no")
-        ],
-        [
-            InlineKeyboardButton("🟡 I already have a BingX account", callback_data="referral_existing")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text="Did you register with the referral link?",
-        reply_markup=reply_markup
-    )
-
-async def handle_referral_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle Step 2 options and branch accordingly"""
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    response = query.data
-
-    if response == "referral_yes":
-        # Go to Step 4 (KYC completion)
-        await ask_kyc_completion(update, context)
-    elif response == "referral_no":
-        # Send referral link again, then repeat Step 2
-        welcome_text = MESSAGES['welcome'].format(BINGX_REFERRAL_LINK=BINGX_REFERRAL_LINK)
-        await context.bot.send_message(chat_id=user_id, text=welcome_text)
-        await ask_referral_registration(update, context)
-    elif response == "referral_existing":
-        # Go to Step 3 (KYC transfer help)
-        await show_kyc_transfer_help(update, context)
-        
-async def ask_vip_campaign(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Yes, I’m interested", callback_data="vip_step1_yes"),
-            InlineKeyboardButton("❌ No, I’m not interested", callback_data="vip_step1_no")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text="Are you a VIP on another exchange or is your balance over $50,000?",
-        reply_markup=reply_markup
-    )
     
-async def show_vip_campaign_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()  # Always answer callback queries first!
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("✅ Yes, I’m interested", callback_data="vip_step2_yes"),
-            InlineKeyboardButton("❌ No, I’m not interested", callback_data="vip_step2_no")
-        ]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    vip_message = (
-        "🔥 BingX VIP Campaign – Switch & Earn BIG 🔥\n\n"
-        "Already a VIP on another exchange? Time to get more.\n\n"
-        "💎 Start directly at VIP+2\n"
-        "💰 Up to 1,000 USDT Trial Fund – Trade risk-free, keep the profits\n"
-        "🎯 Up to 8,000 USDT Cash Rewards – Just maintain your volume\n"
-        "💸 Up to 25% Trading Fee Rebate, paid daily\n"
-        "⚙️ Copy Trading, Bots, Grid & more\n"
-        "🥂 VIP perks: Fast support, low fees, private events\n\n"
-        "Get everything you have — and more — at BingX.\n"
-        "👉 Apply now and upgrade instantly"
-    )
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    locale = user_locale(update, await db.load_user(update.effective_user.id))
+    await update.message.reply_text(locale.text('help'))
     
-    # Send the image first (or after, if you prefer)
-    with open('img/whale.png', 'rb') as photo:
-        await context.bot.send_photo(
-            chat_id=update.effective_user.id,
-            photo=photo
+def parse_reply_targets(text: str) -> Optional[List[int]]:
+    """User IDs from '123' or '123,456,789', without repeats; None unless all are numeric"""
+    parts = [part.strip() for part in text.split(',')]
+    if not all(part.isdigit() for part in parts):
+        return None
+    return list(dict.fromkeys(int(part) for part in parts))
+
+async def send_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, user_ids: List[int], content: str):
+    """Send an admin's reply to every user at once and tell the admin how it went"""
+    results = await broadcaster.send(context.bot, user_ids, f"💬 Admin reply:\n{content}")
+    failed = {user_id: error for user_id, error in results.items() if error is not None}
+    if len(user_ids) == 1:
+        if failed:
+            await update.message.reply_text(f"Failed to send message: {failed[user_ids[0]]}")
+        else:
+            await update.message.reply_text("✅ Your reply has been sent to the user.")
+    elif failed:
+        await update.message.reply_text(
+            f"Your reply was sent to {len(user_ids) - len(failed)} of {len(user_ids)} users. Failed:\n"
+            + "\n".join(f"{user_id}: {error}" for user_id, error in failed.items())
         )
-        
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text=vip_message,
-        reply_markup=reply_markup
-    )
-    
-async def ask_vip_exchange_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    db.set_user_state(user_id, "VIP_AWAITING_DETAILS")
-    await context.bot.send_message(
-        chat_id=user_id,
-        text="Which exchange do you trade on? Which one are you VIP at? Or how much is your balance?\n(Please answer below.)"
-    )
-    
+    else:
+        await update.message.reply_text(f"✅ Your reply has been sent to {len(user_ids)} users.")
 
-async def handle_vip_campaign(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    data = query.data
+async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: reply to users, either in one message or step by step.
 
-    if data == "vip_step1_yes":
-        await show_vip_campaign_details(update, context)
-    elif data == "vip_step1_no":
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="No problem! You can continue with the regular onboarding process."
-        )
-    elif data == "vip_step2_yes":
-        await ask_vip_exchange_details(update, context)
-    elif data == "vip_step2_no":
-        await context.bot.send_message(
-            chat_id=user_id,
-            text="No problem! You can continue with the regular onboarding process."
+    "/reply 123,456 text" sends at once, "/reply 123,456" asks for the text and a
+    bare "/reply" asks for the user IDs first.
+    """
+    admin_id = update.effective_user.id
+    if admin_id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+    parts = update.message.text.split(maxsplit=2)
+    if len(parts) == 1:
+        await admin_reply_state.save(admin_id, {'step': 1})
+        await update.message.reply_text(
+            "Please enter the Telegram user ID you want to reply to, or several separated by commas."
         )
-
-async def show_kyc_transfer_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Step 3: Show KYC transfer help and then proceed to KYC completion question"""
-    help_text = (
-        "To transfer your KYC:\n"
-        "1. Your old account must not have had any trading activity in the last 7 days\n"
-        "2. Your old account must have advanced KYC\n"
-        "3. Log into your old account and transfer your KYC to the newly created account as shown in the image"
-    )
-    await context.bot.send_message(
-        chat_id=update.effective_user.id,
-        text=help_text
-    )
-    # Optionally, send screenshots here using send_photo
-    await context.bot.send_photo(chat_id=update.effective_user.id, photo=open('img/verify_1.png', 'rb'))
-    await context.bot.send_photo(chat_id=update.effective_user.id, photo=open('img/verify_2.png', 'rb'))
-    # Proceed to Step 4 (ask KYC completion)
-    await ask_kyc_completion(update, context)
-    
-async def support_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    telegram_username = update.effective_user.username
-    if not telegram_username:
+        return
+    user_ids = parse_reply_targets(parts[1])
+    if user_ids is None:
+        await update.message.reply_text("Usage: /reply [user_id[,user_id...]] [message]")
+        return
+    if len(parts) == 2:
+        await admin_reply_state.save(admin_id, {'step': 2, 'user_ids': user_ids})
+        await update.message.reply_text("Please enter the content you want to send.")
+        return
+    await admin_reply_state.drop(admin_id)
+    await send_admin_reply(update, context, user_ids, parts[2].strip())
+
+# /broadcast filters and how their values are written
+BROADCAST_FILTER_PATTERN = re.compile(r'(state|has_kyc|has_deposit)=(\S+)\s*')
+BROADCAST_FLAG_VALUES = {'yes': True, 'true': True, 'no': False, 'false': False, 'unknown': None}
+
+def parse_broadcast_args(text: str):
+    """Split '/broadcast key=value ... message' arguments into recipient filters and the message"""
+    recipient_filters = {}
+    while True:
+        match = BROADCAST_FILTER_PATTERN.match(text)
+        if not match:
+            break
+        key, value = match.groups()
+        if key == 'state':
+            recipient_filters[key] = value.upper()
+        elif value.lower() in BROADCAST_FLAG_VALUES:
+            recipient_filters[key] = BROADCAST_FLAG_VALUES[value.lower()]
+        else:
+            raise ValueError(f"{key} must be yes, no or unknown")
+        text = text[match.end():]
+    return recipient_filters, text.strip()
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: send a message to every stored user, optionally filtered"""
+    admin_id = update.effective_user.id
+    if admin_id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+    parts = update.message.text.split(maxsplit=1)
+    try:
+        recipient_filters, message = parse_broadcast_args(parts[1] if len(parts) > 1 else "")
+    except ValueError as e:
+        await update.message.reply_text(f"Invalid filter: {e}")
+        return
+    if not message:
         await update.message.reply_text(
-            "❗ You must set a Telegram username before requesting support.\n"
-            "Please go to Telegram Settings > Edit Profile > Username, set a username, then type /support again."
+            "Usage: /broadcast [state=STATE] [has_kyc=yes|no] [has_deposit=yes|no] <message>"
         )
         return
-    db.set_user_state(user_id, BotStates.SUPPORT)
+    job_id = broadcasts.create(context.bot, admin_id, message, recipient_filters)
     await update.message.reply_text(
-        "Please describe your issue or question. Our admin will contact you soon."
-    )
-    
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "/start - Start the bot\n"
-        "/support - Contact admin for help\n"
-        # Add more commands as needed
+        f"📣 Broadcast {job_id} started. Progress will be posted here.\n"
+        f"Use /broadcast_cancel {job_id} to stop it."
     )
-    await update.message.reply_text(help_text)
-    
-async def reply_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    admin_id = update.effective_user.id
-    if admin_id not in ADMIN_IDS:
+
+async def broadcast_cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: stop a running broadcast"""
+    if update.effective_user.id not in ADMIN_IDS:
         await update.message.reply_text("❌ You are not authorized to use this command.")
         return
-    admin_reply_state[admin_id] = {'step': 1}
-    await update.message.reply_text("Please enter the Telegram user ID you want to reply to.")
+    if not context.args:
+        await update.message.reply_text("Usage: /broadcast_cancel <broadcast id>")
+        return
+    if broadcasts.cancel(context.args[0]):
+        await update.message.reply_text(f"Broadcast {context.args[0]} cancelled.")
+    else:
+        await update.message.reply_text(f"No running broadcast {context.args[0]}.")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: show the onboarding funnel"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+    # Reads the totals other workers published to the store
+    await update.message.reply_text(await asyncio.to_thread(analytics.format_funnel))
+
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin command: page through users waiting for review"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("❌ You are not authorized to use this command.")
+        return
+    text, reply_markup = await render_queue_page(0)
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+# Commands and their handlers
+COMMANDS = {
+    "start": start,
+    "support": support_command,
+    "help": help_command,
+    "reply": reply_command,
+    "broadcast": broadcast_command,
+    "broadcast_cancel": broadcast_cancel_command,
+    "stats": stats_command,
+    "queue": queue_command,
+}
+
+def handler_label(update: object) -> str:
+    """Metrics label for what handles an update; unknown commands and buttons share one label"""
+    if not isinstance(update, Update):
+        return "other"
+    if update.callback_query:
+        return f"callback:{flow.resolve(update.callback_query.data or '')[0] or 'unknown'}"
+    if update.message and update.message.text:
+        if update.message.text.startswith('/'):
+            command = update.message.text.split()[0][1:].split('@')[0].lower()
+            return f"command:{command if command in COMMANDS else 'unknown'}"
+        return "text"
+    if update.chat_join_request:
+        return "join_request"
+    return "other"
+
+def observe_update(update: object, seconds: float):
+    """Record how long the handlers of an update took"""
+    metrics.observe('bot_handler_seconds', seconds, (('handler', handler_label(update)),))
+
+def observe_outbound(lane: str, seconds: float):
+    """Record how long an outgoing message waited to be sent"""
+    metrics.observe('bot_outbound_wait_seconds', seconds, (('lane', lane),))
+
+def runtime_metrics(application: Application):
+    """Metrics collector for update and outbound queue depth, duplicate updates, step sends, user database writes, admissions and UID checks"""
+    processor = application.update_processor
+
+    def collect():
+        yield 'bot_update_queue_size', (), application.update_queue.qsize()
+        if isinstance(processor, PerUserUpdateProcessor):
+            yield 'bot_updates_waiting', (), processor.admitted - processor.running
+            yield 'bot_updates_running', (), processor.running
+        for kind, hits in dedup.hits.items():
+            yield 'bot_dedup_hits_total', (('kind', kind),), hits
+        yield 'bot_dedup_misses_total', (), dedup.misses
+        for step, sends in steps.sends.items():
+            yield 'bot_step_sends_total', (('step', step),), sends
+            yield 'bot_step_api_calls_total', (('step', step),), steps.calls[step]
+        for lane in outbound.queues:
+            yield 'bot_outbound_queue_depth', (('lane', lane),), outbound.depth[lane]
+            yield 'bot_outbound_blocked_senders', (('lane', lane),), outbound.blocked[lane]
+            yield 'bot_outbound_retries_total', (('lane', lane),), outbound.retries[lane]
+        yield 'bot_db_writes_total', (), db.writes
+        yield 'bot_db_write_seconds_total', (), db.write_seconds
+        yield 'bot_db_written_bytes_total', (), db.bytes_written
+        if admissions is not None:
+            yield 'bot_invite_pool_size', (), len(admissions.pool)
+            for outcome, count in admissions.stats.items():
+                yield 'bot_admissions_total', (('outcome', outcome),), count
+        if verifier is not None:
+            for outcome, count in verifier.stats.items():
+                yield 'bot_uid_checks_total', (('outcome', outcome),), count
+            if verifier.snapshot is not None:
+                yield 'bot_referral_snapshot_records', (), len(verifier.snapshot)
+                yield 'bot_referral_snapshot_age_seconds', (), time.time() - verifier.snapshot.fetched_at
+
+    return collect
+
+async def on_startup(application: Application):
+    """Move user database writes off the event loop, resume interrupted broadcasts, start admissions and UID checks and serve metrics"""
+    await db.start_writer()
+    broadcasts.resume(application.bot)
+    if admissions is not None:
+        admissions.start(application.bot)
+    if verifier is not None:
+        await verifier.start()
+    if metrics.enabled:
+        await metrics_server.start(METRICS_HOST, METRICS_PORT)
+
+async def on_shutdown(application: Application):
+    """Pause broadcasts, then flush and close the user database and funnel analytics when the bot stops"""
+    await metrics_server.stop()
+    await broadcasts.stop()
+    if admissions is not None:
+        await admissions.stop()
+    if verifier is not None:
+        await verifier.stop()
+    await db.stop_writer()
+    db.close()
+    store.close()
+    analytics.close()
+    reviews.close()
+
+def build_application(token: str, **builder_options) -> Application:
+    """Create the application with all handlers registered.
+
+    Extra keyword arguments are passed to the matching ApplicationBuilder methods,
+    e.g. request=... to talk to a fake Bot API.
+    """
+    if metrics.enabled:
+        # Bot API calls made by handlers are counted; getUpdates long polls are left out
+        request = builder_options.pop('request', None) or HTTPXRequest(connection_pool_size=256)
+        builder_options['request'] = InstrumentedRequest(request, metrics)
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor(
+            CONCURRENT_UPDATES,
+            observe=observe_update if metrics.enabled else None
+        ))
+        .rate_limiter(outbound)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if metrics.enabled:
+        outbound.observe = observe_outbound
+    for option, value in builder_options.items():
+        builder = getattr(builder, option)(value)
+    application = builder.build()
+    
+    # Add handlers
+    application.add_handler(TypeHandler(Update, dedup), group=-1)
+    for command, callback in COMMANDS.items():
+        application.add_handler(CommandHandler(command, callback))
+    # Every button press goes through the flow engine's router
+    application.add_handler(CallbackQueryHandler(flow.handle_callback))
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, handle_text_message))
+    if admissions is not None:
+        application.add_handler(ChatJoinRequestHandler(handle_join_request, chat_id=GROUP_CHAT_ID))
+    
+    # Add error handler
+    application.add_error_handler(error_handler)
+    if metrics.enabled:
+        metrics.add_collector(runtime_metrics(application))
+    return application
+
+def shard_user_id(data: Dict[str, Any]) -> Optional[int]:
+    """User whose worker handles an update's JSON.
+
+    Reviews are kept by the worker of the user who submitted them, so an admin's
+    approve/reject press goes to that user's worker; everything else goes to the
+    sender's.
+    """
+    query = data.get('callback_query')
+    if query:
+        name, argument = flow.resolve(query.get('data') or '')
+        user_id = argument.split(':')[0]
+        if name in ('approve', 'reject') and user_id.isdigit():
+            return int(user_id)
+    return update_user_id(data)
+
+def run_worker(updates):
+    """Entry point of a worker process: handle the updates the webhook front process routes to it"""
+    asyncio.run(serve_updates(build_application(BOT_TOKEN), updates))
 
 def main():
     """Start the bot"""
@@ -629,30 +782,49 @@ def main():
         logger.error("No bot token provided!")
         return
     
-    # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CallbackQueryHandler(handle_vip_campaign, pattern="^vip_step"))
-    application.add_handler(CallbackQueryHandler(handle_kyc_transfer_response, pattern="^kyc_transfer_"))
-    application.add_handler(CallbackQueryHandler(handle_kyc_completion_response, pattern="^kyc_complete_"))
-    application.add_handler(CallbackQueryHandler(handle_kyc_response, pattern="^kyc_"))
-    application.add_handler(CallbackQueryHandler(handle_deposit_response, pattern="^deposit_"))
-    application.add_handler(CallbackQueryHandler(handle_admin_action, pattern="^(approve|reject)_"))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
-    application.add_handler(CallbackQueryHandler(handle_back_button, pattern="^back_to_"))
-    application.add_handler(CallbackQueryHandler(handle_referral_registration, pattern="^referral_"))
-    application.add_handler(CommandHandler("support", support_command))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("reply", reply_command))
+    if DB_BACKEND == 'store' and STORE_URL.startswith('memory://'):
+        # Users kept only in this process would be lost on every restart
+        logger.error("DB_BACKEND=store needs a persistent STORE_URL (redis://...); memory:// is only for tests")
+        return
     
-    # Add error handler
-    application.add_error_handler(error_handler)
+    application = build_application(BOT_TOKEN)
+    # Only ask Telegram for the update types our handlers consume
+    allowed_updates = allowed_updates_for(application)
     
     # Start the bot
-    logger.info("Starting bot...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WORKERS > 1:
+        if not WEBHOOK_URL or DB_BACKEND != 'store' or STORE_URL.startswith('memory://'):
+            logger.error("WORKERS > 1 needs WEBHOOK_URL, DB_BACKEND=store and a shared STORE_URL (redis://...)")
+            return
+        logger.info(f"Starting bot in webhook mode with {WORKERS} workers on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}...")
+        run_sharded_webhook(
+            run_worker,
+            WORKERS,
+            application.bot,
+            key=shard_user_id,
+            url=WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or secrets.token_urlsafe(32),
+            allowed_updates=allowed_updates,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+    elif WEBHOOK_URL:
+        logger.info(f"Starting bot in webhook mode on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}...")
+        asyncio.run(run_webhook(
+            application,
+            url=WEBHOOK_URL,
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or secrets.token_urlsafe(32),
+            allowed_updates=allowed_updates,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        ))
+    else:
+        logger.info("Starting bot...")
+        application.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,232 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden
+
+from database import UserDatabase
+from outbound import Lane
+
+logger = logging.getLogger(__name__)
+
+class Broadcaster:
+    """Sends one message to many chats concurrently through a lane of the outbound scheduler"""
+
+    def __init__(self, limiter: Lane):
+        self.limiter = limiter
+
+    async def send_one(self, bot: Bot, chat_id: int, text: str, **kwargs) -> Optional[Exception]:
+        """Send to a single chat; returns the error instead of raising it"""
+        try:
+            await self.limiter.call(bot.send_message, chat_id, text=text, **kwargs)
+        except Exception as e:
+            logger.error(f"Failed to send message to {chat_id}: {e}")
+            return e
+        return None
+
+    async def send(self, bot: Bot, chat_ids: Iterable[int], text: str, **kwargs) -> Dict[int, Optional[Exception]]:
+        """Send to every chat at once and return the error (or None) per chat"""
+        chat_ids = list(chat_ids)
+        results = await asyncio.gather(*(self.send_one(bot, chat_id, text, **kwargs) for chat_id in chat_ids))
+        return dict(zip(chat_ids, results))
+
+class BroadcastManager:
+    """Delivers admin announcements to every stored user matching a filter.
+
+    Recipients are streamed from the database in user ID order and sent in chunks
+    through ``limiter``, the outbound scheduler's bulk lane. Jobs are saved to
+    ``<jobs_dir>/jobs.json`` when created or cancelled and after each chunk, with
+    the job's cursor (the last user ID handled), and each recipient's outcome is
+    appended to ``<jobs_dir>/<job_id>.jsonl``, so a job interrupted by a restart
+    or a crash resumes where it stopped. Outcomes already recorded past the cursor are
+    skipped, so a crash mid-chunk re-sends at most the unrecorded part of one chunk.
+    """
+
+    chunk_size = 100
+    # Seconds between progress message edits
+    progress_interval = 5.0
+
+    def __init__(self, db: UserDatabase, limiter: Lane, jobs_dir: str = "broadcasts"):
+        self.db = db
+        self.limiter = limiter
+        self.jobs_dir = jobs_dir
+        self.jobs_file = os.path.join(jobs_dir, "jobs.json")
+        self.jobs: Dict[str, Dict[str, Any]] = self._load()
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+        # Jobs are saved from worker threads and, when created or cancelled, from the event loop
+        self._save_lock = threading.Lock()
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        """Load saved jobs"""
+        if os.path.exists(self.jobs_file):
+            try:
+                with open(self.jobs_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                return {}
+        return {}
+
+    def _jobs_json(self) -> str:
+        return json.dumps(self.jobs, indent=2, ensure_ascii=False)
+
+    def _save(self, jobs_json: str):
+        """Save jobs atomically"""
+        tmp_file = f"{self.jobs_file}.tmp"
+        with self._save_lock:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(jobs_json)
+            os.replace(tmp_file, self.jobs_file)
+
+    def _outcomes_file(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.jsonl")
+
+    def _append_outcomes(self, job_id: str, lines: str):
+        with open(self._outcomes_file(job_id), 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+    def _delivered(self, job_id: str) -> Set[int]:
+        """User IDs that already have an outcome recorded for a job"""
+        delivered = set()
+        if os.path.exists(self._outcomes_file(job_id)):
+            with open(self._outcomes_file(job_id), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        delivered.add(json.loads(line)['user_id'])
+                    except (json.JSONDecodeError, KeyError):
+                        break
+        return delivered
+
+    def create(self, bot: Bot, admin_id: int, text: str, filters: Dict[str, Any]) -> str:
+        """Register a new job and start delivering it; returns its ID"""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        job_id = str(int(time.time() * 1000))
+        self.jobs[job_id] = {
+            'admin_id': admin_id,
+            'text': text,
+            'filters': filters,
+            'cursor': 0,
+            'status': 'running',
+            'progress_message_id': None,
+            'counts': {},
+            'elapsed': 0.0,
+        }
+        # On disk before anything is sent, so a crash during the first chunk leaves a job to resume
+        self._save(self._jobs_json())
+        self._start(bot, job_id)
+        return job_id
+
+    def resume(self, bot: Bot):
+        """Restart every job that was still running when the bot stopped"""
+        for job_id, job in self.jobs.items():
+            if job['status'] == 'running' and job_id not in self.tasks:
+                logger.info(f"Resuming broadcast {job_id} after user {job['cursor']}")
+                self._start(bot, job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Stop a job for good once its current chunk is delivered"""
+        job = self.jobs.get(job_id)
+        if job is None or job['status'] != 'running':
+            return False
+        job['status'] = 'cancelled'
+        # Saved now, so a crash before the chunk ends does not resume the job
+        self._save(self._jobs_json())
+        return True
+
+    async def stop(self):
+        """Pause running jobs on shutdown after their current chunk; they resume on next start"""
+        self._stopping = True
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self._stopping = False
+
+    def _start(self, bot: Bot, job_id: str):
+        task = asyncio.create_task(self._run(bot, job_id))
+        self.tasks[job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+
+    async def _send(self, bot: Bot, user_id: int, text: str) -> str:
+        """Deliver to one recipient and classify the outcome"""
+        try:
+            await self.limiter.call(bot.send_message, user_id, text=text)
+        except Forbidden as e:
+            return 'deleted' if 'deactivated' in e.message.lower() else 'blocked'
+        except BadRequest as e:
+            return 'not_found' if 'chat not found' in e.message.lower() else 'failed'
+        except Exception as e:
+            logger.error(f"Broadcast to {user_id} failed: {e}")
+            return 'failed'
+        return 'sent'
+
+    def _next_chunk(self, recipients: Iterator[Tuple[int, Any]]) -> List[int]:
+        return [user_id for user_id, _ in itertools.islice(recipients, self.chunk_size)]
+
+    async def _run(self, bot: Bot, job_id: str):
+        job = self.jobs[job_id]
+        counts = job['counts']
+        delivered = await asyncio.to_thread(self._delivered, job_id)
+        recipients = self.db.iter_users(after=job['cursor'], **job['filters'])
+        started = time.monotonic() - job['elapsed']
+        last_progress = 0.0
+        # Chunks are never interrupted, so every message sent gets its outcome recorded
+        while job['status'] == 'running' and not self._stopping:
+            # Read in a thread, since with a shared store every page of users is a round trip
+            chunk = await asyncio.to_thread(self._next_chunk, recipients)
+            if not chunk:
+                job['status'] = 'done'
+                break
+            pending = [user_id for user_id in chunk if user_id not in delivered]
+            outcomes = await asyncio.gather(*(self._send(bot, user_id, job['text']) for user_id in pending))
+            for outcome in outcomes:
+                counts[outcome] = counts.get(outcome, 0) + 1
+            job['cursor'] = chunk[-1]
+            job['elapsed'] = time.monotonic() - started
+            lines = ''.join(
+                json.dumps({'user_id': user_id, 'outcome': outcome}) + '\n'
+                for user_id, outcome in zip(pending, outcomes)
+            )
+            await asyncio.to_thread(self._append_outcomes, job_id, lines)
+            await asyncio.to_thread(self._save, self._jobs_json())
+            if time.monotonic() - last_progress >= self.progress_interval:
+                last_progress = time.monotonic()
+                await self._report(bot, job_id)
+        await asyncio.to_thread(self._save, self._jobs_json())
+        await self._report(bot, job_id)
+
+    def format_progress(self, job_id: str) -> str:
+        """Progress summary shown to the admin who started a job"""
+        job = self.jobs[job_id]
+        counts = job['counts']
+        total = sum(counts.values())
+        rate = total / job['elapsed'] if job['elapsed'] else 0.0
+        lines = [
+            f"📣 Broadcast {job_id}: {job['status']}",
+            f"Delivered: {counts.get('sent', 0)}",
+            f"Blocked: {counts.get('blocked', 0)}",
+            f"Deleted accounts: {counts.get('deleted', 0)}",
+            f"Not found: {counts.get('not_found', 0)}",
+            f"Failed: {counts.get('failed', 0)}",
+            f"Throughput: {rate:.1f} msg/s",
+        ]
+        return "\n".join(lines)
+
+    async def _report(self, bot: Bot, job_id: str):
+        """Send or update the admin's progress message"""
+        job = self.jobs[job_id]
+        text = self.format_progress(job_id)
+        try:
+            if job['progress_message_id'] is None:
+                message = await bot.send_message(chat_id=job['admin_id'], text=text)
+                job['progress_message_id'] = message.message_id
+            else:
+                await bot.edit_message_text(chat_id=job['admin_id'], message_id=job['progress_message_id'], text=text)
+        except BadRequest as e:
+            # "message is not modified" when nothing changed since the last edit
+            logger.debug(f"Broadcast {job_id} progress not updated: {e}")
+        except Exception as e:
+            logger.error(f"Failed to report broadcast {job_id} progress: {e}")
@@ -11,6 +11,100 @@ BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_IDS = [int(id.strip()) for id in os.getenv('ADMIN_TELEGRAM_IDS', '').split(',') if id.strip()]
 BINGX_REFERRAL_LINK = os.getenv('BINGX_REFERRAL_LINK', 'https://bingx.com/your-referral-link')
 
+# Approved users are sent GROUP_LINK, unless GROUP_CHAT_ID is set: then each gets a
+# personal invite link that only admits them and works once (the bot must be an admin
+# of the group allowed to invite users). INVITE_POOL_SIZE links are created ahead of
+# approvals, and each expires INVITE_LINK_TTL seconds after it was created.
+GROUP_LINK = os.getenv('GROUP_LINK', 'https://t.me/your_group_link')
+GROUP_CHAT_ID = int(os.getenv('GROUP_CHAT_ID')) if os.getenv('GROUP_CHAT_ID') else None
+INVITE_POOL_SIZE = int(os.getenv('INVITE_POOL_SIZE', '20'))
+INVITE_LINK_TTL = float(os.getenv('INVITE_LINK_TTL', '86400'))
+
+# Webhook mode can run WORKERS bot processes that share users and admin conversations
+# through STORE_URL; updates are sharded between them by user ID. The front process
+# sets WORKER_INDEX for each worker it starts.
+WORKERS = int(os.getenv('WORKERS', '1'))
+WORKER_INDEX = int(os.getenv('WORKER_INDEX')) if os.getenv('WORKER_INDEX') else None
+
+def worker_path(path: str) -> str:
+    """Give each worker process its own copy of a local file or directory"""
+    if WORKER_INDEX is None:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker-{WORKER_INDEX}{ext}"
+
+# Storage: "wal" appends deltas to users.json.wal and compacts into users.json,
+# "json" rewrites users.json on every change, "sqlite" keeps users in SQLITE_FILE
+# (imported from DB_FILE the first time it is created), "store" keeps them in
+# STORE_URL, which must then be Redis (imported from DB_FILE while the store has
+# no users)
+DB_BACKEND = os.getenv('DB_BACKEND', 'wal')
+DB_FILE = os.getenv('DB_FILE', 'users.json')
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'users.db')
+
+# Users (with DB_BACKEND "store") and admin conversations live in this store:
+# memory:// keeps them in the process, redis://host:6379/0 shares them between
+# processes and needs the redis package
+STORE_URL = os.getenv('STORE_URL', 'memory://')
+
+# Seconds an admin's unfinished /reply conversation is kept after their last step
+ADMIN_REPLY_TTL = float(os.getenv('ADMIN_REPLY_TTL', '600'))
+
+# User-facing text is translated by <locale>.json files in LOCALES_DIR (see i18n.py);
+# each user gets the locale matching their Telegram language, else DEFAULT_LOCALE,
+# whose text is MESSAGES below
+LOCALES_DIR = os.getenv('LOCALES_DIR', 'locales')
+DEFAULT_LOCALE = os.getenv('DEFAULT_LOCALE', 'en')
+
+# Telegram file_ids of uploaded images, so each image is uploaded only once
+MEDIA_CACHE_FILE = worker_path(os.getenv('MEDIA_CACHE_FILE', 'media_cache.json'))
+
+# /broadcast job cursors and per-recipient delivery outcomes
+BROADCAST_DIR = worker_path(os.getenv('BROADCAST_DIR', 'broadcasts'))
+
+# Admin review queue of submitted UIDs and the notifications sent for each
+REVIEWS_FILE = worker_path(os.getenv('REVIEWS_FILE', 'reviews.jsonl'))
+
+# Append-only log of user state changes behind /stats; totals are saved next to it
+STATE_EVENTS_FILE = worker_path(os.getenv('STATE_EVENTS_FILE', 'state_events.log'))
+
+# With REFERRAL_SOURCE_FILE (our BingX referral export: uid,kyc,deposit_usdt), a submitted
+# UID of a referral with KYC and a deposit of at least MIN_DEPOSIT_USDT is approved without
+# an admin; other UIDs go to the admins with the reason. The export is re-read every
+# REFERRAL_REFRESH_INTERVAL seconds and cached in REFERRAL_CACHE_FILE for fast restarts.
+REFERRAL_SOURCE_FILE = os.getenv('REFERRAL_SOURCE_FILE')
+REFERRAL_CACHE_FILE = worker_path(os.getenv('REFERRAL_CACHE_FILE', 'referrals.snapshot'))
+REFERRAL_REFRESH_INTERVAL = float(os.getenv('REFERRAL_REFRESH_INTERVAL', '900'))
+MIN_DEPOSIT_USDT = float(os.getenv('MIN_DEPOSIT_USDT', '0'))
+
+# Everything the bot sends is queued by priority (replies to users, then admin
+# notifications, then broadcasts) and sent within Telegram's flood limits: at most
+# OUTBOUND_RATE messages per second overall, split between worker processes, and
+# OUTBOUND_CHAT_RATE per second to the same user. Each priority lane queues at most
+# OUTBOUND_QUEUE_SIZE messages; senders wait while their lane is full.
+OUTBOUND_RATE = float(os.getenv('OUTBOUND_RATE', '30'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+OUTBOUND_QUEUE_SIZE = int(os.getenv('OUTBOUND_QUEUE_SIZE', '1000'))
+
+# Updates from different users are processed concurrently, up to this many at once;
+# each user's own updates are always processed one at a time, in order
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+
+# Prometheus metrics are served on http://METRICS_HOST:METRICS_PORT/metrics when
+# METRICS_PORT is set; without it nothing is recorded. Worker N serves on METRICS_PORT + N.
+METRICS_PORT = int(os.getenv('METRICS_PORT')) + (WORKER_INDEX or 0) if os.getenv('METRICS_PORT') else None
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+
+# Webhook mode: set WEBHOOK_URL to the public HTTPS URL Telegram should POST updates to
+# (it must end with WEBHOOK_PATH). Without it the bot uses long polling.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+# Telegram sends this back with every update; a random one is generated at startup if unset
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
 print(ADMIN_IDS)
 
 # Bot states
@@ -25,6 +119,10 @@ class BotStates:
     DEPOSIT_NO = "DEPOSIT_NO"
     WAITING_FOR_ADMIN = "WAITING_FOR_ADMIN"
     SUPPORT = "SUPPORT"
+    VIP_AWAITING_DETAILS = "VIP_AWAITING_DETAILS"
+    COMPLETED = "COMPLETED"
+    APPROVED = "APPROVED"
+    REJECTED = "REJECTED"
 
 # Messages
 MESSAGES = {
@@ -41,5 +139,26 @@ MESSAGES = {
     'deposit_question': "Have you made a deposit?",
     'deposit_yes': "Perfect! I'm forwarding your information to our admin for verification. You'll receive the group link once verified.",
     'deposit_no': "Please make a deposit first, then let me know when you're ready!",
-    'admin_notification': "New user waiting for verification:\nUser ID: {user_id}\nUsername: @{username}\nName: {name}\nHas KYC: {has_kyc}\nHas Deposit: {has_deposit}"
+    'admin_notification': "New user waiting for verification:\nUser ID: {user_id}\nUsername: @{username}\nName: {name}\nHas KYC: {has_kyc}\nHas Deposit: {has_deposit}",
+    'referral_question': "Did you register with the referral link?",
+    'kyc_transfer_help': "To transfer your KYC:\n1. Your old account must not have had any trading activity in the last 7 days\n2. Your old account must have advanced KYC\n3. Log into your old account and transfer your KYC to the newly created account as shown in the image",
+    'kyc_complete_question': "Did you complete KYC?",
+    'deposit_prompt': "Did you make a deposit?",
+    'deposit_confirmed': "Great! Please submit your BingX UID and your Telegram username (Step 6).",
+    'uid_request': "Please reply with your BingX UID.\n⚠️ To make group management easier, please set a Telegram username in your Telegram settings if you haven't already.",
+    'uid_username_required': "❗ You must set a Telegram username before proceeding.\nPlease go to Telegram Settings > Edit Profile > Username, set a username, then type /start to begin again.",
+    'uid_received': "✅ Info received! You will be added to the group.",
+    'uid_invalid': "❗ That doesn't look like a BingX UID. Please reply with the numeric UID shown in your BingX profile.",
+    'vip_question': "Are you a VIP on another exchange or is your balance over $50,000?",
+    'vip_details': "🔥 BingX VIP Campaign – Switch & Earn BIG 🔥\n\nAlready a VIP on another exchange? Time to get more.\n\n💎 Start directly at VIP+2\n💰 Up to 1,000 USDT Trial Fund – Trade risk-free, keep the profits\n🎯 Up to 8,000 USDT Cash Rewards – Just maintain your volume\n💸 Up to 25% Trading Fee Rebate, paid daily\n⚙️ Copy Trading, Bots, Grid & more\n🥂 VIP perks: Fast support, low fees, private events\n\nGet everything you have — and more — at BingX.\n👉 Apply now and upgrade instantly",
+    'vip_exchange_question': "Which exchange do you trade on? Which one are you VIP at? Or how much is your balance?\n(Please answer below.)",
+    'vip_declined': "No problem! You can continue with the regular onboarding process.",
+    'vip_forwarded': "Your message has been forwarded to the admin.",
+    'support_username_required': "❗ You must set a Telegram username before requesting support.\nPlease go to Telegram Settings > Edit Profile > Username, set a username, then type /support again.",
+    'support_question': "Please describe your issue or question. Our admin will contact you soon.",
+    'support_forwarded': "Your issue has been forwarded to the admin. Thank you!",
+    'stale_button': "You have already answered this step. Send /start to begin again.",
+    'verification_approved': "✅ Your verification is complete! Here's your group link:\n{group_link}",
+    'verification_rejected': "❌ Your verification was not approved. Please contact support for more information.",
+    'help': "/start - Start the bot\n/support - Contact admin for help"
 } 
\ No newline at end of file
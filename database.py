@@ -1,18 +1,132 @@
+import asyncio
 import json
+import logging
 import os
-from typing import Dict, Any, Optional
+import sqlite3
+import sys
+import threading
+import time
+from collections.abc import Mapping
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class UserRecord(Mapping):
+    """One user's data, read like the dict the JSON backends store.
+
+    Uses ``__slots__`` instead of a dict per user: ``state`` and ``locale`` are interned
+    so users in the same state or locale share one string, ``has_kyc`` and
+    ``has_deposit`` are packed into one small int, and any other fields go to
+    ``extra``, which stays None for most users.
+    Fields that are None read as missing. Records are changed only through
+    ``UserDatabase.update_user``.
+    """
+
+    __slots__ = ('state', 'locale', 'username', 'name', 'flags', 'extra')
+
+    FIELDS = ('state', 'locale', 'username', 'name')
+    # Bit offset of each packed tri-state field: 0 unknown, 1 no, 2 yes
+    FLAGS = {'has_kyc': 0, 'has_deposit': 2}
+    FLAG_VALUES = (None, False, True)
+
+    def __init__(self, fields: Optional[Dict[str, Any]] = None):
+        self.state = self.locale = self.username = self.name = self.extra = None
+        self.flags = 0
+        if fields:
+            self.update(fields)
+
+    def update(self, fields: Dict[str, Any]):
+        """Set fields from a dict of changes"""
+        for key, value in fields.items():
+            if key == 'state':
+                self.state = sys.intern(value) if isinstance(value, str) else value
+            elif key == 'locale':
+                self.locale = sys.intern(value) if isinstance(value, str) else value
+            elif key == 'username':
+                self.username = value
+            elif key == 'name':
+                self.name = value
+            elif key in self.FLAGS:
+                shift = self.FLAGS[key]
+                packed = 0 if value is None else 2 if value else 1
+                self.flags = self.flags & ~(3 << shift) | packed << shift
+            elif value is not None:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+            elif self.extra and key in self.extra:
+                del self.extra[key]
+                if not self.extra:
+                    self.extra = None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key in self.FLAGS:
+            value = self.FLAG_VALUES[self.flags >> self.FLAGS[key] & 3]
+        elif key in self.FIELDS:
+            value = getattr(self, key)
+        else:
+            value = self.extra.get(key) if self.extra else None
+        return default if value is None else value
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.to_dict())
+
+    def __len__(self) -> int:
+        return len(self.to_dict())
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The fields that are set, as a plain dict"""
+        user = {}
+        if self.state is not None:
+            user['state'] = self.state
+        for key, shift in self.FLAGS.items():
+            packed = self.flags >> shift & 3
+            if packed:
+                user[key] = packed == 2
+        if self.locale is not None:
+            user['locale'] = self.locale
+        if self.username is not None:
+            user['username'] = self.username
+        if self.name is not None:
+            user['name'] = self.name
+        if self.extra:
+            user.update(self.extra)
+        return user
+
+# Returned for users that have never been stored
+DEFAULT_USER = UserRecord({'state': 'GREETING'})
 
 class UserDatabase:
+    # Seconds the background writer waits after the first change so that
+    # changes arriving close together are flushed as one batch
+    flush_interval = 0.05
+    
     def __init__(self, db_file: str = "users.json"):
         self.db_file = db_file
         self.users = self._load_users()
+        # Write batches, bytes written and seconds spent writing since startup
+        self.writes = 0
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+        # Called as listener(user_id, state) for every state change, e.g. to record funnel analytics
+        self.state_listeners: List[Callable[[int, str], None]] = []
+        self._init_writer()
     
-    def _load_users(self) -> Dict[str, Any]:
+    def _load_users(self) -> Dict[int, UserRecord]:
         """Load users from JSON file"""
         if os.path.exists(self.db_file):
             try:
                 with open(self.db_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    return {int(user_id): UserRecord(fields) for user_id, fields in json.load(f).items()}
             except (json.JSONDecodeError, FileNotFoundError):
                 return {}
         return {}
@@ -20,26 +134,134 @@ class UserDatabase:
     def _save_users(self):
         """Save users to JSON file"""
         with open(self.db_file, 'w', encoding='utf-8') as f:
-            json.dump(self.users, f, indent=2, ensure_ascii=False)
+            json.dump(self._users_json(), f, indent=2, ensure_ascii=False)
     
-    def get_user(self, user_id: int) -> Dict[str, Any]:
+    def _users_json(self) -> Dict[str, Dict[str, Any]]:
+        """Every user in the users.json layout"""
+        return {str(user_id): user.to_dict() for user_id, user in self.users.items()}
+    
+    def _init_writer(self):
+        """Reset the background writer state; changes are written synchronously until it starts"""
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self._writer: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+    
+    def _encode_changes(self, changes: Dict[str, Dict[str, Any]]) -> Any:
+        """Turn changed fields, keyed by user ID, into what _write_encoded persists.
+    
+        Runs on the caller's thread, so it may read self.users.
+        """
+        return json.dumps(self._users_json(), indent=2, ensure_ascii=False)
+    
+    def _write_encoded(self, encoded: Any):
+        """Write encoded changes to disk. May run in a worker thread, so it must not touch self.users."""
+        with open(self.db_file, 'w', encoding='utf-8') as f:
+            f.write(encoded)
+            self.bytes_written += f.tell()
+    
+    def _write(self, encoded: Any):
+        """Write encoded changes and account for the time it took"""
+        started = time.perf_counter()
+        self._write_encoded(encoded)
+        self.write_seconds += time.perf_counter() - started
+        self.writes += 1
+    
+    def _persist(self, changes: Dict[str, Dict[str, Any]]):
+        """Write changes now, or queue them for the background writer if it is running"""
+        if self.state_listeners:
+            for user_id_str, fields in changes.items():
+                if 'state' in fields:
+                    for listener in self.state_listeners:
+                        listener(int(user_id_str), fields['state'])
+        if self._writer is None:
+            self._write(self._encode_changes(changes))
+            return
+        for user_id_str, fields in changes.items():
+            self._dirty.setdefault(user_id_str, {}).update(fields)
+        self._wakeup.set()
+    
+    def _pending_fields(self, user_id_str: str) -> Dict[str, Any]:
+        """Changes for a user that have been queued but not yet written"""
+        fields = {}
+        for changes in (self._inflight, self._dirty):
+            if user_id_str in changes:
+                fields.update(changes[user_id_str])
+        return fields
+    
+    async def start_writer(self):
+        """Queue changes in memory and write them from a background task in batches"""
+        if self._writer is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._writer = asyncio.create_task(self._run_writer())
+    
+    async def _run_writer(self):
+        """Background task: wait for changes, let more accumulate, then flush them"""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to write user changes, will retry: {e}")
+                self._wakeup.set()
+    
+    async def flush(self):
+        """Write all queued changes without blocking the event loop"""
+        if self._flush_lock is None:
+            return
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._inflight, self._dirty = self._dirty, {}
+            try:
+                encoded = self._encode_changes(self._inflight)
+                await asyncio.to_thread(self._write, encoded)
+            except Exception:
+                # Put the batch back underneath anything queued since, so the next flush retries it
+                for user_id_str, fields in self._inflight.items():
+                    self._dirty[user_id_str] = {**fields, **self._dirty.get(user_id_str, {})}
+                raise
+            finally:
+                self._inflight = {}
+    
+    async def stop_writer(self):
+        """Flush queued changes, stop the background writer and go back to synchronous writes"""
+        if self._writer is None:
+            return
+        # Holding the flush lock guarantees the writer is not in the middle of a write
+        async with self._flush_lock:
+            self._writer.cancel()
+        try:
+            await self._writer
+        except asyncio.CancelledError:
+            pass
+        await self.flush()
+        self._writer = None
+    
+    def close(self):
+        """Release any resources held by the storage backend"""
+    
+    def get_user(self, user_id: int) -> Mapping:
         """Get user data by user ID"""
-        return self.users.get(str(user_id), {
-            'state': 'GREETING',
-            'has_kyc': None,
-            'has_deposit': None,
-            'username': None,
-            'name': None
-        })
+        return self.users.get(int(user_id), DEFAULT_USER)
+    
+    async def load_user(self, user_id: int) -> Mapping:
+        """Get user data by user ID from the event loop; backends that read over the network do it in a thread"""
+        return self.get_user(user_id)
     
     def update_user(self, user_id: int, **kwargs):
         """Update user data"""
-        user_id_str = str(user_id)
-        if user_id_str not in self.users:
-            self.users[user_id_str] = {}
+        user = self.users.get(int(user_id))
+        if user is None:
+            user = self.users[int(user_id)] = UserRecord()
         
-        self.users[user_id_str].update(kwargs)
-        self._save_users()
+        user.update(kwargs)
+        self._persist({str(user_id): kwargs})
     
     def set_user_state(self, user_id: int, state: str):
         """Set user's current state"""
@@ -57,10 +279,460 @@ class UserDatabase:
         """Set user's deposit status"""
         self.update_user(user_id, has_deposit=has_deposit)
     
-    def get_pending_users(self) -> Dict[str, Any]:
-        """Get all users waiting for admin verification"""
+    def transaction(self, user_id: int) -> 'UserTransaction':
+        """Group several changes to one user into a single update, committed when the block exits"""
+        return UserTransaction(self, user_id)
+    
+    def get_users_by_state(self, state: str) -> Dict[str, Any]:
+        """Get all users currently in the given state"""
         return {
-            user_id: user_data 
+            str(user_id): user_data 
             for user_id, user_data in self.users.items() 
-            if user_data.get('state') == 'WAITING_FOR_ADMIN'
-        } 
\ No newline at end of file
+            if user_data.state == state
+        }
+    
+    def get_pending_users(self) -> Dict[str, Any]:
+        """Get all users waiting for admin verification"""
+        return self.get_users_by_state('WAITING_FOR_ADMIN')
+    
+    def iter_users(self, after: int = 0, **filters) -> Iterator[Tuple[int, Mapping]]:
+        """Yield (user_id, data) in ascending user ID order for users after `after` whose fields equal `filters`"""
+        for user_id in sorted(self.users):
+            if user_id <= after:
+                continue
+            user_data = self.users.get(user_id)
+            if user_data is not None and all(user_data.get(key) == value for key, value in filters.items()):
+                yield user_id, user_data
+
+class UserTransaction:
+    """Changes to one user collected inside a ``with db.transaction(user_id)`` block.
+
+    Mirrors the ``set_*`` helpers of UserDatabase. All changes are committed with one
+    update_user call when the block exits, and discarded if it raises. After
+    ``load``, the user's record is read once and kept for the whole transaction.
+    """
+
+    def __init__(self, db: UserDatabase, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.changes: Dict[str, Any] = {}
+        self._user: Optional[Mapping] = None
+
+    async def load(self) -> 'UserTransaction':
+        """Read the user's record without blocking the event loop, for get_user to use"""
+        self._user = await self.db.load_user(self.user_id)
+        return self
+
+    def __enter__(self) -> 'UserTransaction':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+
+    def commit(self):
+        """Write the collected changes as one update"""
+        if self.changes:
+            self.db.update_user(self.user_id, **self.changes)
+            self.changes = {}
+
+    def get_user(self) -> Dict[str, Any]:
+        """Get user data including changes made in this transaction"""
+        user = dict(self._user if self._user is not None else self.db.get_user(self.user_id))
+        user.update(self.changes)
+        return user
+
+    def update_user(self, **kwargs):
+        """Update user data"""
+        self.changes.update(kwargs)
+
+    def set_user_state(self, state: str):
+        """Set user's current state"""
+        self.update_user(state=state)
+
+    def set_user_info(self, username: str = None, name: str = None):
+        """Set user's basic information"""
+        self.update_user(username=username, name=name)
+
+    def set_kyc_status(self, has_kyc: bool):
+        """Set user's KYC status"""
+        self.update_user(has_kyc=has_kyc)
+
+    def set_deposit_status(self, has_deposit: bool):
+        """Set user's deposit status"""
+        self.update_user(has_deposit=has_deposit)
+
+class WALUserDatabase(UserDatabase):
+    """User database that appends per-user deltas to a write-ahead log.
+
+    The snapshot keeps the users.json format. Each update appends one JSON line
+    ``{"id": ..., "set": {...}}`` to ``<db_file>.wal``; the log is fsynced in groups
+    and folded into a fresh snapshot once it grows past ``compact_every`` records.
+    """
+
+    def __init__(self, db_file: str = "users.json", log_file: Optional[str] = None,
+                 sync_every: int = 64, sync_interval: float = 1.0, compact_every: int = 10000):
+        self.log_file = log_file or f"{db_file}.wal"
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self._log_records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        super().__init__(db_file)
+        self._log = open(self.log_file, 'a', encoding='utf-8')
+
+    def _load_users(self) -> Dict[int, UserRecord]:
+        """Load the snapshot and replay the log on top of it"""
+        users = super()._load_users()
+        self._log_records = replay_log(self.log_file, users)
+        return users
+
+    def _encode_snapshot(self) -> str:
+        """Serialize every user for a compacted snapshot"""
+        self._log_records = 0
+        return json.dumps(self._users_json(), ensure_ascii=False, separators=(',', ':'))
+
+    def _encode_changes(self, changes: Dict[str, Dict[str, Any]]) -> tuple:
+        """Encode one log record per user, or a whole snapshot when the log is due for compaction"""
+        self._log_records += len(changes)
+        if self._log_records >= self.compact_every:
+            # The snapshot already contains these changes, so they need no log records
+            return None, self._encode_snapshot()
+        lines = ''.join(
+            json.dumps({'id': user_id_str, 'set': fields}, ensure_ascii=False, separators=(',', ':')) + '\n'
+            for user_id_str, fields in changes.items()
+        )
+        return lines, None
+
+    def _write_encoded(self, encoded: tuple):
+        """Append log records and group-commit them, or replace the snapshot"""
+        lines, snapshot = encoded
+        if snapshot is not None:
+            self._write_snapshot(snapshot)
+            return
+        offset = self._log.tell()
+        self._log.write(lines)
+        self._log.flush()
+        self.bytes_written += self._log.tell() - offset
+        self._unsynced += lines.count('\n')
+        if (self._unsynced >= self.sync_every
+                or time.monotonic() - self._last_sync >= self.sync_interval):
+            self.sync()
+
+    def _write_snapshot(self, snapshot: str):
+        """Atomically replace the snapshot file and start an empty log"""
+        tmp_file = f"{self.db_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+            self.bytes_written += f.tell()
+        os.replace(tmp_file, self.db_file)
+        # Records are absolute field values, so replaying a log that survived a crash
+        # at this point over the new snapshot is harmless
+        self._log.close()
+        self._log = open(self.log_file, 'w', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        """Flush appended records to stable storage"""
+        if self._unsynced:
+            os.fsync(self._log.fileno())
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def compact(self):
+        """Write a new snapshot and start an empty log"""
+        self._write_snapshot(self._encode_snapshot())
+
+    def close(self):
+        """Sync the log and close it"""
+        if not self._log.closed:
+            self.sync()
+            self._log.close()
+
+class SQLiteUserDatabase(UserDatabase):
+    """User database stored in SQLite.
+
+    Runs in WAL mode with an index on ``state``, so per-state queries do not scan
+    every user. Each update is a single-row UPSERT; fields without a dedicated
+    column are merged into the JSON ``extra`` column.
+    """
+
+    COLUMNS = ('state', 'has_kyc', 'has_deposit', 'username', 'name', 'uid_submission')
+    BOOL_COLUMNS = ('has_kyc', 'has_deposit')
+
+    def __init__(self, db_file: str = "users.db"):
+        self.db_file = db_file
+        self.writes = 0
+        # SQLite's own page writes are not visible here, so this counts the size of the values written
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+        self.state_listeners: List[Callable[[int, str], None]] = []
+        self._upsert_sql: Dict[tuple, str] = {}
+        # The background writer commits from a worker thread while handlers read on the event loop
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, "
+            "state TEXT NOT NULL DEFAULT 'GREETING', "
+            "has_kyc INTEGER, "
+            "has_deposit INTEGER, "
+            "username TEXT, "
+            "name TEXT, "
+            "uid_submission TEXT, "
+            "extra TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_state ON users(state)")
+        self.conn.commit()
+        self._init_writer()
+
+    def _row_to_user(self, row: tuple) -> Dict[str, Any]:
+        """Convert a users row to the dict layout used by the JSON backends"""
+        user = {}
+        for column, value in zip(self.COLUMNS, row):
+            if value is None:
+                continue
+            user[column] = bool(value) if column in self.BOOL_COLUMNS else value
+        if row[-1]:
+            user.update(json.loads(row[-1]))
+        return user
+
+    def _upsert_statement(self, user_id: int, fields: Dict[str, Any]) -> tuple:
+        """Build the SQL and parameters that insert or update one user row with only the given fields"""
+        columns = tuple(key for key in fields if key in self.COLUMNS)
+        extra = {key: value for key, value in fields.items() if key not in self.COLUMNS}
+        key = (columns, bool(extra))
+        sql = self._upsert_sql.get(key)
+        if sql is None:
+            names = ('user_id',) + columns + (('extra',) if extra else ())
+            assignments = [f"{column} = excluded.{column}" for column in columns]
+            if extra:
+                assignments.append("extra = json_patch(COALESCE(users.extra, '{}'), excluded.extra)")
+            sql = (
+                f"INSERT INTO users ({', '.join(names)}) VALUES ({', '.join('?' * len(names))}) "
+                f"ON CONFLICT(user_id) DO "
+                + (f"UPDATE SET {', '.join(assignments)}" if assignments else "NOTHING")
+            )
+            self._upsert_sql[key] = sql
+        params = [int(user_id)] + [fields[column] for column in columns]
+        if extra:
+            params.append(json.dumps(extra, ensure_ascii=False))
+        return sql, params
+
+    def _encode_changes(self, changes: Dict[str, Dict[str, Any]]) -> list:
+        """Build one UPSERT per changed user"""
+        return [self._upsert_statement(int(user_id_str), fields) for user_id_str, fields in changes.items()]
+
+    def _write_encoded(self, statements: list):
+        """Run the UPSERTs in one transaction"""
+        with self._lock, self.conn:
+            for sql, params in statements:
+                self.conn.execute(sql, params)
+        self.bytes_written += sum(len(str(param)) for _, params in statements for param in params)
+
+    def close(self):
+        """Close the SQLite connection"""
+        with self._lock:
+            self.conn.close()
+
+    def get_user(self, user_id: int) -> Dict[str, Any]:
+        """Get user data by user ID, including changes not yet written"""
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)}, extra FROM users WHERE user_id = ?", (int(user_id),)
+            ).fetchone()
+        pending = self._pending_fields(str(user_id))
+        if row is None and not pending:
+            return DEFAULT_USER
+        user = self._row_to_user(row) if row is not None else {}
+        user.update(pending)
+        return user
+
+    def update_user(self, user_id: int, **kwargs):
+        """Update user data"""
+        self._persist({str(user_id): kwargs})
+
+    def get_users_by_state(self, state: str) -> Dict[str, Any]:
+        """Get all users currently in the given state, using the state index"""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT user_id, {', '.join(self.COLUMNS)}, extra FROM users WHERE state = ?", (state,)
+            ).fetchall()
+        users = {str(row[0]): self._row_to_user(row[1:]) for row in rows}
+        # Queued changes may move users into or out of the state
+        for user_id_str in {**self._inflight, **self._dirty}:
+            user = self.get_user(int(user_id_str))
+            if user.get('state') == state:
+                users[user_id_str] = user
+            else:
+                users.pop(user_id_str, None)
+        return users
+
+    def iter_users(self, after: int = 0, page_size: int = 500, **filters) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Yield matching users in ascending user ID order, reading the table one page at a time"""
+        columns = [key for key in filters if key in self.COLUMNS]
+        # `column = NULL` matches no row, so users without a value are selected with IS NULL
+        where = ''.join(f" AND {column} IS NULL" if filters[column] is None else f" AND {column} = ?" for column in columns)
+        params = [filters[column] for column in columns if filters[column] is not None]
+        sql = (
+            f"SELECT user_id, {', '.join(self.COLUMNS)}, extra FROM users "
+            f"WHERE user_id > ?{where} ORDER BY user_id LIMIT ?"
+        )
+        while True:
+            with self._lock:
+                rows = self.conn.execute(sql, [after] + params + [page_size]).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                user = self._row_to_user(row[1:])
+                user.update(self._pending_fields(str(row[0])))
+                if all(user.get(key) == value for key, value in filters.items()):
+                    yield row[0], user
+            after = rows[-1][0]
+
+    def import_json(self, json_file: str) -> int:
+        """Import users from a users.json snapshot (plus its .wal log, if any). Returns the user count."""
+        users = UserDatabase(json_file).users
+        replay_log(f"{json_file}.wal", users)
+        self._write(self._encode_changes({user_id: user.to_dict() for user_id, user in users.items()}))
+        return len(users)
+
+class StoreUserDatabase(UserDatabase):
+    """User database kept in a shared store (see store.py), so several bot processes serve the same users.
+
+    Each user is a record of fields in the ``users`` namespace. Reads go to the
+    store, overlaid with changes this process has queued but not written yet, and
+    writes are batched by the background writer like the other backends. Updates
+    are sharded between processes by user, so a user's onboarding fields are only
+    changed by one process at a time. The store indexes users by ``state``, so
+    listing the users in a state does not read every user.
+    """
+
+    namespace = 'users'
+    indexed = ('state',)
+
+    def __init__(self, store):
+        self.store = store
+        self.writes = 0
+        # The store's own writes are not visible here, so this counts the size of the values written
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+        self.state_listeners: List[Callable[[int, str], None]] = []
+        self._init_writer()
+
+    def _encode_changes(self, changes: Dict[str, Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """Copy the changed fields, keyed by integer user ID"""
+        return {int(user_id_str): dict(fields) for user_id_str, fields in changes.items()}
+
+    def _write_encoded(self, changes: Dict[int, Dict[str, Any]]):
+        """Write the changed fields of every user in one round trip"""
+        self.store.update_records(self.namespace, changes, self.indexed)
+        self.bytes_written += sum(len(str(value)) for fields in changes.values() for value in fields.values())
+
+    def _with_pending(self, user_id: int, user: Dict[str, Any], pending: Optional[Dict[str, Any]] = None) -> Mapping:
+        if pending is None:
+            pending = self._pending_fields(str(user_id))
+        if not user and not pending:
+            return DEFAULT_USER
+        user.update(pending)
+        return user
+
+    def get_user(self, user_id: int) -> Mapping:
+        """Get user data by user ID, including changes not yet written"""
+        return self._with_pending(user_id, self.store.get_records(self.namespace, [int(user_id)])[0])
+
+    async def load_user(self, user_id: int) -> Mapping:
+        """Get user data by user ID, including changes not yet written, reading the store in a thread"""
+        # Taken first: changes written while the store is read are in what it returns
+        pending = self._pending_fields(str(user_id))
+        records = await asyncio.to_thread(self.store.get_records, self.namespace, [int(user_id)])
+        return self._with_pending(user_id, records[0], pending)
+
+    def update_user(self, user_id: int, **kwargs):
+        """Update user data"""
+        self._persist({str(user_id): kwargs})
+
+    def get_users_by_state(self, state: str) -> Dict[str, Any]:
+        """Get all users currently in the given state"""
+        user_ids = self.store.indexed_ids(self.namespace, 'state', state)
+        users = {}
+        for start in range(0, len(user_ids), 500):
+            page = user_ids[start:start + 500]
+            for user_id, user in zip(page, self.store.get_records(self.namespace, page)):
+                user = self._with_pending(user_id, user)
+                # The index can still list users whose state changed since
+                if user.get('state') == state:
+                    users[str(user_id)] = user
+        # Users whose state changes are queued are not in the store's index yet
+        for user_id_str in {**self._inflight, **self._dirty}:
+            user = self.get_user(int(user_id_str))
+            if user.get('state') == state:
+                users[user_id_str] = user
+        return users
+
+    def iter_users(self, after: int = 0, page_size: int = 500, **filters) -> Iterator[Tuple[int, Mapping]]:
+        """Yield matching users in ascending user ID order, reading the store one page at a time"""
+        while True:
+            user_ids = self.store.record_ids(self.namespace, after, page_size)
+            if not user_ids:
+                return
+            for user_id, user in zip(user_ids, self.store.get_records(self.namespace, user_ids)):
+                user = self._with_pending(user_id, user)
+                if all(user.get(key) == value for key, value in filters.items()):
+                    yield user_id, user
+            after = user_ids[-1]
+
+    def import_json(self, json_file: str) -> int:
+        """Import users from a users.json snapshot (plus its .wal log, if any). Returns the user count."""
+        users = UserDatabase(json_file).users
+        replay_log(f"{json_file}.wal", users)
+        self._write({user_id: user.to_dict() for user_id, user in users.items()})
+        return len(users)
+
+def replay_log(log_file: str, users: Dict[int, UserRecord]) -> int:
+    """Apply write-ahead log records to `users` in place and return how many were applied"""
+    if not os.path.exists(log_file):
+        return 0
+    applied = 0
+    with open(log_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn tail from a crash mid-append; everything before it is intact
+                break
+            user_id = int(record['id'])
+            if user_id not in users:
+                users[user_id] = UserRecord()
+            users[user_id].update(record['set'])
+            applied += 1
+    return applied
+
+def open_database(backend: str = "wal", db_file: str = "users.json",
+                  sqlite_file: str = "users.db", store=None) -> UserDatabase:
+    """Create a user database for the configured storage backend ("store" keeps users in `store`)"""
+    if backend == "json":
+        return UserDatabase(db_file)
+    if backend == "wal":
+        return WALUserDatabase(db_file)
+    if backend == "sqlite":
+        is_new = not os.path.exists(sqlite_file)
+        db = SQLiteUserDatabase(sqlite_file)
+        if is_new and os.path.exists(db_file):
+            db.import_json(db_file)
+        return db
+    if backend == "store":
+        db = StoreUserDatabase(store)
+        # Every worker process opens the database; only the first to mark the import runs it,
+        # so a late one never overwrites users changed since
+        if (not store.record_ids(StoreUserDatabase.namespace, 0, 1) and os.path.exists(db_file)
+                and store.add(StoreUserDatabase.namespace, 'imported', db_file)):
+            db.import_json(db_file)
+        return db
+    raise ValueError(f"Unknown database backend: {backend}")
@@ -0,0 +1,94 @@
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Hashable, Iterable, Optional
+
+from telegram import CallbackQuery, Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """Remembers keys for `ttl` seconds, holding at most `maxsize` of them.
+
+    Every key lives equally long, so insertion order is expiry order and expired
+    keys are dropped from the front in amortized O(1).
+    """
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._expiry: 'OrderedDict[Hashable, float]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    def add(self, key: Hashable) -> bool:
+        """Remember a key; False if it is already remembered"""
+        now = time.monotonic()
+        while self._expiry:
+            oldest, expires = next(iter(self._expiry.items()))
+            if expires > now:
+                break
+            del self._expiry[oldest]
+        if key in self._expiry:
+            return False
+        self._expiry[key] = now + self.ttl
+        if len(self._expiry) > self.maxsize:
+            self._expiry.popitem(last=False)
+        return True
+
+    def discard(self, key: Hashable):
+        """Forget a key"""
+        self._expiry.pop(key, None)
+
+class UpdateDeduplicator:
+    """Drops updates that would repeat work before any handler sees them.
+
+    Registered as a TypeHandler in a group before the others. An update is a
+    duplicate when its update_id was seen within ``update_ttl`` seconds (Telegram
+    redelivering it after a polling or webhook retry), or when it presses the same
+    button on the same message as a press within ``callback_ttl`` seconds (a
+    double-tap). Duplicate button presses are answered so the client stops its
+    spinner, and nothing else is done. Once a press has edited its message into a
+    different keyboard (see ``message_edited``), pressing one of its buttons is a new
+    answer even if the same button was pressed just before; a second tap on a button
+    that left the keyboard as it was is still a double-tap.
+    """
+
+    def __init__(self, update_ttl: float = 3600, callback_ttl: float = 10, maxsize: int = 100000):
+        self.update_ids = TTLCache(update_ttl, maxsize)
+        self.callbacks = TTLCache(callback_ttl, maxsize)
+        # Duplicates dropped, by 'update' or 'callback', and updates let through
+        self.hits: Counter = Counter()
+        self.misses = 0
+
+    def duplicate_kind(self, update: Update) -> Optional[str]:
+        """'update' or 'callback' if the update repeats an earlier one, else None"""
+        if not self.update_ids.add(update.update_id):
+            return 'update'
+        query = update.callback_query
+        if query is not None and query.message is not None:
+            if not self.callbacks.add((query.from_user.id, query.message.message_id, query.data)):
+                return 'callback'
+        return None
+
+    def message_edited(self, query: CallbackQuery, buttons: Iterable[str]):
+        """Let presses of `buttons` through again on the message the press `query` edited to show them"""
+        if query.message is not None:
+            for data in buttons:
+                self.callbacks.discard((query.from_user.id, query.message.message_id, data))
+
+    async def __call__(self, update: object, context: ContextTypes.DEFAULT_TYPE):
+        if not isinstance(update, Update):
+            return
+        kind = self.duplicate_kind(update)
+        if kind is None:
+            self.misses += 1
+            return
+        self.hits[kind] += 1
+        logger.debug(f"Dropping duplicate {kind} {update.update_id}")
+        if kind == 'callback':
+            # A redelivered update's query was answered the first time
+            await update.callback_query.answer()
+        raise ApplicationHandlerStop
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates from different users concurrently and each user's updates in order.
+
+    Handlers read and write a user's state without locks, so two updates from the
+    same user must never overlap. Updates are serialized per ``effective_user.id``
+    and at most ``max_running_updates`` run at once overall. The per-user lock is
+    taken before a processing slot, so a burst from one user waits in line without
+    holding slots other users need. Updates without a user only take a slot.
+
+    If ``observe`` is given, it is called with each update and the seconds its
+    handlers took.
+    """
+
+    # Bound on updates admitted at once, counting those waiting for their user's turn
+    max_admitted_updates = 100000
+
+    def __init__(self, max_running_updates: int, observe: Optional[Callable[[object, float], None]] = None):
+        # The base class semaphore only bounds admitted updates; _slots limits running ones
+        super().__init__(max(self.max_admitted_updates, max_running_updates))
+        self.max_running_updates = max_running_updates
+        self.observe = observe
+        # Updates admitted and not finished, and those of them whose handlers are running
+        self.admitted = 0
+        self.running = 0
+        self._slots = asyncio.Semaphore(max_running_updates)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_waiting: Dict[int, int] = {}
+
+    @staticmethod
+    def user_key(update: object) -> Optional[int]:
+        """The user whose updates must stay ordered, if any"""
+        if isinstance(update, Update) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def _run(self, update: object, coroutine: Awaitable[Any]):
+        """Run the handlers of an update that holds a slot"""
+        self.running += 1
+        started = time.perf_counter()
+        try:
+            await coroutine
+        finally:
+            self.running -= 1
+            if self.observe is not None:
+                self.observe(update, time.perf_counter() - started)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]):
+        self.admitted += 1
+        try:
+            await self._process(update, coroutine)
+        finally:
+            self.admitted -= 1
+
+    async def _process(self, update: object, coroutine: Awaitable[Any]):
+        user_id = self.user_key(update)
+        if user_id is None:
+            async with self._slots:
+                await self._run(update, coroutine)
+            return
+
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = self._user_locks[user_id] = asyncio.Lock()
+        self._user_waiting[user_id] = self._user_waiting.get(user_id, 0) + 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which preserves arrival order
+            async with lock:
+                async with self._slots:
+                    await self._run(update, coroutine)
+        finally:
+            self._user_waiting[user_id] -= 1
+            if not self._user_waiting[user_id]:
+                del self._user_waiting[user_id]
+                del self._user_locks[user_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
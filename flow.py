@@ -0,0 +1,276 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple, Union
+
+from telegram import Bot, CallbackQuery, Update
+from telegram.error import BadRequest
+from telegram.ext import ContextTypes
+
+from database import UserDatabase, UserTransaction
+from media import StepComposer
+from metrics import Metrics
+from templates import Prompt, Templates
+
+logger = logging.getLogger(__name__)
+
+# Custom step logic, called as action(update, context, tx, argument); returning False cancels the
+# transition and returning a state stores that state instead of the transition's
+Action = Callable[[Update, ContextTypes.DEFAULT_TYPE, UserTransaction, str], Awaitable[Union[bool, str, None]]]
+
+@dataclass(frozen=True)
+class Transition:
+    """What a button press or text reply does.
+
+    ``action`` runs first and can cancel the transition by returning False, or pick
+    the state to store by returning it. Then ``state`` and ``fields`` are stored in
+    one write and ``prompts`` are sent in order.
+    A button transition with ``from_states`` only runs while the user is in one of
+    them; presses on keyboards from steps the user has moved past are dropped.
+    """
+    state: Optional[str] = None
+    fields: Mapping[str, Any] = field(default_factory=dict)
+    prompts: Tuple[str, ...] = ()
+    action: Optional[Action] = None
+    from_states: Tuple[str, ...] = ()
+
+class ActivePrompts:
+    """The last message the flow sent each user, as long as nothing came after it.
+
+    Only text messages are tracked, since only those can be edited into the next
+    prompt. The oldest entries are dropped past ``maxsize`` users.
+    """
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self.messages: 'OrderedDict[int, int]' = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[int]:
+        return self.messages.get(user_id)
+
+    def set(self, user_id: int, message_id: int):
+        self.messages[user_id] = message_id
+        self.messages.move_to_end(user_id)
+        if len(self.messages) > self.maxsize:
+            self.messages.popitem(last=False)
+
+    def discard(self, user_id: int):
+        self.messages.pop(user_id, None)
+
+class FlowEngine:
+    """Runs the onboarding flows from tables of prompts and transitions.
+
+    Callback data is ``<route>`` or ``<route>:<argument>`` and is routed with a single
+    dict lookup. Text replies are routed by the user's current state, falling back to
+    ``default_text``. The tables are checked when the engine is created, so a button
+    pointing at a missing route or a missing prompt fails at startup. State changes
+    are counted in ``metrics`` when it is enabled.
+
+    When a button on the user's latest message leads to text-only prompts, that
+    message is edited into them instead of sending new ones, so answering a question
+    replaces it with the next one rather than piling up keyboards.
+
+    Prompts are compiled into ready-to-send payloads once, here. ``variant_of`` picks
+    a variant (e.g. a language) for a user record, and ``variants`` returns the
+    prompts of a variant, replacing some or all of ``prompts``; each variant is
+    compiled the first time one of its users needs it and kept, so sending a prompt
+    stays a lookup however many variants are in use. Users without a variant get
+    ``prompts``. Stale button presses are answered with the text of the
+    ``stale_prompt`` prompt of the user's variant. ``on_edit`` is called with the
+    callback query of each press that edited its message onto a different keyboard,
+    and the callback data of the new keyboard's buttons.
+
+    ``contact_fields`` is called with the update and the user's record on every
+    transition that stores something for the user, and returns fields to store
+    with it, e.g. the language of a user who has none stored yet, so the variant is
+    picked from it right away. Transitions that store nothing, such as an admin's
+    approve or /queue presses, do not create a record for the user who made them.
+    """
+
+    def __init__(self, db: UserDatabase, steps: StepComposer, prompts: Dict[str, Prompt],
+                 callbacks: Dict[str, Transition], texts: Dict[str, Transition], default_text: Transition,
+                 metrics: Optional[Metrics] = None, stale_prompt: Optional[str] = None,
+                 variants: Optional[Callable[[str], Dict[str, Prompt]]] = None,
+                 variant_of: Optional[Callable[[Mapping[str, Any]], Optional[str]]] = None,
+                 on_edit: Optional[Callable[[CallbackQuery, List[str]], None]] = None,
+                 contact_fields: Optional[Callable[[Update, Mapping[str, Any]], Mapping[str, Any]]] = None):
+        self.db = db
+        self.on_edit = on_edit
+        self.contact_fields = contact_fields
+        self.stale_prompt = stale_prompt
+        self.steps = steps
+        self.metrics = metrics or Metrics()
+        self.prompts = prompts
+        self.callbacks = callbacks
+        self.texts = texts
+        self.default_text = default_text
+        self.variants = variants
+        self.variant_of = variant_of if variants is not None else None
+        self.active = ActivePrompts()
+        # Transitions shown by editing the answered message, and the prompts that did not need sending
+        self.edits = 0
+        self.messages_saved = 0
+        self._validate()
+        # Only button presses edit the pressed message, so only their prompts need edits compiled
+        self._sequences = {transition.prompts for transition in callbacks.values()}
+        self.templates = Templates(prompts, self._sequences)
+        self.variant_templates: Dict[str, Templates] = {}
+
+    def _validate(self):
+        """Check that every button has a route and every transition's prompts exist"""
+        self._validate_prompts(None, self.prompts)
+        transitions = [*self.callbacks.values(), *self.texts.values(), self.default_text]
+        for transition in transitions:
+            for name in transition.prompts:
+                if name not in self.prompts:
+                    raise ValueError(f"Unknown prompt {name!r}")
+        if self.stale_prompt is not None and self.stale_prompt not in self.prompts:
+            raise ValueError(f"Unknown stale prompt {self.stale_prompt!r}")
+
+    def _validate_prompts(self, variant: Optional[str], prompts: Dict[str, Prompt]):
+        for name, prompt in prompts.items():
+            if name not in self.prompts:
+                raise ValueError(f"Variant {variant!r} has unknown prompt {name!r}")
+            for row in prompt.buttons:
+                for label, data in row:
+                    if self.route(data)[0] is None:
+                        raise ValueError(f"Button {label!r} of prompt {name!r} has no route for {data!r}")
+
+    def _compile_variant(self, variant: str) -> Templates:
+        try:
+            prompts = self.variants(variant)
+            self._validate_prompts(variant, prompts)
+            templates = Templates({**self.prompts, **prompts}, self._sequences)
+        except ValueError as e:
+            logger.error(f"Variant {variant!r} is invalid, using the default prompts: {e}")
+            templates = self.templates
+        self.variant_templates[variant] = templates
+        return templates
+
+    def templates_of(self, user: Mapping[str, Any]) -> Templates:
+        """The compiled prompts of a user's variant, compiling them on first use"""
+        if self.variant_of is None:
+            return self.templates
+        variant = self.variant_of(user)
+        if variant is None:
+            return self.templates
+        templates = self.variant_templates.get(variant)
+        return templates if templates is not None else self._compile_variant(variant)
+
+    def resolve(self, data: str) -> Tuple[Optional[str], str]:
+        """Split callback data into its route name (None if there is no such route) and argument"""
+        name, _, argument = data.partition(':')
+        if name not in self.callbacks and not argument:
+            # Buttons sent before arguments moved behind ':' carry them after the last '_'
+            name, _, argument = data.rpartition('_')
+        return (name if name in self.callbacks else None), argument
+
+    def route(self, data: str) -> Tuple[Optional[Transition], str]:
+        """Find the transition for callback data and its argument"""
+        name, argument = self.resolve(data)
+        return self.callbacks.get(name), argument
+
+    async def send(self, bot: Bot, chat_id: int, name: str, templates: Optional[Templates] = None):
+        """Send one prompt"""
+        payload = (templates or self.templates).payloads[name]
+        messages = await self.steps.send(bot, chat_id, name, payload)
+        if messages and messages[-1].text is not None:
+            self.active.set(chat_id, messages[-1].message_id)
+        else:
+            self.active.discard(chat_id)
+
+    async def edit_in_place(self, update: Update, bot: Bot, transition: Transition,
+                            templates: Optional[Templates] = None) -> bool:
+        """Show a transition's prompts by editing the message whose button was pressed.
+
+        Only done when that message is the last one the user got, the transition has
+        no action that might send messages of its own, and the prompts are text that
+        fits in one message with a keyboard on the last prompt at most.
+        """
+        query = update.callback_query
+        if query is None or query.message is None or transition.action is not None:
+            return False
+        if self.active.get(query.from_user.id) != query.message.message_id:
+            return False
+        templates = templates or self.templates
+        edit = templates.edits.get(transition.prompts)
+        if edit is None:
+            return False
+        text, reply_markup = edit
+        try:
+            await bot.edit_message_text(
+                chat_id=query.message.chat_id,
+                message_id=query.message.message_id,
+                text=text,
+                reply_markup=reply_markup
+            )
+        except BadRequest as e:
+            # Pressing the same answer again leaves the message as it is
+            if 'not modified' not in e.message.lower():
+                logger.warning(f"Could not edit prompt {query.message.message_id} for {query.from_user.id}, sending instead: {e}")
+                return False
+        else:
+            if self.on_edit is not None:
+                buttons = [data for row in templates.prompts[transition.prompts[-1]].buttons for _, data in row]
+                pressed = query.message.reply_markup
+                shown = [button.callback_data for row in pressed.inline_keyboard for button in row] if pressed else []
+                # Pressing a button that brings back the same keyboard is still a double-tap when repeated
+                if buttons != shown:
+                    self.on_edit(query, buttons)
+        self.edits += 1
+        self.messages_saved += len(transition.prompts)
+        return True
+
+    async def run(self, update: Update, context: ContextTypes.DEFAULT_TYPE, transition: Transition, argument: str = ''):
+        """Apply a transition for the user who sent the update"""
+        user_id = update.effective_user.id
+        tx = await self.db.transaction(user_id).load()
+        result = await transition.action(update, context, tx, argument) if transition.action else None
+        if result is False:
+            return
+        state = result if isinstance(result, str) else transition.state
+        if transition.fields:
+            tx.update_user(**transition.fields)
+        if state:
+            if self.metrics.enabled:
+                previous = tx.get_user().get('state') or 'NONE'
+                self.metrics.inc('bot_state_transitions_total', (('from', previous), ('to', state)))
+            tx.set_user_state(state)
+        user = tx.get_user()
+        if self.contact_fields is not None and tx.changes:
+            fields = self.contact_fields(update, user)
+            if fields:
+                tx.update_user(**fields)
+                user.update(fields)
+        templates = self.templates_of(user)
+        tx.commit()
+        if update.callback_query is None or transition.action is not None:
+            # The user's own message, or whatever the action sent, now comes after the last prompt
+            self.active.discard(user_id)
+        if transition.prompts and not await self.edit_in_place(update, context.bot, transition, templates):
+            for name in transition.prompts:
+                await self.send(context.bot, user_id, name, templates)
+
+    async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Route a button press"""
+        query = update.callback_query
+        name, argument = self.resolve(query.data or '')
+        transition = self.callbacks.get(name)
+        if transition is None:
+            await query.answer()
+            logger.warning(f"No route for callback data {query.data!r} from {query.from_user.id}")
+            return
+        if transition.from_states:
+            user = await self.db.load_user(query.from_user.id)
+            if user.get('state') not in transition.from_states:
+                self.metrics.inc('bot_stale_callbacks_total', (('route', name),))
+                stale_prompt = self.templates_of(user).prompts.get(self.stale_prompt)
+                await query.answer(stale_prompt.text if stale_prompt else None)
+                return
+        await query.answer()
+        await self.run(update, context, transition, argument)
+
+    async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Route a text reply by the user's current state"""
+        state = (await self.db.load_user(update.effective_user.id)).get('state')
+        await self.run(update, context, self.texts.get(state, self.default_text))
@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+class Locale:
+    """One locale's strings, resolved through its fallback chain with fixed placeholders filled in.
+
+    ``text`` looks up a message by its MESSAGES key and ``label`` translates a button
+    label given in English, returning it unchanged when there is no translation.
+    """
+
+    __slots__ = ('code', 'messages', 'labels')
+
+    def __init__(self, code: str, messages: Dict[str, str], labels: Dict[str, str]):
+        self.code = code
+        self.messages = messages
+        self.labels = labels
+
+    def text(self, key: str) -> str:
+        return self.messages[key]
+
+    def label(self, source: str) -> str:
+        return self.labels.get(source, source)
+
+class MessageCatalog:
+    """User-facing strings per locale, each locale loaded from its file on first use.
+
+    ``locales_dir`` holds one ``<code>.json`` per locale (codes are lowercase, e.g.
+    ``es`` or ``pt-br``) with ``messages`` keyed like config.MESSAGES, ``buttons``
+    keyed by the English label and an optional ``fallback`` locale. A locale falls
+    back to its ``fallback``, else to its language without the region, and finally to
+    ``default_messages``, so a file only needs the strings that differ. Placeholders
+    named in ``params`` (e.g. the referral link) are filled in when a locale is
+    loaded; others, such as ``{user_id}``, are left for the caller.
+    """
+
+    def __init__(self, default_messages: Dict[str, str], locales_dir: str = "locales",
+                 default_locale: str = "en", params: Optional[Dict[str, Any]] = None):
+        self.locales_dir = locales_dir
+        self.default_locale = default_locale
+        self.params = {f"{{{name}}}": str(value) for name, value in (params or {}).items()}
+        # Only the file names are read up front
+        self.available = {default_locale}
+        if os.path.isdir(locales_dir):
+            self.available.update(name[:-len('.json')] for name in os.listdir(locales_dir) if name.endswith('.json'))
+        self._files: Dict[str, Dict[str, Any]] = {default_locale: {'messages': default_messages}}
+        self._locales: Dict[str, Locale] = {}
+
+    def resolve(self, language_code: Optional[str]) -> str:
+        """The available locale closest to a Telegram language_code (e.g. 'pt-BR')"""
+        if not language_code:
+            return self.default_locale
+        code = language_code.lower().replace('_', '-')
+        if code in self.available:
+            return code
+        language = code.split('-')[0]
+        return language if language in self.available else self.default_locale
+
+    def locale(self, code: Optional[str]) -> Locale:
+        """A locale's compiled strings, loading them the first time; unknown codes get the default locale"""
+        locale = self._locales.get(code)
+        if locale is None:
+            if code not in self.available:
+                code = self.default_locale
+            locale = self._locales.get(code) or self._load(code)
+        return locale
+
+    def chain(self, code: str) -> List[str]:
+        """A locale followed by the locales it falls back to, ending with the default one"""
+        chain = []
+        while code not in chain and code != self.default_locale:
+            chain.append(code)
+            fallback = self._file(code).get('fallback') or code.rpartition('-')[0]
+            code = fallback if fallback in self.available else self.default_locale
+        chain.append(self.default_locale)
+        return chain
+
+    def _file(self, code: str) -> Dict[str, Any]:
+        data = self._files.get(code)
+        if data is None:
+            path = os.path.join(self.locales_dir, f"{code}.json")
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.error(f"Could not load locale file {path}: {e}")
+                data = {}
+            self._files[code] = data
+        return data
+
+    def _load(self, code: str) -> Locale:
+        messages: Dict[str, str] = {}
+        labels: Dict[str, str] = {}
+        for fallback in reversed(self.chain(code)):
+            data = self._file(fallback)
+            messages.update(data.get('messages', {}))
+            labels.update(data.get('buttons', {}))
+        for key, text in messages.items():
+            for placeholder, value in self.params.items():
+                text = text.replace(placeholder, value)
+            messages[key] = text
+        locale = self._locales[code] = Locale(code, messages, labels)
+        logger.info(f"Loaded locale {code} (falls back to {', '.join(self.chain(code)[1:]) or 'nothing'})")
+        return locale
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from telegram import Bot, InlineKeyboardMarkup, InputMediaPhoto, Message
+from telegram.constants import MediaGroupLimit, MessageLimit
+from telegram.error import BadRequest
+
+logger = logging.getLogger(__name__)
+
+class MediaRegistry:
+    """Uploads each image once and sends it by Telegram file_id afterwards.
+
+    file_ids are stored in ``cache_file`` keyed by the SHA-256 of the file contents,
+    so an edited image is uploaded again automatically.
+    """
+
+    def __init__(self, cache_file: str = "media_cache.json"):
+        self.cache_file = cache_file
+        self.file_ids: Dict[str, str] = self._load()
+        self._digests: Dict[str, Tuple[int, int, str]] = {}  # path -> (mtime_ns, size, sha256)
+        self._upload_locks: Dict[str, asyncio.Lock] = {}
+
+    def _load(self) -> Dict[str, str]:
+        """Load cached file_ids"""
+        if os.path.exists(self.cache_file):
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (json.JSONDecodeError, FileNotFoundError):
+                return {}
+        return {}
+
+    def _save(self):
+        """Save cached file_ids"""
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.file_ids, f, indent=2)
+        os.replace(tmp_file, self.cache_file)
+
+    def digest(self, path: str) -> str:
+        """SHA-256 of a file, recomputed only when its size or mtime changes"""
+        stat = os.stat(path)
+        cached = self._digests.get(path)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def get_file_id(self, path: str) -> Optional[str]:
+        """Cached file_id for the current contents of `path`, if it was uploaded before"""
+        return self.file_ids.get(self.digest(path))
+
+    def remember(self, path: str, file_id: str):
+        """Store the file_id Telegram returned for an upload of `path`"""
+        self.file_ids[self.digest(path)] = file_id
+        self._save()
+
+    def forget(self, path: str):
+        """Drop the cached file_id for `path` so the next send uploads it again"""
+        if self.file_ids.pop(self.digest(path), None) is not None:
+            self._save()
+
+    async def send_photo(self, bot: Bot, chat_id: int, path: str, **kwargs) -> Message:
+        """Send an image by cached file_id, uploading it only if needed"""
+        file_id = self.get_file_id(path)
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except BadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                logger.warning(f"Telegram rejected cached file_id for {path} ({e}), uploading again")
+                self.forget(path)
+
+        # Concurrent first sends of the same image wait for a single upload
+        lock = self._upload_locks.setdefault(self.digest(path), asyncio.Lock())
+        async with lock:
+            file_id = self.get_file_id(path)
+            if not file_id:
+                with open(path, 'rb') as photo:
+                    message = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+                self.remember(path, message.photo[-1].file_id)
+                return message
+        # Sent outside the lock, so the sends that waited for the upload run concurrently
+        return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+
+    async def send_media_group(self, bot: Bot, chat_id: int, paths: Sequence[str],
+                               caption: Optional[str] = None) -> Tuple[Message, ...]:
+        """Send several images as one album, uploading only those without a cached file_id"""
+        try:
+            return await self._send_media_group(bot, chat_id, paths, caption)
+        except BadRequest as e:
+            if not is_file_id_error(e):
+                raise
+            logger.warning(f"Telegram rejected a cached file_id in album {list(paths)} ({e}), uploading again")
+            for path in paths:
+                self.forget(path)
+            return await self._send_media_group(bot, chat_id, paths, caption)
+
+    async def _send_media_group(self, bot: Bot, chat_id: int, paths: Sequence[str],
+                                caption: Optional[str]) -> Tuple[Message, ...]:
+        """Build the album from cached file_ids or file bytes and remember newly uploaded file_ids"""
+        media = []
+        for index, path in enumerate(paths):
+            photo = self.get_file_id(path)
+            if photo is None:
+                with open(path, 'rb') as f:
+                    photo = f.read()
+            media.append(InputMediaPhoto(media=photo, caption=caption if index == 0 else None))
+        messages = await bot.send_media_group(chat_id=chat_id, media=media)
+        for path, message in zip(paths, messages):
+            if self.get_file_id(path) is None:
+                self.remember(path, message.photo[-1].file_id)
+        return messages
+
+@dataclass(frozen=True)
+class StepPayload:
+    """Everything one onboarding step sends: images, text and an optional inline keyboard.
+
+    The keyboard may be given already serialized to JSON (see templates.keyboard_json).
+    """
+    images: Tuple[str, ...] = ()
+    text: Optional[str] = None
+    reply_markup: Union[InlineKeyboardMarkup, str, None] = None
+
+class StepComposer:
+    """Sends a StepPayload in as few Bot API calls as possible.
+
+    Text rides along as the caption of a single photo or album when it fits, and the
+    keyboard goes on a single photo; only albums with a keyboard, or text longer than
+    a caption allows, need a separate message. Calls are counted per step.
+    """
+
+    def __init__(self, media: MediaRegistry):
+        self.media = media
+        self.calls: Counter = Counter()
+        self.sends: Counter = Counter()
+
+    async def send(self, bot: Bot, chat_id: int, step: str, payload: StepPayload) -> List[Message]:
+        """Send a step's payload to a chat and return the messages sent"""
+        messages: List[Message] = []
+        text = payload.text
+        reply_markup = payload.reply_markup
+        caption_fits = text is not None and len(text) <= MessageLimit.CAPTION_LENGTH
+        images = list(payload.images)
+
+        if len(images) == 1:
+            messages.append(await self.media.send_photo(
+                bot, chat_id, images[0],
+                caption=text if caption_fits else None,
+                reply_markup=reply_markup if caption_fits else None
+            ))
+            self.calls[step] += 1
+            if caption_fits:
+                text = reply_markup = None
+        elif images:
+            # Albums cannot carry a keyboard, so the caption is only used when there is none
+            use_caption = caption_fits and reply_markup is None
+            for start in range(0, len(images), MediaGroupLimit.MAX_MEDIA_LENGTH):
+                chunk = images[start:start + MediaGroupLimit.MAX_MEDIA_LENGTH]
+                caption = text if use_caption and start == 0 else None
+                messages.extend(await self.media.send_media_group(bot, chat_id, chunk, caption=caption))
+                self.calls[step] += 1
+            if use_caption:
+                text = None
+
+        if text is not None:
+            messages.append(await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup))
+            self.calls[step] += 1
+
+        self.sends[step] += 1
+        logger.debug(f"Step {step} sent to {chat_id} in {self.calls[step] / self.sends[step]:.2f} API calls on average")
+        return messages
+
+def is_file_id_error(error: BadRequest) -> bool:
+    """Whether Telegram refused a request because of the file_id it referenced"""
+    return 'file' in error.message.lower()
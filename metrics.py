@@ -0,0 +1,207 @@
+import asyncio
+import bisect
+import logging
+import time
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+logger = logging.getLogger(__name__)
+
+# Label pairs, e.g. (('method', 'sendMessage'),)
+Labels = Tuple[Tuple[str, str], ...]
+# Reads current values at scrape time as (metric name, labels, value) triples
+Collector = Callable[[], Iterable[Tuple[str, Labels, float]]]
+
+# Every metric the bot exposes: name -> (type, help)
+FAMILIES = {
+    'bot_handler_seconds': ('histogram', "Time the handlers of one update took, by command, button route or text reply"),
+    'bot_updates_waiting': ('gauge', "Updates accepted but waiting for an earlier update of the same user or a free slot"),
+    'bot_updates_running': ('gauge', "Updates whose handlers are running"),
+    'bot_update_queue_size': ('gauge', "Updates received but not yet picked up by the application"),
+    'bot_outbound_queue_depth': ('gauge', "Outgoing messages waiting for their chat's or the overall rate limit, by lane"),
+    'bot_outbound_blocked_senders': ('gauge', "Senders waiting for room in a full outbound lane, by lane"),
+    'bot_outbound_wait_seconds': ('histogram', "Time outgoing messages waited for the rate limits before being sent, by lane"),
+    'bot_outbound_retries_total': ('counter', "Outgoing messages sent again after a 429 Too Many Requests, by lane"),
+    'bot_api_requests_total': ('counter', "Bot API calls, by method"),
+    'bot_api_request_seconds': ('histogram', "Bot API call latency, by method"),
+    'bot_api_errors_total': ('counter', "Failed Bot API calls, by method and HTTP status or exception"),
+    'bot_step_sends_total': ('counter', "Onboarding steps sent, by step"),
+    'bot_step_api_calls_total': ('counter', "Bot API calls made to send onboarding steps, by step"),
+    'bot_state_transitions_total': ('counter', "Onboarding state changes, by previous and new state"),
+    'bot_dedup_hits_total': ('counter', "Updates dropped as duplicates, by kind (redelivered update or repeated button press)"),
+    'bot_dedup_misses_total': ('counter', "Updates that passed the duplicate check"),
+    'bot_stale_callbacks_total': ('counter', "Button presses dropped because the user has moved past that step, by route"),
+    'bot_db_writes_total': ('counter', "User database write batches"),
+    'bot_db_write_seconds_total': ('counter', "Time spent writing the user database"),
+    'bot_db_written_bytes_total': ('counter', "Bytes written to the user database"),
+    'bot_invite_pool_size': ('gauge', "Invite links created ahead of approvals and not issued yet"),
+    'bot_admissions_total': ('counter', "Invite links minted and issued (from the pool or minted on the spot) and join requests approved or declined"),
+    'bot_uid_checks_total': ('counter', "Submitted UIDs checked against the referral records, by outcome (approved or sent to review)"),
+    'bot_referral_snapshot_records': ('gauge', "Referral records in the snapshot UIDs are checked against"),
+    'bot_referral_snapshot_age_seconds': ('gauge', "Seconds since the referral snapshot was fetched"),
+}
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format.
+
+    Recording returns immediately while ``enabled`` is False, so instrumentation left
+    in hot paths costs one attribute check when no metrics port is configured.
+    """
+
+    # Histogram bucket upper bounds in seconds
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        # Per bucket counts (the last one is +Inf), then the sum of observed values
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        self.collectors: List[Collector] = []
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1):
+        """Add to a counter"""
+        if not self.enabled:
+            return
+        self.counters[name, labels] += value
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        """Record one value in a histogram"""
+        if not self.enabled:
+            return
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[name, labels] = [0] * (len(self.buckets) + 2)
+        histogram[bisect.bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def add_collector(self, collector: Collector):
+        """Register a function that reports current values (gauges, totals kept elsewhere) at scrape time"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        samples: Dict[str, List[str]] = defaultdict(list)
+        for (name, labels), value in self.counters.items():
+            samples[name].append(f"{name}{format_labels(labels)} {value:g}")
+        for collector in self.collectors:
+            try:
+                for name, labels, value in collector():
+                    samples[name].append(f"{name}{format_labels(labels)} {value:g}")
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        for (name, labels), histogram in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), histogram):
+                cumulative += count
+                samples[name].append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            samples[name].append(f"{name}_sum{format_labels(labels)} {histogram[-1]:g}")
+            samples[name].append(f"{name}_count{format_labels(labels)} {cumulative}")
+
+        lines = []
+        for name, (kind, help_text) in FAMILIES.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples.get(name, ()))
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels: Labels) -> str:
+    """Render label pairs as {key="value",...}"""
+    if not labels:
+        return ''
+    pairs = ','.join(
+        f'{key}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels
+    )
+    return '{' + pairs + '}'
+
+class InstrumentedRequest(BaseRequest):
+    """Wraps the Bot API request object and records calls, latency and errors per method"""
+
+    def __init__(self, request: BaseRequest, metrics: Metrics):
+        self.request = request
+        self.metrics = metrics
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.request.read_timeout
+
+    async def initialize(self):
+        await self.request.initialize()
+
+    async def shutdown(self):
+        await self.request.shutdown()
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE) -> Tuple[int, bytes]:
+        labels = (('method', url.rsplit('/', 1)[-1]),)
+        started = time.perf_counter()
+        try:
+            code, payload = await self.request.do_request(
+                url, method, request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        except Exception as e:
+            self.metrics.inc('bot_api_errors_total', labels + (('error', type(e).__name__),))
+            raise
+        finally:
+            self.metrics.observe('bot_api_request_seconds', time.perf_counter() - started, labels)
+            self.metrics.inc('bot_api_requests_total', labels)
+        if code != 200:
+            self.metrics.inc('bot_api_errors_total', labels + (('error', str(code)),))
+        return code, payload
+
+class MetricsServer:
+    """Serves GET /metrics over plain HTTP for a Prometheus scraper"""
+
+    max_header_lines = 100
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        self.server: Optional[asyncio.Server] = None
+
+    @property
+    def port(self) -> int:
+        """Port the server listens on (useful when started on port 0)"""
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str, port: int):
+        """Start accepting scrapes"""
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Metrics available at http://{host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            for _ in range(self.max_header_lines):
+                if await reader.readline() in (b'\r\n', b'\n', b''):
+                    break
+            if len(request_line) >= 2 and request_line[0] == 'GET' and request_line[1].split('?', 1)[0] == '/metrics':
+                status, body = "200 OK", self.metrics.render().encode('utf-8')
+            else:
+                status, body = "404 Not Found", b"Not Found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
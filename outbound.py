@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from ratelimit import RateLimiter, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Lanes, most urgent first: replies to users, admin notifications, broadcasts and other bulk sends
+INTERACTIVE = 'interactive'
+ADMIN = 'admin'
+BULK = 'bulk'
+LANES = (INTERACTIVE, ADMIN, BULK)
+
+# Bot API methods that post a new message, limited per chat and overall
+POSTING_METHODS = ('send', 'copyMessage', 'forwardMessage')
+# Methods that change a posted message, limited overall only
+EDITING_METHODS = ('edit',)
+
+class Lane:
+    """Sends Bot API calls of the application bot through one lane of its OutboundScheduler.
+
+    Has the ``call`` of a RateLimiter, so senders written against one (broadcasts,
+    admin notifications) only choose their lane; limits and retries are the scheduler's.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    async def call(self, method: Callable[..., Awaitable[Any]], chat_id: int, **kwargs) -> Any:
+        """Call a Bot API method addressed to `chat_id` in this lane"""
+        return await method(chat_id=chat_id, rate_limit_args=self.name, **kwargs)
+
+class OutboundScheduler(BaseRateLimiter):
+    """Sends every message the bot posts or edits within Telegram's limits, most urgent lane first.
+
+    Installed as the application's rate limiter, it sees each Bot API call; the
+    lane is the call's ``rate_limit_args`` (see Lane), and calls without one are
+    interactive. A new message first waits for its chat's bucket of ``limiter``,
+    then for the overall rate, which a dispatcher hands out to the most urgent lane
+    with requests waiting, so a reply to a user never queues behind a broadcast.
+    Calls that are not messages (answering buttons, invite links) are not held.
+
+    Each lane holds at most ``queue_size`` requests; further senders wait for room,
+    which slows broadcasts down and keeps handlers from piling up sends faster
+    than they can go out. A 429 pauses the chat for the ``retry_after`` Telegram
+    asks for and the call is retried, up to the limiter's ``max_retries`` times;
+    calls that are not messages are retried after waiting that long. This is the
+    only place 429s are retried: Lane passes them through, and a RateLimiter that
+    paces other calls of the bot (invite links, join requests) is created with
+    ``max_retries=0`` so its ``call`` does too.
+
+    If ``observe`` is given, it is called with the lane and the seconds each
+    request waited before being sent.
+    """
+
+    def __init__(self, limiter: RateLimiter, queue_size: int = 1000,
+                 observe: Optional[Callable[[str, float], None]] = None):
+        self.limiter = limiter
+        self.queue_size = queue_size
+        self.observe = observe
+        # Requests in each lane waiting for the overall rate, oldest first
+        self.queues: Dict[str, Deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        # Requests in each lane (waiting for their chat or the overall rate), and senders waiting for room
+        self.depth: Counter = Counter()
+        self.blocked: Counter = Counter()
+        # Calls retried after a 429, by lane
+        self.retries: Counter = Counter()
+        self._room = {lane: asyncio.Semaphore(queue_size) for lane in LANES}
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def initialize(self):
+        # Waits belong to the event loop the bot runs in
+        self._room = {lane: asyncio.Semaphore(self.queue_size) for lane in LANES}
+        self._wakeup = asyncio.Event()
+
+    async def shutdown(self):
+        """Stop handing out the rate; requests still waiting are cancelled"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for queue in self.queues.values():
+            while queue:
+                queue.popleft().cancel()
+
+    async def _dispatch(self):
+        while True:
+            if not any(self.queues.values()):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            await self.limiter.global_bucket.acquire()
+            # Chosen after the wait, so a more urgent request that arrived meanwhile goes first
+            for queue in self.queues.values():
+                while queue and queue[0].done():
+                    # Its sender was cancelled
+                    queue.popleft()
+                if queue:
+                    queue.popleft().set_result(None)
+                    break
+
+    async def _wait_turn(self, lane: str, chat_id: Optional[int]):
+        """Wait for room in the lane, then for the chat's limit (if given) and the overall rate"""
+        room = self._room[lane]
+        if room.locked():
+            self.blocked[lane] += 1
+            try:
+                await room.acquire()
+            finally:
+                self.blocked[lane] -= 1
+        else:
+            await room.acquire()
+        started = time.perf_counter()
+        self.depth[lane] += 1
+        try:
+            if chat_id is not None:
+                await self.limiter.chat_bucket(chat_id).acquire()
+            # Straight through while nothing is waiting and the rate allows
+            if any(self.queues.values()) or not self.limiter.global_bucket.try_acquire():
+                if self._dispatcher is None:
+                    self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+                turn = asyncio.get_running_loop().create_future()
+                self.queues[lane].append(turn)
+                self._wakeup.set()
+                await turn
+        finally:
+            self.depth[lane] -= 1
+            room.release()
+        if self.observe is not None:
+            self.observe(lane, time.perf_counter() - started)
+
+    async def process_request(self, callback, args, kwargs, endpoint: str, data: Dict[str, Any],
+                              rate_limit_args: Optional[str]):
+        chat_id = data.get('chat_id')
+        scheduled = chat_id is not None and endpoint.startswith(POSTING_METHODS + EDITING_METHODS)
+        lane = rate_limit_args if rate_limit_args in self.queues else INTERACTIVE
+        limited_chat = chat_id if scheduled and endpoint.startswith(POSTING_METHODS) else None
+        for attempt in range(self.limiter.max_retries + 1):
+            if scheduled:
+                await self._wait_turn(lane, limited_chat)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.limiter.max_retries:
+                    raise
+                delay = retry_after_seconds(e)
+                self.retries[lane] += 1
+                logger.warning(f"Flood control on {endpoint} for chat {chat_id} ({lane}), retrying in {delay:.0f}s")
+                if scheduled:
+                    # The retry waits for the paused chat, edits included
+                    self.limiter.chat_bucket(chat_id).pause(delay)
+                    limited_chat = chat_id
+                else:
+                    await asyncio.sleep(delay)
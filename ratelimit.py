@@ -0,0 +1,108 @@
+import asyncio
+import datetime
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        """Whether the bucket has been idle long enough to refill completely"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the next `seconds`"""
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class RateLimiter:
+    """Global and per-chat token buckets sized to Telegram's flood limits.
+
+    Telegram allows about 30 messages per second overall, about one per second to
+    the same private chat and 20 per minute to the same group. Short bursts to one
+    chat are tolerated, so per-chat buckets hold a few tokens.
+    """
+
+    # Per-chat buckets are dropped once this many exist and they have refilled
+    max_chat_buckets = 10000
+
+    def __init__(self, global_rate: float = 30, private_rate: float = 1, private_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 3, max_retries: int = 3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        """The bucket limiting messages to one chat, created on first use"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.max_chat_buckets:
+                self.chat_buckets = {
+                    other_id: other for other_id, other in self.chat_buckets.items() if not other.is_full()
+                }
+            # Group and channel IDs are negative
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.private_rate, self.private_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        """Wait until one more message to `chat_id` stays within both limits"""
+        await self.chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    async def call(self, method: Callable[..., Awaitable[Any]], chat_id: int, **kwargs) -> Any:
+        """Call a Bot API method addressed to `chat_id` under the limits, retrying 429 responses"""
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id)
+            try:
+                return await method(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = retry_after_seconds(e)
+                logger.warning(f"Flood control for chat {chat_id}, retrying in {delay:.0f}s")
+                self.chat_bucket(chat_id).pause(delay)
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Seconds Telegram asked us to wait, whichever type the library reports it as"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, datetime.timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from telegram import Bot, InlineKeyboardMarkup
+from telegram.error import BadRequest
+
+from outbound import Lane
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+APPROVED = 'approved'
+REJECTED = 'rejected'
+
+class ReviewQueue:
+    """Users waiting for an admin to approve or reject their UID submission.
+
+    Each review remembers the notification message it sent to every admin, so once
+    one admin decides, all admins' copies are edited to show the decision. Changes
+    are appended to ``reviews_file`` as JSON lines ``{"id": ..., "set": {...}}``,
+    replayed on startup and compacted when the log holds many superseded lines.
+
+    Pending reviews are also indexed in ``store`` by a submission number the store
+    hands out, so a page of the backlog is a range of that index. With several
+    worker processes, each keeps the reviews of its own users in its own file and
+    decides them, while the index in the shared store lists every worker's pending
+    reviews for /queue. The store is read and written from a thread, so a remote
+    store does not hold up the event loop.
+    """
+
+    page_size = 10
+    namespace = 'review_queue'
+
+    def __init__(self, limiter: Lane, store, reviews_file: str = "reviews.jsonl"):
+        self.limiter = limiter
+        self.store = store
+        self.reviews_file = reviews_file
+        self.reviews: Dict[int, Dict[str, Any]] = {}
+        lines = self._load()
+        if lines > 2 * len(self.reviews) + 100:
+            self._compact()
+        self._log = open(reviews_file, 'a', encoding='utf-8')
+
+    def _load(self) -> int:
+        """Replay the review log and return how many lines it had"""
+        lines = 0
+        if os.path.exists(self.reviews_file):
+            with open(self.reviews_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn tail from a crash mid-append
+                        break
+                    self.reviews.setdefault(int(record['id']), {}).update(record['set'])
+                    lines += 1
+        # The index loses a review only if the bot stopped between the log and the store
+        self.store.update_records(self.namespace, {
+            review['seq']: self._index_entry(user_id, review)
+            for user_id, review in self.reviews.items() if review['status'] == PENDING
+        })
+        # Reviews logged before the store handed out numbers keep theirs
+        last_seq = max((review['seq'] for review in self.reviews.values()), default=0)
+        issued = self.store.incr(self.namespace, 'seq', 0)
+        if last_seq > issued:
+            self.store.incr(self.namespace, 'seq', last_seq - issued)
+        return lines
+
+    def _compact(self):
+        """Rewrite the log with one line per review"""
+        tmp_file = f"{self.reviews_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for user_id, review in self.reviews.items():
+                f.write(json.dumps({'id': user_id, 'set': review}, ensure_ascii=False) + '\n')
+        os.replace(tmp_file, self.reviews_file)
+
+    def _append(self, user_id: int, fields: Dict[str, Any]):
+        self._log.write(json.dumps({'id': user_id, 'set': fields}, ensure_ascii=False) + '\n')
+        self._log.flush()
+
+    def close(self):
+        if not self._log.closed:
+            self._log.close()
+
+    @staticmethod
+    def _index_entry(user_id: int, review: Dict[str, Any]) -> Dict[str, Any]:
+        """What /queue shows of a pending review"""
+        return {'user_id': user_id, 'summary': review['summary'], 'submitted_at': review['submitted_at']}
+
+    async def submit(self, user_id: int, text: str, summary: str, uid: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a user for review, or update the details of their pending review.
+
+        `text` is the notification admins get, `summary` the user's line in /queue
+        and `uid` the UID they submitted.
+        """
+        review = self.reviews.get(user_id)
+        if review is None or review['status'] != PENDING:
+            seq = await asyncio.to_thread(self.store.incr, self.namespace, 'seq')
+            # Another submission of the user may have queued a review meanwhile
+            review = self.reviews.get(user_id)
+        if review is not None and review['status'] == PENDING:
+            review.update(text=text, summary=summary, uid=uid)
+            self._append(user_id, {'text': text, 'summary': summary, 'uid': uid})
+            await asyncio.to_thread(self.store.update_records, self.namespace, {review['seq']: {'summary': summary}})
+            return review
+        review = self.reviews[user_id] = {
+            'seq': seq,
+            'status': PENDING,
+            'text': text,
+            'summary': summary,
+            'uid': uid,
+            'submitted_at': time.time(),
+            'decided_by': None,
+            # [admin_id, message_id] of each admin's notification
+            'notifications': [],
+        }
+        self._append(user_id, review)
+        await asyncio.to_thread(self.store.update_records, self.namespace,
+                                {review['seq']: self._index_entry(user_id, review)})
+        return review
+
+    async def decide(self, user_id: int, status: str, admin_name: str) -> bool:
+        """Record an admin's decision; False if the user has no pending review.
+
+        The check and the change happen before the first await, so when several
+        admins press a button for the same user only the first decision counts.
+        """
+        review = self.reviews.get(user_id)
+        if review is None or review['status'] != PENDING:
+            return False
+        review.update(status=status, decided_by=admin_name)
+        # Out of the index first, so a stop in between leaves the log to restore it
+        await asyncio.to_thread(self.store.delete_records, self.namespace, [review['seq']])
+        self._append(user_id, {'status': status, 'decided_by': admin_name})
+        return True
+
+    def submitted_uids(self) -> List[Tuple[str, int]]:
+        """(uid, user_id) of the latest submission of every user, oldest first"""
+        reviews = sorted(self.reviews.items(), key=lambda item: item[1]['seq'])
+        return [(review['uid'], user_id) for user_id, review in reviews if review.get('uid')]
+
+    @property
+    def pending_count(self) -> int:
+        """Pending reviews of every worker"""
+        return self.store.count_records(self.namespace)
+
+    def pages_of(self, pending_count: int) -> int:
+        """Number of pages `pending_count` reviews take (at least one, possibly empty)"""
+        return max(1, -(-pending_count // self.page_size))
+
+    async def page(self, index: int) -> Tuple[int, int, List[Tuple[int, Dict[str, Any]]]]:
+        """One page of every worker's pending reviews, oldest first, as
+        (page index, pending count, [(user_id, {'summary', 'submitted_at'})]).
+
+        Out of range indexes are clamped to the first or last page.
+        """
+        return await asyncio.to_thread(self._read_page, index)
+
+    def _read_page(self, index: int) -> Tuple[int, int, List[Tuple[int, Dict[str, Any]]]]:
+        pending_count = self.pending_count
+        index = min(max(index, 0), self.pages_of(pending_count) - 1)
+        seqs = self.store.record_range(self.namespace, index * self.page_size, self.page_size)
+        # Reviews decided since the range was read come back empty
+        entries = [entry for entry in self.store.get_records(self.namespace, seqs) if entry]
+        return index, pending_count, [(entry['user_id'], entry) for entry in entries]
+
+    def format_notification(self, user_id: int) -> str:
+        """An admin's notification text, with the decision once there is one"""
+        review = self.reviews[user_id]
+        if review['status'] == APPROVED:
+            return f"{review['text']}\n\n✅ Approved by {review['decided_by']}"
+        if review['status'] == REJECTED:
+            return f"{review['text']}\n\n❌ Rejected by {review['decided_by']}"
+        return review['text']
+
+    async def notify(self, bot: Bot, user_id: int, admin_ids: Iterable[int], reply_markup: InlineKeyboardMarkup):
+        """Send the review to every admin, or edit the copies they already have"""
+        review = self.reviews[user_id]
+        if review['notifications']:
+            await self.update_notifications(bot, user_id, reply_markup)
+            return
+        admin_ids = list(admin_ids)
+        results = await asyncio.gather(*(
+            self.limiter.call(bot.send_message, admin_id, text=review['text'], reply_markup=reply_markup)
+            for admin_id in admin_ids
+        ), return_exceptions=True)
+        if self.reviews.get(user_id) is not review:
+            # The user was decided and submitted again while these were being sent
+            return
+        for admin_id, result in zip(admin_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to notify admin {admin_id} about user {user_id}: {result}")
+            else:
+                review['notifications'].append([admin_id, result.message_id])
+        self._append(user_id, {'notifications': review['notifications']})
+        if review['status'] != PENDING:
+            # Decided while the notifications were being sent
+            await self.update_notifications(bot, user_id)
+
+    async def update_notifications(self, bot: Bot, user_id: int, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Edit every admin's notification to the review's current text"""
+        text = self.format_notification(user_id)
+        await asyncio.gather(*(
+            self._edit(bot, admin_id, message_id, text, reply_markup)
+            for admin_id, message_id in self.reviews[user_id]['notifications']
+        ))
+
+    async def _edit(self, bot: Bot, chat_id: int, message_id: int, text: str,
+                    reply_markup: Optional[InlineKeyboardMarkup]):
+        try:
+            await self.limiter.call(bot.edit_message_text, chat_id, message_id=message_id, text=text,
+                                    reply_markup=reply_markup)
+        except BadRequest as e:
+            # "message is not modified" when the copy already shows this text
+            logger.debug(f"Review notification {message_id} for admin {chat_id} not edited: {e}")
+        except Exception as e:
+            logger.error(f"Failed to edit review notification {message_id} for admin {chat_id}: {e}")
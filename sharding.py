@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from webhook import WebhookServer, stop_on_signals
+
+logger = logging.getLogger(__name__)
+
+ShardTarget = Callable[[Dict[str, Any]], Awaitable[None]]
+
+def update_user_id(data: Dict[str, Any]) -> Optional[int]:
+    """ID of the user an update's JSON comes from, or None (e.g. for channel posts)"""
+    for field, value in data.items():
+        if field != 'update_id' and isinstance(value, dict):
+            # poll_answer names its user 'user', everything else 'from'
+            sender = value.get('from') or value.get('user')
+            if isinstance(sender, dict) and 'id' in sender:
+                return sender['id']
+    return None
+
+class ShardRouter:
+    """Hands each webhook update to one of several workers, chosen by user.
+
+    ``key`` maps an update's JSON to the user it belongs to, so all of a user's
+    updates reach the same worker in the order they arrived and that worker's
+    PerUserUpdateProcessor keeps them in order. Updates without a user are spread
+    by update_id.
+    """
+
+    def __init__(self, targets: List[ShardTarget], key: Callable[[Dict[str, Any]], Optional[int]] = update_user_id):
+        self.targets = targets
+        self.key = key
+        # Updates handed to each worker
+        self.routed = [0] * len(targets)
+
+    def shard(self, data: Dict[str, Any]) -> int:
+        user_id = self.key(data)
+        return (user_id if user_id is not None else data['update_id']) % len(self.targets)
+
+    async def dispatch(self, data: Dict[str, Any]):
+        index = self.shard(data)
+        self.routed[index] += 1
+        await self.targets[index](data)
+
+def application_target(application: Application) -> ShardTarget:
+    """Shard target that puts updates on an application in this process, e.g. to test sharding locally"""
+    async def put(data: Dict[str, Any]):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    return put
+
+def queue_target(updates: multiprocessing.Queue) -> ShardTarget:
+    """Shard target that sends updates to a worker process"""
+    async def put(data: Dict[str, Any]):
+        updates.put(data)
+    return put
+
+async def serve_updates(application: Application, updates: multiprocessing.Queue):
+    """Run the application in a worker process on the updates the front process sends, until it sends None.
+
+    Mirrors run_webhook's lifecycle callbacks; the front process owns the webhook.
+    """
+    # Ctrl+C reaches every process in the group; the front process decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        while True:
+            try:
+                batch = [await asyncio.to_thread(updates.get, True, 1.0)]
+            except queue.Empty:
+                if not multiprocessing.parent_process().is_alive():
+                    logger.error("Front process is gone, stopping worker")
+                    break
+                continue
+            # Take whatever else has arrived without another thread hop per update
+            while batch[-1] is not None:
+                try:
+                    batch.append(updates.get_nowait())
+                except queue.Empty:
+                    break
+            for data in batch:
+                if data is not None:
+                    await application.update_queue.put(Update.de_json(data, application.bot))
+            if batch[-1] is None:
+                break
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+async def serve_front(bot: Bot, router: ShardRouter, processes: List[multiprocessing.Process], url: str,
+                      listen: str, port: int, path: str, secret_token: str, allowed_updates: List[str],
+                      max_connections: int = 40):
+    """Receive webhook updates and route them to workers until SIGINT/SIGTERM or a worker exits"""
+    stop_event = stop_on_signals()
+    await bot.initialize()
+    server = WebhookServer(None, path, secret_token, dispatch=router.dispatch)
+    await server.start(listen, port)
+    await bot.set_webhook(
+        url=url,
+        secret_token=secret_token,
+        allowed_updates=allowed_updates,
+        max_connections=max_connections
+    )
+    try:
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+            exited = [process.name for process in processes if not process.is_alive()]
+            if exited:
+                # Their users' updates would pile up unprocessed; let the supervisor restart everything
+                logger.error(f"Worker {', '.join(exited)} exited, stopping")
+                break
+    finally:
+        await server.stop()
+        await bot.shutdown()
+
+def run_sharded_webhook(worker: Callable[[multiprocessing.Queue], None], workers: int, bot: Bot,
+                        key: Callable[[Dict[str, Any]], Optional[int]] = update_user_id, **webhook_options):
+    """Run `workers` processes calling worker(updates) and shard webhook updates between them.
+
+    Workers are started with 'spawn', so each imports the bot afresh rather than
+    inheriting this process' state, and each finds its number in the WORKER_INDEX
+    environment variable. ``webhook_options`` are serve_front's arguments.
+    """
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = []
+    for index, updates in enumerate(queues):
+        os.environ['WORKER_INDEX'] = str(index)
+        process = context.Process(target=worker, args=(updates,), name=f"worker-{index}")
+        process.start()
+        processes.append(process)
+    del os.environ['WORKER_INDEX']
+
+    router = ShardRouter([queue_target(updates) for updates in queues], key)
+    try:
+        asyncio.run(serve_front(bot, router, processes, **webhook_options))
+    finally:
+        for updates in queues:
+            updates.put(None)
+        for process in processes:
+            process.join()
+        logger.info(f"Updates routed to each worker: {router.routed}")
@@ -0,0 +1,323 @@
+import asyncio
+import bisect
+import json
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+class MemoryStore:
+    """Shared state kept in this process, with the same interface as RedisStore.
+
+    Holds two kinds of data per namespace: records, which are dicts of fields
+    addressed by an integer ID and listed in ID order (e.g. users), and values,
+    which are single JSON values under a string key with an optional TTL (e.g. an
+    admin's conversation). Everything is stored JSON-encoded, so callers get copies
+    and see the same types they would get back from Redis. Fields passed as
+    ``indexed`` when records are written are indexed by value, so the records with
+    a value (e.g. users in a state) are listed without reading every record.
+
+    Only code in this process shares it: it serves a single bot process, and lets
+    several workers in one process be tested without a Redis server.
+    """
+
+    def __init__(self):
+        self._records: Dict[str, Dict[int, Dict[str, str]]] = {}
+        # Record IDs of each namespace in ascending order
+        self._ids: Dict[str, List[int]] = {}
+        # Record IDs by (namespace, field, JSON-encoded value) of indexed fields
+        self._index: Dict[Tuple[str, str, str], Set[int]] = {}
+        self._values: Dict[Tuple[str, str], Tuple[str, Optional[float]]] = {}
+        # Expired values are dropped when read, and all at once whenever their number doubles
+        self._sweep_at = 1024
+        # The user database's background writer writes from a worker thread
+        self._lock = threading.Lock()
+
+    def close(self):
+        pass
+
+    def get_records(self, namespace: str, record_ids: List[int]) -> List[Dict[str, Any]]:
+        """Fields of each record, {} for records that do not exist"""
+        with self._lock:
+            records = self._records.get(namespace, {})
+            return [{field: json.loads(value) for field, value in records.get(record_id, {}).items()}
+                    for record_id in record_ids]
+
+    def update_records(self, namespace: str, changes: Dict[int, Dict[str, Any]], indexed: Iterable[str] = ()):
+        """Set fields of several records, creating those that do not exist, and index the `indexed` fields"""
+        with self._lock:
+            records = self._records.setdefault(namespace, {})
+            ids = self._ids.setdefault(namespace, [])
+            for record_id, fields in changes.items():
+                record = records.get(record_id)
+                if record is None:
+                    record = records[record_id] = {}
+                    bisect.insort(ids, record_id)
+                encoded = {field: json.dumps(value, ensure_ascii=False) for field, value in fields.items()}
+                for field in indexed:
+                    if field in encoded:
+                        self._unindex(namespace, field, record.get(field), record_id)
+                        self._index.setdefault((namespace, field, encoded[field]), set()).add(record_id)
+                record.update(encoded)
+
+    def _unindex(self, namespace: str, field: str, value: Optional[str], record_id: int):
+        ids = self._index.get((namespace, field, value))
+        if ids is not None:
+            ids.discard(record_id)
+            if not ids:
+                del self._index[namespace, field, value]
+
+    def indexed_ids(self, namespace: str, field: str, value: Any) -> List[int]:
+        """IDs of the records whose indexed `field` is `value`, ascending"""
+        with self._lock:
+            return sorted(self._index.get((namespace, field, json.dumps(value, ensure_ascii=False)), ()))
+
+    def record_ids(self, namespace: str, after: int = 0, count: int = 500) -> List[int]:
+        """Up to `count` record IDs greater than `after`, ascending"""
+        with self._lock:
+            ids = self._ids.get(namespace, [])
+            start = bisect.bisect_right(ids, after)
+            return ids[start:start + count]
+
+    def record_range(self, namespace: str, start: int = 0, count: int = 500) -> List[int]:
+        """Up to `count` record IDs from position `start` in ascending order"""
+        with self._lock:
+            return self._ids.get(namespace, [])[start:start + count]
+
+    def count_records(self, namespace: str) -> int:
+        with self._lock:
+            return len(self._ids.get(namespace, []))
+
+    def delete_records(self, namespace: str, record_ids: List[int], indexed: Iterable[str] = ()):
+        """Delete records, ignoring those that do not exist, and drop them from the index of `indexed` fields"""
+        with self._lock:
+            records = self._records.get(namespace, {})
+            ids = self._ids.get(namespace, [])
+            for record_id in record_ids:
+                record = records.pop(record_id, None)
+                if record is not None:
+                    del ids[bisect.bisect_left(ids, record_id)]
+                    for field in indexed:
+                        self._unindex(namespace, field, record.get(field), record_id)
+
+    def get(self, namespace: str, key: str) -> Any:
+        """A value, or None if it is not set or has expired"""
+        with self._lock:
+            entry = self._values.get((namespace, key))
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._values[namespace, key]
+                return None
+            return json.loads(value)
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """Set a value, expiring after `ttl` seconds if given"""
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._values[namespace, key] = (json.dumps(value, ensure_ascii=False), expires)
+            if len(self._values) >= self._sweep_at:
+                now = time.monotonic()
+                self._values = {
+                    value_key: entry for value_key, entry in self._values.items()
+                    if entry[1] is None or entry[1] > now
+                }
+                self._sweep_at = max(1024, 2 * len(self._values))
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        """Add to an integer value (0 if it is not set) and return the result"""
+        with self._lock:
+            entry = self._values.get((namespace, key))
+            value = json.loads(entry[0]) + amount if entry is not None else amount
+            self._values[namespace, key] = (json.dumps(value), None)
+            return value
+
+    def add(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set a value unless it is already set; False if it was"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._values.get((namespace, key))
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                return False
+            self._values[namespace, key] = (json.dumps(value, ensure_ascii=False), now + ttl if ttl is not None else None)
+            return True
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._values.pop((namespace, key), None)
+
+class RedisStore:
+    """Shared state in Redis, so several bot processes (or hosts) see the same data.
+
+    A record is a hash ``<prefix><namespace>:<id>`` of JSON-encoded fields, and the
+    IDs of a namespace are a sorted set ``<prefix><namespace>`` scored by ID. Records
+    with an indexed field set to a value are a sorted set
+    ``<prefix><namespace>:<field>=<JSON value>`` of the same kind. A value is a
+    string ``<prefix><namespace>:<key>`` with Redis' own expiry. Requires the redis
+    package.
+
+    Every call is a blocking round trip: call it from a worker thread, e.g. with
+    ``asyncio.to_thread``, rather than on the event loop.
+    """
+
+    def __init__(self, url: str, prefix: str = "bot:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("STORE_URL points to Redis, but the redis package is not installed") from e
+        self.prefix = prefix
+        # redis-py clients are thread-safe, each command takes a connection from the pool
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, namespace: str, key: Any) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def close(self):
+        self.client.close()
+
+    def get_records(self, namespace: str, record_ids: List[int]) -> List[Dict[str, Any]]:
+        """Fields of each record, {} for records that do not exist"""
+        pipeline = self.client.pipeline(transaction=False)
+        for record_id in record_ids:
+            pipeline.hgetall(self._key(namespace, record_id))
+        return [{field: json.loads(value) for field, value in fields.items()} for fields in pipeline.execute()]
+
+    def _index_key(self, namespace: str, field: str, encoded_value: str) -> str:
+        return f"{self.prefix}{namespace}:{field}={encoded_value}"
+
+    def _indexed_values(self, namespace: str, record_ids: List[int], indexed: List[str]) -> List[List[Optional[str]]]:
+        """The JSON-encoded `indexed` fields of each record, None where unset"""
+        pipeline = self.client.pipeline(transaction=False)
+        for record_id in record_ids:
+            pipeline.hmget(self._key(namespace, record_id), indexed)
+        return pipeline.execute()
+
+    def update_records(self, namespace: str, changes: Dict[int, Dict[str, Any]], indexed: Iterable[str] = ()):
+        """Set fields of several records, creating those that do not exist, and index the `indexed` fields"""
+        indexed = list(indexed)
+        reindexed = [record_id for record_id, fields in changes.items() if any(field in fields for field in indexed)]
+        # Two processes changing a record at once can leave it in an old value's index too,
+        # so readers of the index check the records themselves
+        previous = dict(zip(reindexed, self._indexed_values(namespace, reindexed, indexed))) if reindexed else {}
+        pipeline = self.client.pipeline(transaction=False)
+        for record_id, fields in changes.items():
+            for field, old_value in zip(indexed, previous.get(record_id, ())):
+                if field in fields:
+                    if old_value is not None:
+                        pipeline.zrem(self._index_key(namespace, field, old_value), str(record_id))
+                    pipeline.zadd(self._index_key(namespace, field, json.dumps(fields[field], ensure_ascii=False)),
+                                  {str(record_id): record_id})
+            if fields:
+                pipeline.hset(self._key(namespace, record_id), mapping={
+                    field: json.dumps(value, ensure_ascii=False) for field, value in fields.items()
+                })
+            pipeline.zadd(f"{self.prefix}{namespace}", {str(record_id): record_id}, nx=True)
+        pipeline.execute()
+
+    def record_ids(self, namespace: str, after: int = 0, count: int = 500) -> List[int]:
+        """Up to `count` record IDs greater than `after`, ascending"""
+        ids = self.client.zrangebyscore(f"{self.prefix}{namespace}", f"({after}", "+inf", start=0, num=count)
+        return [int(record_id) for record_id in ids]
+
+    def record_range(self, namespace: str, start: int = 0, count: int = 500) -> List[int]:
+        """Up to `count` record IDs from position `start` in ascending order"""
+        ids = self.client.zrange(f"{self.prefix}{namespace}", start, start + count - 1)
+        return [int(record_id) for record_id in ids]
+
+    def indexed_ids(self, namespace: str, field: str, value: Any) -> List[int]:
+        """IDs of the records whose indexed `field` is `value`, ascending"""
+        ids = self.client.zrange(self._index_key(namespace, field, json.dumps(value, ensure_ascii=False)), 0, -1)
+        return [int(record_id) for record_id in ids]
+
+    def count_records(self, namespace: str) -> int:
+        return self.client.zcard(f"{self.prefix}{namespace}")
+
+    def delete_records(self, namespace: str, record_ids: List[int], indexed: Iterable[str] = ()):
+        """Delete records, ignoring those that do not exist, and drop them from the index of `indexed` fields"""
+        if not record_ids:
+            return
+        indexed = list(indexed)
+        previous = self._indexed_values(namespace, record_ids, indexed) if indexed else []
+        pipeline = self.client.pipeline(transaction=False)
+        for record_id, values in zip(record_ids, previous):
+            for field, value in zip(indexed, values):
+                if value is not None:
+                    pipeline.zrem(self._index_key(namespace, field, value), str(record_id))
+        pipeline.delete(*(self._key(namespace, record_id) for record_id in record_ids))
+        pipeline.zrem(f"{self.prefix}{namespace}", *(str(record_id) for record_id in record_ids))
+        pipeline.execute()
+
+    def get(self, namespace: str, key: str) -> Any:
+        """A value, or None if it is not set or has expired"""
+        value = self.client.get(self._key(namespace, key))
+        return json.loads(value) if value is not None else None
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """Set a value, expiring after `ttl` seconds if given"""
+        self.client.set(self._key(namespace, key), json.dumps(value, ensure_ascii=False),
+                        px=int(ttl * 1000) if ttl is not None else None)
+
+    def incr(self, namespace: str, key: str, amount: int = 1) -> int:
+        """Add to an integer value (0 if it is not set) and return the result"""
+        return self.client.incrby(self._key(namespace, key), amount)
+
+    def add(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Set a value unless it is already set; False if it was"""
+        return bool(self.client.set(self._key(namespace, key), json.dumps(value, ensure_ascii=False),
+                                    px=int(ttl * 1000) if ttl is not None else None, nx=True))
+
+    def delete(self, namespace: str, key: str):
+        self.client.delete(self._key(namespace, key))
+
+class StoreDict:
+    """Dict-style access to the values of one store namespace, e.g. per-admin state.
+
+    Keys are converted to strings, and values are copies: assign a changed value
+    back for the store to see it. ``load``, ``save`` and ``drop`` do the same as
+    ``get``, assigning and ``discard`` from a thread, for use on the event loop.
+    """
+
+    def __init__(self, store, namespace: str, ttl: Optional[float] = None):
+        self.store = store
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        value = self.store.get(self.namespace, str(key))
+        return default if value is None else value
+
+    def discard(self, key: Any):
+        """Remove a key if it is set"""
+        self.store.delete(self.namespace, str(key))
+
+    async def load(self, key: Any, default: Any = None) -> Any:
+        return await asyncio.to_thread(self.get, key, default)
+
+    async def save(self, key: Any, value: Any):
+        await asyncio.to_thread(self.__setitem__, key, value)
+
+    async def drop(self, key: Any):
+        await asyncio.to_thread(self.discard, key)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.store.get(self.namespace, str(key)) is not None
+
+    def __getitem__(self, key: Any) -> Any:
+        value = self.store.get(self.namespace, str(key))
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: Any, value: Any):
+        self.store.set(self.namespace, str(key), value, self.ttl)
+
+    def __delitem__(self, key: Any):
+        self.store.delete(self.namespace, str(key))
+
+def open_store(url: str = "memory://"):
+    """Create the shared store a STORE_URL points to"""
+    if url.startswith("memory://"):
+        return MemoryStore()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(url)
+    raise ValueError(f"Unknown store URL: {url}")
@@ -0,0 +1,62 @@
+import json
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import MessageLimit
+
+from media import StepPayload
+
+# Keyboard rows of (label, callback_data) pairs
+Buttons = Tuple[Tuple[Tuple[str, str], ...], ...]
+
+@dataclass(frozen=True)
+class Prompt:
+    """A message the bot sends: text with optional images and buttons"""
+    text: str
+    buttons: Buttons = ()
+    images: Tuple[str, ...] = ()
+
+def keyboard_json(buttons: Buttons) -> Optional[str]:
+    """An inline keyboard serialized the way the Bot API takes reply_markup, or None without buttons.
+
+    python-telegram-bot sends string parameters as they are, so a keyboard
+    serialized once skips building and dumping the markup objects on every send.
+    """
+    if not buttons:
+        return None
+    markup = InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+        for row in buttons
+    ])
+    return json.dumps(markup.to_dict())
+
+class Templates:
+    """Every prompt of one variant (e.g. a language) compiled into what the bot sends.
+
+    ``payloads`` has a StepPayload per prompt. ``edits`` has, for each sequence of
+    prompts a button press can show, the text and keyboard that replace the pressed
+    message, when the sequence can be shown that way: text only, within one
+    message, with a keyboard on the last prompt at most.
+    """
+
+    def __init__(self, prompts: Dict[str, Prompt], sequences: Iterable[Tuple[str, ...]] = ()):
+        self.prompts = prompts
+        self.payloads: Dict[str, StepPayload] = {
+            name: StepPayload(images=prompt.images, text=prompt.text, reply_markup=keyboard_json(prompt.buttons))
+            for name, prompt in prompts.items()
+        }
+        self.edits: Dict[Tuple[str, ...], Tuple[str, Optional[str]]] = {}
+        for names in sequences:
+            edit = self._compile_edit(names)
+            if edit is not None:
+                self.edits[names] = edit
+
+    def _compile_edit(self, names: Tuple[str, ...]) -> Optional[Tuple[str, Optional[str]]]:
+        prompts = [self.prompts[name] for name in names]
+        if not prompts or any(prompt.images for prompt in prompts) or any(prompt.buttons for prompt in prompts[:-1]):
+            return None
+        text = "\n\n".join(prompt.text for prompt in prompts)
+        if len(text) > MessageLimit.MAX_TEXT_LENGTH:
+            return None
+        return text, self.payloads[names[-1]].reply_markup
@@ -0,0 +1,120 @@
+"""Exercise group admission offline: approvals in a burst, then join requests.
+
+The bot runs against FakeBotAPI with GROUP_CHAT_ID set. An admin approves a burst
+of users at once, first while the invite link pool is filled and then with the
+pool turned off, so every approval waits for a link to be created; approval
+latency is reported for both. Then every approved user asks to join through their
+link, outsiders ask to join through forwarded links, and approved users ask again
+after being admitted. The harness exits with status 1 unless exactly the approved
+users were admitted, each once, and every admitted user's link was revoked.
+
+Usage: python -m tools.admission_harness [--users N] [--pool N] [--latency SECONDS]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from typing import List
+
+from telegram import Update
+
+from tools.bot_env import use_scratch_files
+from tools.fake_bot_api import FakeBotAPI, callback_update, join_request_update
+
+ADMIN_ID = 900001
+GROUP_CHAT_ID = -1001234567890
+
+async def approve_burst(application, user_ids: List[int], update_ids) -> List[float]:
+    """Submit reviews for the users, have the admin approve all of them at once and time each approval"""
+    import bot
+
+    for user_id in user_ids:
+        await bot.reviews.submit(user_id, f"User {user_id}", f"user{user_id} (ID: {user_id})")
+
+    async def approve(user_id: int) -> float:
+        update = Update.de_json(callback_update(next(update_ids), ADMIN_ID, f"approve:{user_id}"), application.bot)
+        started = time.perf_counter()
+        await application.process_update(update)
+        return time.perf_counter() - started
+
+    return list(await asyncio.gather(*(approve(user_id) for user_id in user_ids)))
+
+def report(label: str, latencies: List[float]):
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    print(f"{label:>22}: p50 {quantiles[49] * 1000:7.1f} ms, p99 {quantiles[98] * 1000:7.1f} ms per approval")
+
+async def run(users: int, pool: int, latency: float) -> bool:
+    import bot
+
+    fake_api = FakeBotAPI(latency)
+    application = bot.build_application("123456:ADMISSION", request=fake_api, get_updates_request=fake_api)
+    await application.initialize()
+    await application.post_init(application)
+    # Review notifications are updated in tasks the running application awaits
+    await application.start()
+    admissions = bot.admissions
+    update_ids = itertools.count(1)
+
+    started = time.perf_counter()
+    while len(admissions.pool) < pool:
+        await asyncio.sleep(0.01)
+    print(f"Pool of {pool} links filled in {time.perf_counter() - started:.2f}s")
+
+    pooled = list(range(1, users + 1))
+    report("pooled links", await approve_burst(application, pooled, update_ids))
+    await admissions.stop()
+    admissions.pool.clear()
+    admissions.pool_size = 0
+    minted = list(range(users + 1, 2 * users + 1))
+    report("links minted on demand", await approve_burst(application, minted, update_ids))
+    print(f"Links: {dict(admissions.stats)}")
+
+    approved = pooled + minted
+    links = {user_id: bot.store.get(admissions.namespace, f"user:{user_id}") for user_id in approved}
+    requests = [join_request_update(next(update_ids), user_id, GROUP_CHAT_ID, links[user_id]) for user_id in approved]
+    # Outsiders following forwarded links, then approved users trying again once admitted
+    outsiders = [(100000 + user_id, links[user_id]) for user_id in approved[::5]]
+    requests += [join_request_update(next(update_ids), user_id, GROUP_CHAT_ID, link) for user_id, link in outsiders]
+    requests += [join_request_update(next(update_ids), user_id, GROUP_CHAT_ID, links[user_id]) for user_id in approved[::7]]
+    for data in requests:
+        await application.process_update(Update.de_json(data, application.bot))
+
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    admitted = [user_id for _, user_id in fake_api.join_requests['approved']]
+    declined = fake_api.join_requests['declined']
+    revoked = [link for link, data in fake_api.invite_links.items() if data['is_revoked']]
+    print(f"Join requests: {len(admitted)} approved, {len(declined)} declined, {len(revoked)} links revoked")
+    problems = []
+    if sorted(admitted) != approved:
+        problems.append("admitted users are not exactly the approved users, each once")
+    if len(declined) != len(outsiders) + len(approved[::7]):
+        problems.append(f"{len(declined)} join requests declined, expected {len(outsiders) + len(approved[::7])}")
+    if sorted(revoked) != sorted(links.values()):
+        problems.append("admitted users' links were not all revoked")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return not problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="users approved in each burst")
+    parser.add_argument("--pool", type=int, default=64, help="invite links created ahead of approvals")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each Bot API call takes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_scratch_files(tmp, ADMIN_TELEGRAM_IDS=str(ADMIN_ID), GROUP_CHAT_ID=str(GROUP_CHAT_ID),
+                          INVITE_POOL_SIZE=str(args.pool))
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        ok = asyncio.run(run(args.users, args.pool, args.latency))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Compare the JSON rewrite, write-ahead log and SQLite user database backends.
+
+Usage: python -m tools.bench_database [--users N] [--updates N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from database import UserDatabase, UserRecord, open_database
+
+STATES = ["GREETING", "KYC_YES", "KYC_NO", "DEPOSIT_YES", "WAITING_FOR_ADMIN"]
+
+def seed(db_file: str, users: int):
+    """Write a users.json with `users` onboarded users"""
+    db = UserDatabase(db_file)
+    for user_id in range(users):
+        db.users[user_id] = UserRecord({
+            'state': random.choice(STATES),
+            'has_kyc': random.choice([True, False, None]),
+            'has_deposit': random.choice([True, False, None]),
+            'username': f"user{user_id}",
+            'name': f"User {user_id}",
+        })
+    db._save_users()
+
+def run(db: UserDatabase, users: int, updates: int) -> float:
+    """Replay the write pattern of /start (info + state) and return seconds taken"""
+    start = time.perf_counter()
+    for _ in range(updates // 2):
+        user_id = random.randrange(users)
+        db.set_user_info(user_id, username=f"user{user_id}", name=f"User {user_id}")
+        db.set_user_state(user_id, random.choice(STATES))
+    db.close()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ("json", "wal", "sqlite"):
+            db_file = os.path.join(tmp, f"{backend}.json")
+            sqlite_file = os.path.join(tmp, f"{backend}.db")
+            seed(db_file, args.users)
+            elapsed = run(open_database(backend, db_file, sqlite_file), args.users, args.updates)
+
+            reload_start = time.perf_counter()
+            db = open_database(backend, db_file, sqlite_file)
+            db.get_pending_users()
+            db.close()
+            reload_time = time.perf_counter() - reload_start
+
+            print(f"{backend:>6}: {args.updates} updates over {args.users} users in {elapsed:.3f}s "
+                  f"({args.updates / elapsed:,.0f} writes/s, {elapsed / args.updates * 1e6:,.0f} us/write), "
+                  f"reload + pending query {reload_time * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
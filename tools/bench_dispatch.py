@@ -0,0 +1,112 @@
+"""Measure what routing a button press costs per update.
+
+Compares the chain of regex CallbackQueryHandlers the bot used to register with the
+flow engine's single dict-lookup router: first the routing decision alone, then a
+whole Application.process_update with no-op handlers, and finally the real handlers
+against a fake Bot API for scale.
+
+Usage: python -m tools.bench_dispatch [--updates N]
+"""
+import argparse
+import asyncio
+import re
+import tempfile
+import time
+
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+
+from tools.bot_env import use_scratch_files
+from tools.fake_bot_api import FakeBotAPI, callback_update
+
+# Callback patterns in the order the handlers used to be registered; the first match wins
+LEGACY_PATTERNS = [
+    "^vip_step", "^kyc_transfer_", "^kyc_complete_", "^kyc_",
+    "^deposit_", "^(approve|reject)_", "^back_to_", "^referral_",
+]
+
+async def noop(update, context):
+    pass
+
+def legacy_route(patterns, data: str):
+    for pattern in patterns:
+        if pattern.match(data):
+            return pattern
+    return None
+
+def bench_router(flow, data_samples, updates: int):
+    patterns = [re.compile(pattern) for pattern in LEGACY_PATTERNS]
+    results = {}
+    for name, route in (("regex chain", lambda data: legacy_route(patterns, data)), ("dict router", flow.route)):
+        started = time.perf_counter()
+        for i in range(updates):
+            route(data_samples[i % len(data_samples)])
+        results[name] = (time.perf_counter() - started) / updates
+    return results
+
+def legacy_application(fake_api: FakeBotAPI) -> Application:
+    application = Application.builder().token("123456:BENCH").request(fake_api).build()
+    application.add_handler(CommandHandler("start", noop))
+    for pattern in LEGACY_PATTERNS[:6]:
+        application.add_handler(CallbackQueryHandler(noop, pattern=pattern))
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, noop))
+    for pattern in LEGACY_PATTERNS[6:]:
+        application.add_handler(CallbackQueryHandler(noop, pattern=pattern))
+    return application
+
+def router_application(fake_api: FakeBotAPI, flow) -> Application:
+    async def route(update, context):
+        flow.route(update.callback_query.data)
+
+    application = Application.builder().token("123456:BENCH").request(fake_api).build()
+    application.add_handler(CommandHandler("start", noop))
+    application.add_handler(CallbackQueryHandler(route))
+    application.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, noop))
+    return application
+
+async def time_updates(application: Application, data_samples, updates: int) -> float:
+    """Seconds per update processed by the application"""
+    await application.initialize()
+    # Every update gets its own update_id and message, so none is dropped as a duplicate
+    samples = [Update.de_json(callback_update(i, 1000 + i % len(data_samples), data_samples[i % len(data_samples)], i),
+                              application.bot)
+               for i in range(1, updates + 1)]
+    started = time.perf_counter()
+    for update in samples:
+        await application.process_update(update)
+    elapsed = time.perf_counter() - started
+    await application.shutdown()
+    return elapsed / updates
+
+async def run(updates: int):
+    import bot
+
+    data_samples = [data for data in bot.CALLBACKS if data not in ('approve', 'reject', 'queue')]
+    print(f"{len(data_samples)} callback routes, {updates} updates each run")
+
+    for name, seconds in bench_router(bot.flow, data_samples, updates * 10).items():
+        print(f"{'routing only':>22} | {name:<11}: {seconds * 1e6:7.2f} us/update")
+
+    fake_api = FakeBotAPI()
+    for name, application in (("regex chain", legacy_application(fake_api)),
+                              ("dict router", router_application(fake_api, bot.flow))):
+        seconds = await time_updates(application, data_samples, updates)
+        print(f"{'process_update, no-op':>22} | {name:<11}: {seconds * 1e6:7.2f} us/update")
+
+    application = bot.build_application("123456:BENCH", request=fake_api)
+    seconds = await time_updates(application, data_samples, updates)
+    print(f"{'process_update, real':>22} | {'dict router':<11}: {seconds * 1e6:7.2f} us/update "
+          f"({fake_api.counts['sendMessage'] + fake_api.counts['sendPhoto']} messages sent)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Measure dispatch, not the wait for Telegram's flood limits
+        use_scratch_files(tmp, OUTBOUND_RATE='1000000', OUTBOUND_CHAT_RATE='1000000')
+        asyncio.run(run(args.updates))
+
+if __name__ == "__main__":
+    main()
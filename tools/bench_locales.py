@@ -0,0 +1,95 @@
+"""Measure what per-user locales cost: loading a locale, compiling its prompts and sending from it.
+
+Writes a locales directory with the shipped locales plus --locales regional variants
+of them (e.g. es-x07, falling back to es), then loads the bot with it. Reports the
+time to load and compile each locale the first time one of its users needs it, the
+memory the compiled locales take, and the time to get a prompt's payload for users
+spread over every locale, next to users of the default locale and to building the
+prompts from the catalog on every send, as a bot without compiled locales would.
+
+Usage: python -m tools.bench_locales [--locales N] [--lookups N]
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from templates import keyboard_json
+from tools.bot_env import use_scratch_files
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'locales')
+
+def write_locales(directory: str, variants: int):
+    """Copy the shipped locales and add regional variants that override a couple of messages"""
+    shipped = sorted(name[:-len('.json')] for name in os.listdir(LOCALES_DIR) if name.endswith('.json'))
+    for code in shipped:
+        shutil.copy(os.path.join(LOCALES_DIR, f"{code}.json"), directory)
+    codes = list(shipped)
+    for number in range(variants):
+        base = shipped[number % len(shipped)]
+        code = f"{base}-x{number:02d}"
+        with open(os.path.join(directory, f"{base}.json"), 'r', encoding='utf-8') as f:
+            messages = json.load(f)['messages']
+        variant = {'messages': {key: f"{messages[key]} ({code})" for key in ('kyc_question', 'deposit_prompt')}}
+        with open(os.path.join(directory, f"{code}.json"), 'w', encoding='utf-8') as f:
+            json.dump(variant, f, ensure_ascii=False)
+        codes.append(code)
+    return codes
+
+def bench(codes, lookups: int):
+    import bot
+
+    logging.getLogger('i18n').setLevel(logging.WARNING)
+    print(f"{len(bot.catalog.available)} locales available, {len(bot.flow.variant_templates)} compiled besides the default at startup")
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for code in codes:
+        bot.flow.templates_of({'locale': code})
+    seconds = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"{'first use':>22}: {seconds / len(codes) * 1e3:7.2f} ms/locale to load and compile, "
+          f"{size / len(codes) / 1024:6.1f} KiB/locale kept")
+
+    users = [{'locale': code} for code in codes]
+    default_users = [{'locale': bot.DEFAULT_LOCALE}] * len(users)
+    names = list(bot.PROMPTS)
+
+    def compiled(user, name):
+        return bot.flow.templates_of(user).payloads[name]
+
+    def built(user, name):
+        prompt = bot.build_prompts(bot.catalog.locale(user['locale']))[name]
+        return keyboard_json(prompt.buttons)
+
+    for label, payload, sample, count in [
+        ("default locale", compiled, default_users, lookups),
+        (f"{len(codes)} locales", compiled, users, lookups),
+        ("built per send", built, users, max(1, lookups // 100)),
+    ]:
+        started = time.perf_counter()
+        for number in range(count):
+            payload(sample[number % len(sample)], names[number % len(names)])
+        seconds = (time.perf_counter() - started) / count
+        print(f"{label:>22}: {seconds * 1e6:9.3f} us/prompt payload")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locales", type=int, default=48, help="regional variants to add to the shipped locales")
+    parser.add_argument("--lookups", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        use_scratch_files(tmp, LOCALES_DIR=os.path.join(tmp, 'locales'))
+        os.mkdir(os.environ['LOCALES_DIR'])
+        codes = write_locales(os.environ['LOCALES_DIR'], args.locales)
+        bench(codes, args.lookups)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compare memory per user of the dict-per-user layout with UserRecord.
+
+Writes a users.json with onboarded users, then loads it as plain dicts keyed by
+string IDs (the layout before UserRecord) and through UserDatabase, and reports the
+memory each keeps allocated per user.
+
+Usage: python -m tools.bench_memory [--users N]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from config import BotStates
+from database import UserDatabase
+
+STATES = [BotStates.GREETING, BotStates.KYC_YES, BotStates.DEPOSIT_YES, BotStates.WAITING_FOR_ADMIN, BotStates.COMPLETED]
+
+def seed(db_file: str, users: int):
+    """Write a users.json with `users` onboarded users"""
+    data = {}
+    for user_id in range(100000000, 100000000 + users):
+        user = {
+            'state': random.choice(STATES),
+            'has_kyc': random.choice([True, False, None]),
+            'has_deposit': random.choice([True, False, None]),
+            'username': f"user{user_id}",
+            'name': f"User {user_id}",
+        }
+        if user['state'] in (BotStates.WAITING_FOR_ADMIN, BotStates.COMPLETED):
+            user['uid_submission'] = f"UID: {user_id * 7}\nUsername: @user{user_id}"
+        data[str(user_id)] = user
+    with open(db_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+def measure(load):
+    """Run `load` and return what it returned, the bytes it left allocated and seconds taken"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, retained, elapsed
+
+def load_dicts(db_file: str):
+    with open(db_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'users.json')
+        seed(db_file, args.users)
+        dicts, dict_bytes, dict_time = measure(lambda: load_dicts(db_file))
+        del dicts
+        db, record_bytes, record_time = measure(lambda: UserDatabase(db_file))
+        db.close()
+
+    print(f"{args.users:,} users")
+    print(f"  dict per user: {dict_bytes / args.users:6.0f} bytes/user, loaded in {dict_time:.2f}s")
+    print(f"  UserRecord:    {record_bytes / args.users:6.0f} bytes/user, loaded in {record_time:.2f}s "
+          f"({1 - record_bytes / dict_bytes:.0%} less memory)")
+
+if __name__ == "__main__":
+    main()
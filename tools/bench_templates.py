@@ -0,0 +1,98 @@
+"""Measure what sending a prompt costs with its keyboard built per send, cached, or compiled.
+
+Sends one step's text and keyboard three ways: building the InlineKeyboardMarkup for
+every send (as the per-step handlers used to), reusing one markup object (as the
+flow engine did before templates were compiled), and passing the keyboard
+pre-serialized by templates.keyboard_json. For each, reports time per send and the
+peak memory allocated while sending, first for encoding the request alone and then
+for a whole send_message against a fake Bot API.
+
+Usage: python -m tools.bench_templates [--sends N]
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.request import RequestData
+from telegram.request._requestparameter import RequestParameter
+
+from templates import keyboard_json
+from tools.fake_bot_api import FakeBotAPI
+
+TEXT = "Have you completed the KYC transfer to our referral?"
+BUTTONS = (
+    (("Yes, I completed the transfer", "kyc_transfer_yes"), ("No, I haven't completed it yet", "kyc_transfer_no")),
+    (("⬅️ Back", "back_to_kyc"),),
+)
+
+def build_markup() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(label, callback_data=data) for label, data in row]
+        for row in BUTTONS
+    ])
+
+def variants():
+    """(name, function returning the reply_markup to send) per approach"""
+    markup = build_markup()
+    compiled = keyboard_json(BUTTONS)
+    return [
+        ("built per send", build_markup),
+        ("cached markup", lambda: markup),
+        ("compiled JSON", lambda: compiled),
+    ]
+
+def encode(reply_markup) -> str:
+    """Serialize a sendMessage request the way the request layer does"""
+    return RequestData([
+        RequestParameter.from_input('chat_id', 1),
+        RequestParameter.from_input('text', TEXT),
+        RequestParameter.from_input('reply_markup', reply_markup),
+    ]).json_parameters
+
+def peak_bytes(run) -> int:
+    """Peak memory allocated while `run` runs once"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    run()
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+def bench_encode(sends: int):
+    for name, reply_markup in variants():
+        started = time.perf_counter()
+        for _ in range(sends):
+            encode(reply_markup())
+        seconds = (time.perf_counter() - started) / sends
+        peak = peak_bytes(lambda: encode(reply_markup()))
+        print(f"{'encode request':>16} | {name:<14}: {seconds * 1e6:7.2f} us/send, {peak:6,} bytes peak")
+
+async def bench_send(sends: int):
+    bot = Bot("123456:BENCH", request=FakeBotAPI())
+    await bot.initialize()
+    for name, reply_markup in variants():
+        started = time.perf_counter()
+        for _ in range(sends):
+            await bot.send_message(chat_id=1, text=TEXT, reply_markup=reply_markup())
+        seconds = (time.perf_counter() - started) / sends
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        await bot.send_message(chat_id=1, text=TEXT, reply_markup=reply_markup())
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        print(f"{'send_message':>16} | {name:<14}: {seconds * 1e6:7.2f} us/send, {peak:6,} bytes peak")
+    await bot.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sends", type=int, default=20000)
+    args = parser.parse_args()
+    bench_encode(args.sends)
+    asyncio.run(bench_send(args.sends))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Measure UID verification against a large referral export.
+
+Writes a referral CSV with --rows accounts (random 8-10 digit UIDs, most with KYC
+and a deposit), as the file-backed stand-in for the exchange API reads it. Reports
+the time to fetch and index it, to save and reload the snapshot cache, the memory
+the index takes next to a dict of tuples, and the time per lookup for UIDs that
+are referrals and UIDs that are not, through the snapshot, the verifier and a dict.
+
+Usage: python -m tools.bench_verifier [--rows N] [--lookups N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from verification import FileReferralSource, ReferralSnapshot, SnapshotVerifier
+
+def write_referrals(path: str, rows: int, seed: int = 0) -> list:
+    """Write a referral export and return its UIDs"""
+    rng = random.Random(seed)
+    uids = rng.sample(range(10_000_000, 10_000_000_000), rows)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("uid,kyc,deposit_usdt\n")
+        for uid in uids:
+            kyc = rng.random() < 0.9
+            deposit = round(rng.expovariate(1 / 500), 2) if rng.random() < 0.8 else 0
+            f.write(f"{uid},{int(kyc)},{deposit}\n")
+    return uids
+
+def timed(label: str, function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    print(f"{label:>24}: {time.perf_counter() - started:8.3f} s")
+    return result
+
+def allocated(function, *args):
+    """Result of `function` and the memory it still holds"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = function(*args)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, size
+
+def per_lookup(label: str, lookup, samples: list, lookups: int):
+    started = time.perf_counter()
+    for number in range(lookups):
+        lookup(samples[number % len(samples)])
+    seconds = (time.perf_counter() - started) / lookups
+    print(f"{label:>24}: {seconds * 1e6:8.3f} us/lookup")
+
+async def per_verify(label: str, verifier: SnapshotVerifier, samples: list, lookups: int):
+    started = time.perf_counter()
+    for number in range(lookups):
+        await verifier.verify(samples[number % len(samples)], number)
+    seconds = (time.perf_counter() - started) / lookups
+    print(f"{label:>24}: {seconds * 1e6:8.3f} us/lookup")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source_file = os.path.join(tmp, 'referrals.csv')
+        cache_file = os.path.join(tmp, 'referrals.snapshot')
+        uids = timed(f"write {args.rows:,} rows", write_referrals, source_file, args.rows)
+        source = FileReferralSource(source_file)
+        rows = timed("fetch (parse CSV)", lambda: list(source.fetch()))
+        snapshot, snapshot_bytes = allocated(ReferralSnapshot.build, rows)
+        timed("index", ReferralSnapshot.build, rows)
+        timed("save cache", snapshot.save, cache_file)
+        timed("load cache", ReferralSnapshot.load, cache_file)
+        table, dict_bytes = allocated(lambda: {uid: (kyc, deposit) for uid, kyc, deposit in rows})
+        del rows
+        print(f"{'index memory':>24}: {snapshot_bytes / 2**20:8.1f} MiB sorted arrays, "
+              f"{dict_bytes / 2**20:.1f} MiB dict of tuples; cache file {os.path.getsize(cache_file) / 2**20:.1f} MiB")
+
+        rng = random.Random(1)
+        hits = rng.sample(uids, min(len(uids), 10000))
+        known = set(uids)
+        misses = [uid for uid in (rng.randrange(10_000_000, 10_000_000_000) for _ in range(10000)) if uid not in known]
+        per_lookup("snapshot, referral", snapshot.lookup, hits, args.lookups)
+        per_lookup("snapshot, unknown UID", snapshot.lookup, misses, args.lookups)
+        per_lookup("dict, referral", table.get, hits, args.lookups)
+
+        verifier = SnapshotVerifier(source, cache_file)
+        verifier.snapshot = snapshot
+        asyncio.run(per_verify("verifier.verify", verifier, [str(uid) for uid in hits], args.lookups))
+        print(f"{'outcomes':>24}: {dict(verifier.stats)}")
+
+if __name__ == "__main__":
+    main()
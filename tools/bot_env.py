@@ -0,0 +1,22 @@
+"""Environment for tools that import the bot, set before the import reads config.py."""
+import os
+
+# Files and directories the bot writes, and their names in a scratch directory
+BOT_FILES = {
+    'DB_FILE': 'users.json',
+    'SQLITE_FILE': 'users.db',
+    'MEDIA_CACHE_FILE': 'media_cache.json',
+    'BROADCAST_DIR': 'broadcasts',
+    'STATE_EVENTS_FILE': 'state_events.log',
+    'REVIEWS_FILE': 'reviews.jsonl',
+    'REFERRAL_CACHE_FILE': 'referrals.snapshot',
+}
+
+def use_scratch_files(directory: str, **variables: str):
+    """Point every file the bot writes into `directory`, away from the real users.json and review queue.
+
+    Keyword arguments set further environment variables, e.g. OUTBOUND_RATE='1000000'.
+    """
+    for variable, name in BOT_FILES.items():
+        os.environ[variable] = os.path.join(directory, name)
+    os.environ.update(variables)
@@ -0,0 +1,205 @@
+"""In-process stand-in for the Telegram Bot API, plus builders for synthetic updates.
+
+Pass a FakeBotAPI as the ``request`` of an Application to run the bot without
+network access. Every call is recorded and answered with a plausible result, after
+an optional latency; a share of calls can be refused with 429 Too Many Requests.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_USER = {
+    'id': 100000,
+    'is_bot': True,
+    'first_name': 'Fake Bot',
+    'username': 'fake_bot',
+    'can_join_groups': True,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+class FakeBotAPI(BaseRequest):
+    """Records Bot API calls and answers them without network access"""
+
+    def __init__(self, latency: float = 0.0, rate_limit_ratio: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        # Share of calls answered with 429 and the retry_after they carry
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.counts: Counter = Counter()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        # Latest message in each chat carrying a button, keyed by (chat_id, callback_data)
+        self.buttons: Dict[Tuple[int, str], int] = {}
+        # Inline keyboard each message carries now, keyed by (chat_id, message_id)
+        self.keyboards: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        # Invite links created, keyed by URL, and users approved or declined per chat
+        self.invite_links: Dict[str, Dict[str, Any]] = {}
+        self._invite_numbers = itertools.count(1)
+        self.join_requests: Dict[str, List[Tuple[int, int]]] = {'approved': [], 'declined': []}
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None,
+                         pool_timeout=None) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params))
+        self.counts[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_limit_ratio and api_method != 'getMe' and self._random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return 429, json.dumps({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }).encode()
+        answer = getattr(self, f"answer_{api_method}", None)
+        result = answer(params) if answer else True
+        return 200, json.dumps({'ok': True, 'result': result}).encode()
+
+    def message(self, params: Dict[str, Any], **fields) -> Dict[str, Any]:
+        """A Message sent by the bot to params['chat_id']"""
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': BOT_USER,
+        }
+        message.update(fields)
+        reply_markup = params.get('reply_markup') or {}
+        if isinstance(reply_markup, str):
+            # Keyboards serialized ahead of time are passed through as JSON
+            reply_markup = json.loads(reply_markup)
+        if reply_markup.get('inline_keyboard'):
+            message['reply_markup'] = reply_markup
+            self.keyboards[chat_id, message['message_id']] = reply_markup
+        else:
+            self.keyboards.pop((chat_id, message['message_id']), None)
+        for row in reply_markup.get('inline_keyboard', []):
+            for button in row:
+                if 'callback_data' in button:
+                    self.buttons[chat_id, button['callback_data']] = message['message_id']
+        return message
+
+    def photo(self) -> List[Dict[str, Any]]:
+        """PhotoSize list for a newly stored photo"""
+        file_number = next(self._file_ids)
+        return [{'file_id': f"fake-photo-{file_number}", 'file_unique_id': f"fake-{file_number}",
+                 'width': 1280, 'height': 720}]
+
+    def answer_getMe(self, params):
+        return BOT_USER
+
+    def answer_sendMessage(self, params):
+        return self.message(params, text=params.get('text', ''))
+
+    def answer_sendPhoto(self, params):
+        return self.message(params, photo=self.photo(), caption=params.get('caption'))
+
+    def answer_sendMediaGroup(self, params):
+        return [self.message(params, photo=self.photo(), caption=item.get('caption'))
+                for item in params.get('media', [])]
+
+    def answer_editMessageText(self, params):
+        return self.message(params, message_id=params.get('message_id'), text=params.get('text', ''))
+
+    def answer_createChatInviteLink(self, params):
+        link = invite_link(f"https://t.me/+fake{next(self._invite_numbers)}", params.get('expire_date'),
+                           bool(params.get('creates_join_request')))
+        self.invite_links[link['invite_link']] = link
+        return link
+
+    def answer_revokeChatInviteLink(self, params):
+        link = self.invite_links[params['invite_link']]
+        link['is_revoked'] = True
+        return link
+
+    def answer_approveChatJoinRequest(self, params):
+        self.join_requests['approved'].append((int(params['chat_id']), int(params['user_id'])))
+        return True
+
+    def answer_declineChatJoinRequest(self, params):
+        self.join_requests['declined'].append((int(params['chat_id']), int(params['user_id'])))
+        return True
+
+def user(user_id: int, username: Optional[str] = None) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}",
+            'username': username or f"user{user_id}", 'language_code': 'en'}
+
+def invite_link(url: str, expire_date: Optional[int] = None, creates_join_request: bool = True) -> Dict[str, Any]:
+    """ChatInviteLink JSON for a link the bot created"""
+    link = {'invite_link': url, 'creator': BOT_USER, 'creates_join_request': creates_join_request,
+            'is_primary': False, 'is_revoked': False}
+    if expire_date is not None:
+        link['expire_date'] = int(expire_date)
+    return link
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Update JSON for a private text message (commands included)"""
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int = 1,
+                    reply_markup: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Update JSON for an inline keyboard button press on a message carrying `reply_markup`"""
+    update = {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': '',
+            },
+        },
+    }
+    if reply_markup is not None:
+        update['callback_query']['message']['reply_markup'] = reply_markup
+    return update
+
+def join_request_update(update_id: int, user_id: int, chat_id: int, link: Optional[str] = None) -> Dict[str, Any]:
+    """Update JSON for a request to join a group, through an invite link if given"""
+    join_request = {
+        'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'Group'},
+        'from': user(user_id),
+        'user_chat_id': user_id,
+        'date': int(time.time()),
+    }
+    if link is not None:
+        join_request['invite_link'] = invite_link(link)
+    return {'update_id': update_id, 'chat_join_request': join_request}
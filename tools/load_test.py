@@ -0,0 +1,234 @@
+"""Replay synthetic user journeys against the bot offline and compare with saved baselines.
+
+The bot runs against FakeBotAPI with optional latency and injected 429s. Simulated
+users take the onboarding journey (start -> referral -> KYC -> deposit -> UID), the
+VIP branch or the /support branch, many at once. The run reports handler latency
+percentiles, updates per second, Bot API calls per journey and user database write
+volume, and exits with status 1 when a metric is worse than the baseline: timings
+and write volume by more than the tolerance, API calls and completed journeys at all.
+Afterwards one user per journey is replayed with synchronous database writes, and
+the run also fails if any update wrote the user database more than once.
+
+Admin notifications are turned off: they are throttled to one message per second
+per admin and would only measure the rate limiter. For the same reason the outbound
+rate limits are raised out of the way; tools.outbound_harness measures them.
+
+Usage: python -m tools.load_test [--users N] [--concurrency N] [--latency SECONDS]
+                                 [--rate-limit-ratio P] [--save-baseline] [--tolerance T]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from telegram import Update
+
+from tools.bot_env import use_scratch_files
+from tools.fake_bot_api import FakeBotAPI, callback_update, message_update
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'load_baseline.json')
+
+# Updates each journey sends, as (kind, payload) pairs; {uid} is filled in per user
+JOURNEYS = {
+    'onboarding': [
+        ('message', '/start'),
+        ('callback', 'referral_yes'),
+        ('callback', 'kyc_complete_yes'),
+        ('callback', 'deposit_yes'),
+        ('message', '{uid}'),
+    ],
+    'vip': [
+        ('message', '/start'),
+        ('callback', 'vip_step1_yes'),
+        ('callback', 'vip_step2_yes'),
+        ('message', 'Binance, VIP 3'),
+    ],
+    'support': [
+        ('message', '/start'),
+        ('message', '/support'),
+        ('message', 'I cannot find my UID'),
+    ],
+}
+# Out of every 10 users, how many take each journey
+JOURNEY_MIX = ['onboarding'] * 8 + ['vip', 'support']
+
+# Metrics compared with the baseline: (higher is better, varies from run to run).
+# Metrics that vary get the --tolerance; the others must not get worse at all.
+METRICS = {
+    'p50_ms': (False, True),
+    'p99_ms': (False, True),
+    'updates_per_second': (True, True),
+    'api_calls_per_journey': (False, False),
+    # New messages; prompts shown by editing the answered message are not counted
+    'messages_per_journey': (False, False),
+    # Background writes are batched by time, so write volume varies a little
+    'db_bytes_per_journey': (False, True),
+    'completed_ratio': (True, False),
+}
+# Bot API methods that put a new message in the chat
+MESSAGE_METHODS = ('sendMessage', 'sendPhoto', 'sendMediaGroup')
+# Allowed regression of metrics that do not vary, to absorb rounding in the baseline file
+STRICT_TOLERANCE = 0.001
+
+def journey_update(application, fake_api: FakeBotAPI, user_id: int, kind: str, payload: str, update_ids) -> Update:
+    """One step of a user's journey as an update"""
+    if kind == 'message':
+        data = message_update(next(update_ids), user_id, payload.format(uid=10000000 + user_id * 7))
+    else:
+        # Press the button on the message that carries it
+        message_id = fake_api.buttons.get((user_id, payload), 1)
+        data = callback_update(next(update_ids), user_id, payload, message_id,
+                               fake_api.keyboards.get((user_id, message_id)))
+    return Update.de_json(data, application.bot)
+
+async def run_journey(application, fake_api: FakeBotAPI, user_id: int, journey: str, update_ids,
+                      latencies: List[float]):
+    """Send one user's updates one after another, timing each"""
+    for kind, payload in JOURNEYS[journey]:
+        update = journey_update(application, fake_api, user_id, kind, payload, update_ids)
+        started = time.perf_counter()
+        await application.process_update(update)
+        latencies.append(time.perf_counter() - started)
+
+async def check_writes_per_update(application, fake_api: FakeBotAPI, db, first_user_id: int, update_ids) -> List[str]:
+    """Replay one user per journey and report each update that wrote the user database more than once.
+
+    The background writer must be stopped, so every change is written as it is made.
+    """
+    problems = []
+    for user_id, journey in enumerate(JOURNEYS, first_user_id):
+        for kind, payload in JOURNEYS[journey]:
+            writes = db.writes
+            await application.process_update(journey_update(application, fake_api, user_id, kind, payload, update_ids))
+            if db.writes - writes > 1:
+                problems.append(f"{journey} journey, {kind} {payload!r}: {db.writes - writes} user database writes")
+    return problems
+
+async def run(users: int, concurrency: int, fake_api: FakeBotAPI) -> Tuple[Dict[str, float], List[str]]:
+    import bot
+
+    # Handler errors (e.g. from injected 429s) are counted instead of logged
+    logging.getLogger('bot').setLevel(logging.CRITICAL)
+    errors: Counter = Counter()
+
+    async def count_error(update, context):
+        errors[type(context.error).__name__] += 1
+
+    application = bot.build_application("123456:LOADTEST", request=fake_api, get_updates_request=fake_api)
+    application.add_error_handler(count_error)
+    await application.initialize()
+    await application.post_init(application)
+
+    latencies: List[float] = []
+    update_ids = itertools.count(1)
+    slots = asyncio.Semaphore(concurrency)
+    journeys = Counter()
+
+    async def simulate(user_id: int):
+        journey = JOURNEY_MIX[user_id % len(JOURNEY_MIX)]
+        journeys[journey] += 1
+        async with slots:
+            await run_journey(application, fake_api, user_id, journey, update_ids, latencies)
+
+    api_calls_before = sum(fake_api.counts.values())
+    messages_before = sum(fake_api.counts[method] for method in MESSAGE_METHODS)
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    api_calls = sum(fake_api.counts.values()) - api_calls_before
+    messages = sum(fake_api.counts[method] for method in MESSAGE_METHODS) - messages_before
+
+    completed = sum(bot.db.get_user(user_id).get('state') == bot.BotStates.COMPLETED
+                    for user_id in range(1, users + 1))
+    # Every change of the run is written once the writer stops; then each update writes on its own
+    await bot.db.stop_writer()
+    db_writes, db_bytes = bot.db.writes, bot.db.bytes_written
+    write_problems = await check_writes_per_update(application, fake_api, bot.db, users + 1, update_ids)
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    print(f"{users} users ({dict(journeys)}), {len(latencies)} updates in {elapsed:.2f}s")
+    print(f"Bot API calls: {dict(fake_api.counts)}, 429s injected: {fake_api.rate_limited}")
+    print(f"Prompts edited in place: {bot.flow.edits} times, {bot.flow.messages_saved} messages not sent")
+    print(f"Handler errors: {dict(errors) or 'none'}")
+    print(f"User database: {db_writes} writes, {db_bytes:,} bytes ({bot.DB_BACKEND} backend)")
+    metrics = {
+        'p50_ms': quantiles[49] * 1000,
+        'p99_ms': quantiles[98] * 1000,
+        'updates_per_second': len(latencies) / elapsed,
+        'api_calls_per_journey': api_calls / users,
+        'messages_per_journey': messages / users,
+        'db_bytes_per_journey': db_bytes / users,
+        'completed_ratio': completed / users,
+    }
+    return metrics, write_problems
+
+def compare(metrics: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> List[str]:
+    """Metrics worse than the baseline by more than the tolerance"""
+    regressions = []
+    for name, (higher_is_better, varies) in METRICS.items():
+        if name not in baseline:
+            continue
+        value, expected = metrics[name], baseline[name]
+        allowed = tolerance if varies else STRICT_TOLERANCE
+        limit = expected * (1 - allowed) if higher_is_better else expected * (1 + allowed)
+        if (value < limit) if higher_is_better else (value > limit):
+            regressions.append(f"{name}: {value:,.2f} vs baseline {expected:,.2f}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200, help="users onboarding at the same time")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds each Bot API call takes")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of Bot API calls answered with 429")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run's metrics as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression of timings and write volume")
+    args = parser.parse_args()
+
+    fake_api = FakeBotAPI(args.latency, args.rate_limit_ratio)
+    with tempfile.TemporaryDirectory() as tmp:
+        use_scratch_files(tmp, ADMIN_TELEGRAM_IDS='', OUTBOUND_RATE='1000000', OUTBOUND_CHAT_RATE='1000000')
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        metrics, write_problems = asyncio.run(run(args.users, args.concurrency, fake_api))
+
+    for name, value in metrics.items():
+        print(f"{name:>22}: {value:,.2f}")
+    if write_problems:
+        print("Updates that wrote the user database more than once:")
+        for problem in write_problems:
+            print(f"  {problem}")
+        sys.exit(1)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({name: round(value, 3) for name, value in metrics.items()}, f, indent=2)
+            f.write('\n')
+        print(f"Baseline saved to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline first")
+        return
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(metrics, baseline, args.tolerance)
+    if regressions:
+        print("Regressions past the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"No regressions past the baseline (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Exercise the outbound scheduler offline under Telegram's real flood limits.
+
+The bot runs against FakeBotAPI with the default outbound limits (OUTBOUND_RATE
+messages per second overall, OUTBOUND_CHAT_RATE per user) and a share of calls
+answered with 429. An admin broadcasts to --recipients users; while it runs,
+--users users arrive one after another and send /start, /support and a support
+request, which also notifies every admin. The harness reports how long each lane's
+messages waited, how long users waited for the bot's replies, and how deep the
+lanes got and how many senders waited for room in them. It exits with status 1
+unless every recipient got the broadcast and every update was handled without error.
+
+With --single-lane broadcasts and admin notifications are queued with the replies
+to users, as without priority lanes, to compare the user-facing latency.
+
+Usage: python -m tools.outbound_harness [--recipients N] [--users N] [--admins N]
+                                        [--queue-size N] [--rate-limit-ratio P] [--single-lane]
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from telegram import Update
+
+from tools.bot_env import use_scratch_files
+from tools.fake_bot_api import FakeBotAPI, message_update
+
+ADMIN_ID = 900001
+FIRST_USER_ID = 100001
+JOURNEY = ['/start', '/support', 'I cannot find my UID']
+
+def percentiles(label: str, values: List[float], unit: str = "s"):
+    if len(values) < 2:
+        print(f"{label:>22}: {len(values)} samples")
+        return
+    quantiles = statistics.quantiles(values, n=100, method='inclusive')
+    print(f"{label:>22}: p50 {quantiles[49]:7.3f} {unit}, p99 {quantiles[98]:7.3f} {unit}, "
+          f"max {max(values):7.3f} {unit} ({len(values)} samples)")
+
+async def run(recipients: int, users: int, arrival: float, fake_api: FakeBotAPI,
+              single_lane: bool) -> bool:
+    import bot
+    from outbound import INTERACTIVE, Lane
+
+    errors = []
+
+    async def record_error(update, context):
+        errors.append(context.error)
+
+    waits: Dict[str, List[float]] = defaultdict(list)
+    bot.outbound.observe = lambda lane, seconds: waits[lane].append(seconds)
+    if single_lane:
+        bot.broadcaster.limiter = bot.broadcasts.limiter = bot.reviews.limiter = Lane(INTERACTIVE)
+
+    application = bot.build_application("123456:OUTBOUND", request=fake_api, get_updates_request=fake_api)
+    application.add_error_handler(record_error)
+    await application.initialize()
+    await application.post_init(application)
+    # Admin notifications are sent in tasks the running application awaits
+    await application.start()
+    for user_id in range(1, recipients + 1):
+        bot.db.set_user_state(user_id, bot.BotStates.COMPLETED)
+    update_ids = itertools.count(1)
+
+    async def send(user_id: int, text: str) -> float:
+        update = Update.de_json(message_update(next(update_ids), user_id, text), application.bot)
+        started = time.perf_counter()
+        await application.process_update(update)
+        return time.perf_counter() - started
+
+    peaks = {'depth': defaultdict(int), 'blocked': defaultdict(int)}
+
+    async def sample():
+        while True:
+            for lane in bot.outbound.queues:
+                peaks['depth'][lane] = max(peaks['depth'][lane], bot.outbound.depth[lane])
+                peaks['blocked'][lane] = max(peaks['blocked'][lane], bot.outbound.blocked[lane])
+            await asyncio.sleep(0.05)
+
+    replies: List[float] = []
+
+    async def journey(user_id: int):
+        for text in JOURNEY:
+            replies.append(await send(user_id, text))
+
+    sampler = asyncio.create_task(sample())
+    started = time.perf_counter()
+    await send(ADMIN_ID, "/broadcast state=COMPLETED Weekly signals are live!")
+    journeys = []
+    for number in range(users):
+        journeys.append(asyncio.create_task(journey(FIRST_USER_ID + number)))
+        await asyncio.sleep(arrival)
+    await asyncio.gather(*journeys)
+    users_done = time.perf_counter() - started
+    while bot.broadcasts.tasks:
+        await asyncio.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    job = next(iter(bot.broadcasts.jobs.values()))
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+    print(f"{'lanes':>22}: {'one shared lane' if single_lane else 'interactive > admin > bulk'}, "
+          f"{bot.OUTBOUND_RATE:g} msg/s overall, {bot.OUTBOUND_CHAT_RATE:g} msg/s per user")
+    print(f"{'broadcast':>22}: {job['counts']} in {elapsed:.1f}s ({job['counts'].get('sent', 0) / elapsed:.1f} msg/s); "
+          f"users done after {users_done:.1f}s")
+    print(f"{'Bot API calls':>22}: {dict(fake_api.counts)}, 429s injected: {fake_api.rate_limited}, "
+          f"retried: {dict(bot.outbound.retries)}")
+    for lane, values in waits.items():
+        percentiles(f"{lane} wait", values)
+    percentiles("replies to users", replies)
+    print(f"{'peak depth':>22}: {dict(peaks['depth'])}; senders waiting for room: {dict(peaks['blocked'])}")
+
+    problems = []
+    if job['counts'].get('sent', 0) != recipients:
+        problems.append(f"broadcast reached {job['counts'].get('sent', 0)} of {recipients} recipients")
+    if errors:
+        problems.append(f"{len(errors)} handler errors, e.g. {errors[0]!r}")
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return not problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=600, help="users the broadcast goes to")
+    parser.add_argument("--users", type=int, default=40, help="users asking for support during the broadcast")
+    parser.add_argument("--admins", type=int, default=2, help="admins notified of each support request")
+    parser.add_argument("--arrival", type=float, default=0.25, help="seconds between users arriving")
+    parser.add_argument("--queue-size", type=int, default=50, help="OUTBOUND_QUEUE_SIZE, requests each lane holds")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each Bot API call takes")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.02, help="share of Bot API calls answered with 429")
+    parser.add_argument("--single-lane", action="store_true", help="queue every message in one lane")
+    args = parser.parse_args()
+
+    fake_api = FakeBotAPI(args.latency, args.rate_limit_ratio)
+    with tempfile.TemporaryDirectory() as tmp:
+        use_scratch_files(tmp, ADMIN_TELEGRAM_IDS=','.join(str(ADMIN_ID + number) for number in range(args.admins)),
+                          OUTBOUND_QUEUE_SIZE=str(args.queue_size))
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        logging.getLogger('outbound').setLevel(logging.ERROR)
+        ok = asyncio.run(run(args.recipients, args.users, args.arrival, fake_api, args.single_lane))
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Exercise webhook mode locally by POSTing synthetic updates to the embedded server.
+
+The bot runs against FakeBotAPI, so no Telegram token or network access is needed.
+Each simulated user walks start -> referral -> KYC -> deposit -> UID submission.
+Users' updates arrive interleaved and each user's next update is posted before the
+previous one is processed, so a user that does not end where their journey leads
+(COMPLETED, waiting for an admin) means updates were processed out of order; the
+harness then exits with status 1.
+
+With --workers N, updates are sharded by user between N applications in this
+process, as the front process shards them between worker processes, and users are
+kept in an in-process shared store (DB_BACKEND=store, STORE_URL=memory://).
+
+With --verifier, the UIDs of even-numbered users are in a referral export
+(REFERRAL_SOURCE_FILE), so those users are approved on the spot and end up
+APPROVED while the others wait for an admin. Either way every user must be counted
+in the funnel's last step.
+
+Usage: python -m tools.webhook_harness [--users N] [--latency SECONDS] [--workers N] [--verifier]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import List
+
+import httpx
+
+from tools.bot_env import use_scratch_files
+from tools.fake_bot_api import FakeBotAPI, callback_update, message_update
+
+SECRET = "harness-secret"
+PATH = "/telegram"
+
+def submitted_uid(user_id: int) -> int:
+    return 10000000 + user_id * 7
+
+def journey(user_id: int):
+    """Updates one user sends while onboarding, as (kind, payload) pairs"""
+    return [
+        ('message', '/start'),
+        ('callback', 'referral_yes'),
+        ('callback', 'kyc_complete_yes'),
+        ('callback', 'deposit_yes'),
+        ('message', f"{submitted_uid(user_id)}"),
+    ]
+
+def expected_state(user_id: int, verifier: bool) -> str:
+    """Where a user's journey ends: approved by the UID check, or waiting for an admin"""
+    return 'APPROVED' if verifier and user_id % 2 == 0 else 'COMPLETED'
+
+def write_referrals(path: str, users: int):
+    """A referral export vouching for the UIDs of even-numbered users"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("uid,kyc,deposit_usdt\n")
+        for user_id in range(2, users + 1, 2):
+            f.write(f"{submitted_uid(user_id)},1,100\n")
+
+async def post_journey(client: httpx.AsyncClient, url: str, user_id: int, update_ids, statuses: Counter):
+    for kind, payload in journey(user_id):
+        update_id = next(update_ids)
+        if kind == 'message':
+            update = message_update(update_id, user_id, payload)
+        else:
+            update = callback_update(update_id, user_id, payload)
+        response = await client.post(url, json=update, headers={'X-Telegram-Bot-Api-Secret-Token': SECRET})
+        statuses[response.status_code] += 1
+
+async def run(users: int, latency: float, workers: int, verifier: bool) -> List[str]:
+    """Post every user's journey and return what went wrong"""
+    import bot
+    from sharding import ShardRouter, application_target
+    from webhook import WebhookServer, allowed_updates_for
+
+    fake_api = FakeBotAPI(latency)
+    applications = [bot.build_application("123456:HARNESS", request=fake_api, get_updates_request=fake_api)
+                    for _ in range(workers)]
+    application = applications[0]
+    print(f"allowed_updates: {allowed_updates_for(application)}")
+
+    for worker in applications:
+        await worker.initialize()
+    # The applications share the bot module's database and services, which post_init starts once
+    await application.post_init(application)
+    while verifier and bot.verifier.snapshot is None:
+        # The referral export is read in the background
+        await asyncio.sleep(0.05)
+    router = ShardRouter([application_target(worker) for worker in applications], bot.shard_user_id)
+    server = WebhookServer(application, PATH, SECRET, dispatch=router.dispatch if workers > 1 else None)
+    await server.start("127.0.0.1", 0)
+    for worker in applications:
+        await worker.start()
+    url = f"http://127.0.0.1:{server.port}{PATH}"
+
+    statuses: Counter = Counter()
+    update_ids = iter(range(1, 10 ** 9))
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=40)) as client:
+        rejected = await client.post(url, json=message_update(0, 1, '/start'),
+                                     headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+        print(f"wrong secret -> HTTP {rejected.status_code}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            post_journey(client, url, user_id, update_ids, statuses) for user_id in range(1, users + 1)
+        ))
+        accepted = time.perf_counter() - started
+        for worker in applications:
+            await worker.update_queue.join()
+        processed = time.perf_counter() - started
+
+    total = sum(statuses.values())
+    print(f"HTTP statuses: {dict(statuses)}")
+    print(f"{total} updates accepted in {accepted:.2f}s, processed in {processed:.2f}s "
+          f"({total / processed:,.0f} updates/s)")
+    print(f"Bot API calls: {dict(fake_api.counts)}")
+    if workers > 1:
+        print(f"Updates routed to each worker: {router.routed}")
+    final_states = Counter(bot.db.get_user(user_id).get('state') for user_id in range(1, users + 1))
+    print(f"Final states: {dict(final_states)}")
+    completed = bot.analytics.funnel()[-1]['reached']
+    print(f"Funnel: {completed} of {users} users reached the last step")
+
+    await server.stop()
+    for worker in applications:
+        await worker.stop()
+        await worker.shutdown()
+    await application.post_shutdown(application)
+    problems = []
+    if final_states != Counter(expected_state(user_id, verifier) for user_id in range(1, users + 1)):
+        problems.append("Some users did not end where their journey leads: updates were processed out of order")
+    if completed != users:
+        problems.append(f"{users - completed} users are missing from the funnel's last step")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each Bot API call takes")
+    parser.add_argument("--workers", type=int, default=1, help="applications to shard updates between")
+    parser.add_argument("--verifier", action="store_true", help="approve even-numbered users' UIDs on the spot")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault('ADMIN_TELEGRAM_IDS', '900001')
+        # Simulated users answer instantly; Telegram's per-chat limit would only slow them down
+        use_scratch_files(tmp, OUTBOUND_RATE='1000000', OUTBOUND_CHAT_RATE='1000000')
+        if args.verifier:
+            os.environ['REFERRAL_SOURCE_FILE'] = os.path.join(tmp, 'referrals.csv')
+            write_referrals(os.environ['REFERRAL_SOURCE_FILE'], args.users)
+        if args.workers > 1:
+            os.environ['DB_BACKEND'] = 'store'
+            os.environ['STORE_URL'] = 'memory://'
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        problems = asyncio.run(run(args.users, args.latency, args.workers, args.verifier))
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
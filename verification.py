@@ -0,0 +1,241 @@
+import abc
+import array
+import asyncio
+import bisect
+import csv
+import logging
+import os
+import re
+import struct
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# One referred account: (UID, has KYC, deposited USDT)
+ReferralRow = Tuple[int, bool, float]
+
+UID_PATTERN = re.compile(r'(?:uid\s*[:#]?\s*)?(\d{6,15})', re.IGNORECASE)
+
+def parse_uid(text: str) -> Optional[str]:
+    """The numeric UID in a user's reply, e.g. '12345678' or 'UID: 12345678'; None if there is none"""
+    match = UID_PATTERN.fullmatch(text.strip())
+    return match.group(1) if match else None
+
+@dataclass(frozen=True)
+class Verification:
+    """Outcome of checking a UID: approved without an admin or not, and why"""
+    approved: bool
+    reason: str
+
+class UidVerifier(abc.ABC):
+    """Checks submitted UIDs so clear cases are approved without waiting for an admin.
+
+    Subclasses implement ``verify``; ``start`` and ``stop`` run with the bot, for
+    verifiers that keep their data fresh in the background.
+    """
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abc.abstractmethod
+    async def verify(self, uid: str, user_id: int) -> Verification:
+        """Check a UID the Telegram user `user_id` submitted"""
+
+class UidClaims:
+    """The Telegram user each submitted UID belongs to: the first to submit it.
+
+    Kept in a shared store, so every worker process sees the same claims. A UID
+    only vouches for its first user, so one leaked UID cannot admit other accounts.
+    """
+
+    namespace = 'uid_claims'
+
+    def __init__(self, store):
+        self.store = store
+
+    def claim(self, uid: str, user_id: int) -> int:
+        """Claim a UID for a user unless someone else has; returns the user it belongs to"""
+        if self.store.add(self.namespace, uid, user_id):
+            return user_id
+        return self.store.get(self.namespace, uid)
+
+    def restore(self, submissions: Iterable[Tuple[str, int]]):
+        """Claim UIDs from earlier (uid, user_id) submissions, oldest first, e.g. into a store that starts empty"""
+        for uid, user_id in submissions:
+            self.store.add(self.namespace, uid, user_id)
+
+class FileReferralSource:
+    """Stand-in for the exchange's referral API: reads our referrals from an exported CSV file.
+
+    The file has a header and the columns ``uid``, ``kyc`` (1/0 or true/false) and
+    ``deposit_usdt``, one row per referred account. A client of the real API would
+    implement the same ``fetch``; it runs in a worker thread.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def fetch(self) -> Iterator[ReferralRow]:
+        with open(self.path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header != ['uid', 'kyc', 'deposit_usdt']:
+                raise ValueError(f"{self.path}: expected the columns uid,kyc,deposit_usdt, got {header}")
+            for uid, kyc, deposit in reader:
+                yield int(uid), kyc.lower() in ('1', 'true', 'yes'), float(deposit or 0)
+
+class ReferralSnapshot:
+    """Referral records indexed by UID in sorted arrays and found by binary search.
+
+    Three parallel arrays (UIDs ascending, deposits, KYC flags) take 17 bytes per
+    account where a dict of tuples takes well over a hundred, and finding a UID
+    among a million accounts is twenty comparisons. The cache file is the raw
+    arrays behind a short header, so loading it is a copy rather than a parse.
+    """
+
+    MAGIC = b'REFSNAP1'
+    HEADER = struct.Struct('<8sQd')
+
+    def __init__(self, uids: array.array, deposits: array.array, kyc: array.array, fetched_at: float):
+        self.uids = uids
+        self.deposits = deposits
+        self.kyc = kyc
+        self.fetched_at = fetched_at
+
+    def __len__(self) -> int:
+        return len(self.uids)
+
+    @classmethod
+    def build(cls, rows: Iterable[ReferralRow], fetched_at: Optional[float] = None) -> 'ReferralSnapshot':
+        """Index rows by UID; when a UID repeats, its last row wins"""
+        records = {}
+        for uid, kyc, deposit in rows:
+            records[uid] = (kyc, deposit)
+        uids = array.array('Q', sorted(records))
+        deposits = array.array('d', (records[uid][1] for uid in uids))
+        kyc = array.array('B', (records[uid][0] for uid in uids))
+        return cls(uids, deposits, kyc, fetched_at if fetched_at is not None else time.time())
+
+    def lookup(self, uid: int) -> Optional[Tuple[bool, float]]:
+        """(has KYC, deposited USDT) of a UID, or None if it is not one of our referrals"""
+        index = bisect.bisect_left(self.uids, uid)
+        if index == len(self.uids) or self.uids[index] != uid:
+            return None
+        return bool(self.kyc[index]), self.deposits[index]
+
+    def save(self, path: str):
+        """Write the snapshot to a cache file, replacing it atomically"""
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, len(self.uids), self.fetched_at))
+            self.uids.tofile(f)
+            self.deposits.tofile(f)
+            self.kyc.tofile(f)
+        os.replace(tmp_file, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'ReferralSnapshot':
+        with open(path, 'rb') as f:
+            magic, count, fetched_at = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            if magic != cls.MAGIC:
+                raise ValueError(f"{path} is not a referral snapshot")
+            arrays = []
+            for typecode in ('Q', 'd', 'B'):
+                values = array.array(typecode)
+                values.fromfile(f, count)
+                arrays.append(values)
+        return cls(*arrays, fetched_at)
+
+class SnapshotVerifier(UidVerifier):
+    """Approves UIDs of our referrals that have KYC and a deposit, using a local snapshot.
+
+    The snapshot is refetched from ``source`` every ``refresh_interval`` seconds in
+    a worker thread and swapped in whole, so a check is one in-memory lookup and
+    never waits on the exchange. Each snapshot is saved to ``cache_file``, and on
+    startup the cached one is used until the first refresh finishes. Anything short
+    of a clear match (unknown UID, no KYC, no deposit or less than ``min_deposit``
+    USDT, no snapshot yet) goes to the admins with the reason. With ``claims``, a
+    UID is only approved for the user who submitted it first.
+    """
+
+    def __init__(self, source, cache_file: str, refresh_interval: float = 900, min_deposit: float = 0,
+                 claims: Optional[UidClaims] = None):
+        self.source = source
+        self.claims = claims
+        self.cache_file = cache_file
+        self.refresh_interval = refresh_interval
+        self.min_deposit = min_deposit
+        self.snapshot: Optional[ReferralSnapshot] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        # Checks by outcome: 'approved' or 'review'
+        self.stats: Counter = Counter()
+
+    async def start(self):
+        if os.path.exists(self.cache_file):
+            try:
+                self.snapshot = await asyncio.to_thread(ReferralSnapshot.load, self.cache_file)
+                logger.info(f"Loaded {len(self.snapshot)} cached referrals from {self.cache_file}")
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Could not load referral cache {self.cache_file}: {e}")
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    def _fetch(self) -> ReferralSnapshot:
+        snapshot = ReferralSnapshot.build(self.source.fetch())
+        snapshot.save(self.cache_file)
+        return snapshot
+
+    async def refresh(self):
+        """Fetch the referrals again and swap the new snapshot in"""
+        started = time.monotonic()
+        self.snapshot = await asyncio.to_thread(self._fetch)
+        logger.info(f"Refreshed {len(self.snapshot)} referrals in {time.monotonic() - started:.1f}s")
+
+    async def _refresh_loop(self):
+        while True:
+            age = time.time() - self.snapshot.fetched_at if self.snapshot else self.refresh_interval
+            if age < self.refresh_interval:
+                await asyncio.sleep(self.refresh_interval - age)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Could not refresh referrals, keeping the previous snapshot: {e}")
+                await asyncio.sleep(min(60, self.refresh_interval))
+
+    def check(self, uid: int) -> Verification:
+        snapshot = self.snapshot
+        if snapshot is None:
+            return Verification(False, "referral records not loaded yet")
+        record = snapshot.lookup(uid)
+        if record is None:
+            return Verification(False, f"not among our {len(snapshot)} referrals "
+                                       f"(records from {time.strftime('%Y-%m-%d %H:%M', time.localtime(snapshot.fetched_at))})")
+        kyc, deposit = record
+        if not kyc:
+            return Verification(False, "referral without KYC")
+        if deposit <= 0 or deposit < self.min_deposit:
+            return Verification(False, f"referral with KYC but {deposit:g} USDT deposited")
+        return Verification(True, f"referral with KYC and {deposit:g} USDT deposited")
+
+    async def verify(self, uid: str, user_id: int) -> Verification:
+        verification = self.check(int(uid))
+        if self.claims is not None:
+            owner = await asyncio.to_thread(self.claims.claim, uid, user_id)
+            if owner != user_id:
+                verification = Verification(False, f"UID already used by {owner}")
+        self.stats['approved' if verification.approved else 'review'] += 1
+        return verification
@@ -0,0 +1,194 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, ChatJoinRequestHandler, CommandHandler, MessageHandler
+
+logger = logging.getLogger(__name__)
+
+# Update types each handler class consumes
+HANDLER_UPDATE_TYPES = (
+    (CommandHandler, Update.MESSAGE),
+    (MessageHandler, Update.MESSAGE),
+    (CallbackQueryHandler, Update.CALLBACK_QUERY),
+    (ChatJoinRequestHandler, Update.CHAT_JOIN_REQUEST),
+)
+
+def allowed_updates_for(application: Application) -> List[str]:
+    """The update types the application's handlers consume, so Telegram does not send the rest"""
+    allowed = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            for handler_class, update_type in HANDLER_UPDATE_TYPES:
+                if isinstance(handler, handler_class):
+                    allowed.add(update_type)
+    return sorted(allowed)
+
+class WebhookServer:
+    """Minimal asyncio HTTP server that receives Telegram webhook POSTs.
+
+    Requests must carry the secret token registered with setWebhook in the
+    ``X-Telegram-Bot-Api-Secret-Token`` header. Each connection is served by its own
+    task and updates go straight onto the application's update queue, so many
+    updates are accepted at once and the application processes them. If
+    ``dispatch`` is given, each update's JSON is passed to it instead (e.g. to hand
+    it to another process) and ``application`` may be None.
+    """
+
+    max_body_size = 1024 * 1024
+    max_header_lines = 100
+
+    def __init__(self, application: Optional[Application], path: str, secret_token: str,
+                 dispatch: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        self.application = application
+        self.path = path
+        self.secret_token = secret_token
+        self.dispatch = dispatch or self._enqueue
+        self.server: Optional[asyncio.Server] = None
+        self._connections: Set[asyncio.StreamWriter] = set()
+
+    @property
+    def port(self) -> int:
+        """Port the server listens on (useful when started on port 0)"""
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str, port: int):
+        """Start accepting connections"""
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Webhook server listening on {host}:{self.port}{self.path}")
+
+    async def stop(self):
+        """Stop accepting connections and close open ones"""
+        if self.server is not None:
+            self.server.close()
+            # Idle keep-alive connections would otherwise stay open indefinitely
+            for writer in list(self._connections):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            # Telegram keeps connections alive, so serve requests until the client closes
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logger.error(f"Webhook connection failed: {e}")
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, request_line: bytes, reader: asyncio.StreamReader,
+                              writer: asyncio.StreamWriter) -> bool:
+        """Serve one request and return whether the connection stays open"""
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            self._respond(writer, 400, "Bad Request", False)
+            return False
+
+        headers = {}
+        for _ in range(self.max_header_lines):
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            self._respond(writer, 400, "Bad Request", False)
+            return False
+        if length > self.max_body_size:
+            self._respond(writer, 413, "Payload Too Large", False)
+            return False
+        body = await reader.readexactly(length) if length else b''
+
+        if target.split('?', 1)[0] != self.path:
+            self._respond(writer, 404, "Not Found", keep_alive)
+        elif method != 'POST':
+            self._respond(writer, 405, "Method Not Allowed", keep_alive)
+        elif not hmac.compare_digest(headers.get('x-telegram-bot-api-secret-token', ''), self.secret_token):
+            logger.warning("Rejected webhook request with a missing or wrong secret token")
+            self._respond(writer, 403, "Forbidden", keep_alive)
+        else:
+            try:
+                data = json.loads(body)
+                if not isinstance(data, dict):
+                    raise TypeError("update is not a JSON object")
+                await self.dispatch(data)
+            except (ValueError, TypeError, KeyError) as e:
+                logger.warning(f"Rejected malformed webhook update: {e}")
+                self._respond(writer, 400, "Bad Request", keep_alive)
+            else:
+                self._respond(writer, 200, "OK", keep_alive)
+        return keep_alive
+
+    async def _enqueue(self, data: Dict[str, Any]):
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: int, reason: str, keep_alive: bool):
+        writer.write(
+            f"HTTP/1.1 {status} {reason}\r\n"
+            f"Content-Length: 0\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1')
+        )
+
+def stop_on_signals() -> asyncio.Event:
+    """An event that is set on SIGINT/SIGTERM"""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Signal handlers are not available on Windows event loops
+            pass
+    return stop_event
+
+async def run_webhook(application: Application, url: str, listen: str, port: int, path: str,
+                      secret_token: str, allowed_updates: List[str], max_connections: int = 40):
+    """Run the application on webhook updates until SIGINT/SIGTERM.
+
+    Mirrors Application.run_polling: post_init, post_stop and post_shutdown
+    callbacks run at the same points.
+    """
+    stop_event = stop_on_signals()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    server = WebhookServer(application, path, secret_token)
+    await server.start(listen, port)
+    await application.start()
+    await application.bot.set_webhook(
+        url=url,
+        secret_token=secret_token,
+        allowed_updates=allowed_updates,
+        max_connections=max_connections
+    )
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)